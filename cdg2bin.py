@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 
 import cdgtools
+import cdgstats
 import os
 import os.path
 import sys
@@ -184,7 +185,16 @@ def decode_file(file):
             # too much to implement it.
             show_warning(NOTSUPPORTED, file)
             return False
-        if not os.system(decode):
+        # The decoder runs as a child process, so its CPU time is the
+        # change in the children's CPU time
+        start = cdgstats.Start()
+        children = os.times()
+        status = os.system(decode)
+        wall = cdgstats.Start()[0] - start[0]
+        cpu = sum(os.times()[2:4]) - sum(children[2:4])
+        if not status:
+            cdgstats.Add('decode', wall, cpu, os.path.getsize(file),
+                         os.path.getsize(outfile))
             return outfile
 
     return False
@@ -220,6 +230,7 @@ def produce_bin(raw, cdg, binfile, rawbin=0):
 
     Raw BIN image writing is not yet implemented."""
 
+    start = cdgstats.Start()
     rawaudio = open(raw, 'rb')
     rawcdg = open(cdg, 'rb')
 
@@ -251,6 +262,7 @@ def produce_bin(raw, cdg, binfile, rawbin=0):
 
     rawaudio.close()
     rawcdg.close()
+    cdgstats.Stop(start, 'produce_bin', bytes, bytes, frames)
     return (frames, bytes)
 
 
@@ -321,93 +333,116 @@ parser.add_option('-r', '--raw', dest='raw', action='store_true',
 parser.add_option('-b', '--byte-swap', dest='byteswap', action='store_true',
                   help='Swap byte order while processing audio.',
                   default=False)
+parser.add_option('--stats', dest='stats', action='store_true',
+                  help='Show timing and throughput statistics for decoding and interleaving each track',
+                  default=False)
+parser.add_option('--stats-json', dest='statsjson', type='string', metavar='FILE',
+                  help='Save the timing and throughput statistics to FILE as a JSON report',
+                  default=None)
 
-(options, args) = parser.parse_args()
+def main():
+    global options
 
-if not len(args):
-    parser.print_help()
-    print '\nERROR: at least one file must be specified.'
-    sys.exit(2)
+    (options, args) = parser.parse_args()
 
-# We always start at Track 1
-track = 1
+    if not len(args):
+        parser.print_help()
+        print '\nERROR: at least one file must be specified.'
+        sys.exit(2)
 
-# Create an empty cue sheet
-toc = ''
-index = ''
+    # We always start at Track 1
+    track = 1
 
-# Nothing's written yet
-bytes = 0
-offset = 0
-totframes = 0
+    # Create an empty cue sheet
+    toc = ''
+    index = ''
 
-if not options.split:
-    # We're writing a single BIN image, so we just open it once and
-    # keep writing to it.
-    bin = open(options.output + '.bin', 'wb')
+    # Nothing's written yet
+    bytes = 0
+    offset = 0
+    totframes = 0
 
-for file in args:
-    print 'Processing %s' % file
+    if not options.split:
+        # We're writing a single BIN image, so we just open it once and
+        # keep writing to it.
+        bin = open(options.output + '.bin', 'wb')
 
-    # Find a matching pair and decode the audio
-    compaudio = ''
+    cdgstats.Reset()
 
-    if archivetype(file):
-        # Extract the archive first
-        (cdg, compaudio) = extractarchive(file)
-        audio = decode_file(compaudio)
-        purge_all = 1
-    else:
-        (cdg, audio) = fetchpair(file)
-        purge_all = 0
-
-    if cdg and audio:
-        if options.split:
-            # We're writing multiple BIN images, so we have to
-            # create a new BIN image file here first
-            bin = open(options.output + '-%02d.bin' % track, 'wb')
-
-        # Encode the CDG and audio data
-        (frames, bytes) = produce_bin(audio, cdg, bin, options.raw)
-
-        # We created the raw audio file, but now we're done with it
-        os.unlink(audio)
-        if purge_all:
-            # Also clean up extracted archive files if we were given any
-            os.unlink(cdg)
-            os.unlink(compaudio)
-
-        # Add to the cue sheet
-        toc += tocblock(bin.name, track, offset, frames, options.raw)
-        offset += bytes
-        totframes += frames
-
-        if options.split:
-            # We're writing multiple BIN images, so we have to
-            # close the current one before moving on to the next.
-            bin.close()
-            offset = 0
-
-        # Write the index entry for this track.
-        index += '%s-%02d: %s\n' % (options.output, track, file)
-        track += 1
-    else:
-        print 'Warning, couldn\'t process %s. NOT adding to image.' % file
+    for file in args:
+        print 'Processing %s' % file
+        cdgstats.SetTrack(os.path.basename(file))
+
+        # Find a matching pair and decode the audio
+        compaudio = ''
+
+        if archivetype(file):
+            # Extract the archive first
+            (cdg, compaudio) = extractarchive(file)
+            audio = decode_file(compaudio)
+            purge_all = 1
+        else:
+            (cdg, audio) = fetchpair(file)
+            purge_all = 0
+
+        if cdg and audio:
+            if options.split:
+                # We're writing multiple BIN images, so we have to
+                # create a new BIN image file here first
+                bin = open(options.output + '-%02d.bin' % track, 'wb')
+
+            # Encode the CDG and audio data
+            (frames, bytes) = produce_bin(audio, cdg, bin, options.raw)
+
+            # We created the raw audio file, but now we're done with it
+            os.unlink(audio)
+            if purge_all:
+                # Also clean up extracted archive files if we were given any
+                os.unlink(cdg)
+                os.unlink(compaudio)
+
+            # Add to the cue sheet
+            toc += tocblock(bin.name, track, offset, frames, options.raw)
+            offset += bytes
+            totframes += frames
+
+            if options.split:
+                # We're writing multiple BIN images, so we have to
+                # close the current one before moving on to the next.
+                bin.close()
+                offset = 0
+
+            # Write the index entry for this track.
+            index += '%s-%02d: %s\n' % (options.output, track, file)
+            track += 1
+        else:
+            print 'Warning, couldn\'t process %s. NOT adding to image.' % file
+
+    if not options.split:
+        bin.close()
+
+    # Write the finished cue sheet
+    tocfile = open(options.output + '.toc', 'w')
+    tocfile.write(toc)
+    tocfile.close()
+
+    # Write the finished index file
+    indexfile = open(options.output + '.txt', 'w')
+    indexfile.write(index)
+    indexfile.close()
 
-if not options.split:
-    bin.close()
+    time = calctime(totframes)
 
-# Write the finished cue sheet
-tocfile = open(options.output + '.toc', 'w')
-tocfile.write(toc)
-tocfile.close()
+    print 'Processing complete. Added %d tracks.' % (track - 1)
+    print 'Finished CD length is %s.' % time
 
-# Write the finished index file
-indexfile = open(options.output + '.txt', 'w')
-indexfile.write(index)
-indexfile.close()
+    if options.stats:
+        cdgstats.Summary()
+    if options.statsjson:
+        cdgstats.WriteReport(options.statsjson, 'cdg2bin',
+                             {'output': options.output, 'tracks': track - 1})
+        print 'Statistics saved to %s.' % options.statsjson
 
-time = calctime(totframes)
 
-print 'Processing complete. Added %d tracks.' % (track - 1)
-print 'Finished CD length is %s.' % time
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,338 @@
+#!/usr/bin/python
+
+# cdg2png - cdgtools: CDG to PNG or RGB video frames
+
+# Copyright (C) 2009  Kelvin Lawson (kelvinl@users.sf.net)
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+
+# OVERVIEW
+#
+# cdg2png is part of the cdgtools suite of CD+G karaoke software.
+#
+# It exports the CD+G screen of a .cdg file as a sequence of video
+# frames, at whatever frame rate you like: either one PNG image per
+# frame, or one file of raw RGB frames (3 bytes per pixel) which can be
+# fed straight to a video encoder.
+#
+# The track is split into segments, each starting at one of the screen
+# snapshots of the file (see cdgsnap.py), so that each segment can be
+# rendered on its own from its snapshot. The segments are rendered by a
+# pool of processes (one per CPU by default), and the frames written
+# out in order as each segment is finished.
+#
+# Frames where the screen hasn't changed since the previous frame (as
+# on a static page of lyrics) are not converted or encoded again: the
+# previous frame's image is written out once more instead.
+#
+# The PNG images are written with only the standard library (zlib).
+
+
+# REQUIREMENTS
+#
+# cdg2png requires the following to be installed on your system:
+# . Python (www.python.org)
+
+
+# USAGE INSTRUCTIONS
+#
+# To export a CDG as PNG images at 30 frames per second, pass the CDG
+# filename/path on the command line:
+#       python cdg2png.py theboxer.cdg
+#
+# This writes theboxer-000000.png, theboxer-000001.png etc. To choose
+# the frame rate and output directory, and show only the screen inside
+# the border:
+#       python cdg2png.py --fps 25 --outdir frames --crop theboxer.cdg
+#
+# To write the raw RGB frames to theboxer.rgb instead, e.g. to make a
+# video with ffmpeg:
+#       python cdg2png.py --format rgb theboxer.cdg
+#       ffmpeg -f rawvideo -pix_fmt rgb24 -s 300x216 -r 30 -i theboxer.rgb theboxer.mp4
+#
+# Run "python cdg2png.py --help" for the full list of options.
+
+
+import sys, os, getopt, time, struct, zlib, multiprocessing
+import cdgpacks, cdgrender, cdgsnap, cdgindex
+
+
+# Default frame rate
+DEFAULT_FPS = 30
+
+# Number of segments to split the track into per process, so that the
+# processes are kept busy even if some segments take longer than others
+SEGMENTS_PER_JOB = 4
+
+# Output formats
+FORMAT_PNG = "png"
+FORMAT_RGB = "rgb"
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+# Make one PNG chunk
+def _PngChunk (chunktype, data):
+	crc = zlib.crc32 (chunktype + data) & 0xFFFFFFFF
+	return (struct.pack (">I", len(data)) + chunktype + data + struct.pack (">I", crc))
+
+# Encode an RGB image (3 bytes per pixel, one row after another) as a PNG
+def EncodePng (width, height, rgb):
+	header = struct.pack (">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+	# Every row has filter type 0 (none)
+	stride = width * 3
+	rows = b"".join ([b"\x00" + rgb[y * stride:(y + 1) * stride] for y in range (height)])
+	return (_PNG_SIGNATURE + _PngChunk (b"IHDR", header) +
+			_PngChunk (b"IDAT", zlib.compress (rows, 6)) + _PngChunk (b"IEND", b""))
+
+
+# Get the packet position of each frame: the screen shown by a frame is
+# the screen with every packet before its time played
+def FramePositions (count, fps):
+	frames = []
+	frame = 0
+	while True:
+		position = cdgindex.TimeToPack (float (frame) / fps)
+		if position >= count:
+			break
+		frames.append (position)
+		frame = frame + 1
+	return (frames)
+
+
+# Split the frames into about segments segments, each starting at the
+# first frame after a snapshot. Returns a list of (first frame, snapshot
+# or None) for each segment.
+def SplitFrames (frames, snapshots, segments):
+	starts = [(0, None)]
+	for snapshot in snapshots.snapshots:
+		first = _FirstFrame (frames, snapshot.position)
+		if first >= len(frames):
+			break
+		if first == starts[-1][0]:
+			starts[-1] = (first, snapshot)
+		else:
+			starts.append ((first, snapshot))
+
+	# Choose the starts closest to evenly spaced frames
+	if len(starts) <= segments:
+		return (starts)
+	chosen = [starts[0]]
+	i = 0
+	for segment in range (1, segments):
+		target = (segment * len(frames)) // segments
+		while (i + 1 < len(starts)) and (starts[i + 1][0] <= target):
+			i = i + 1
+		if starts[i][0] > chosen[-1][0]:
+			chosen.append (starts[i])
+	return (chosen)
+
+# Find the first frame at or after a packet position
+def _FirstFrame (frames, position):
+	lo, hi = 0, len(frames)
+	while lo < hi:
+		mid = (lo + hi) // 2
+		if frames[mid] < position:
+			lo = mid + 1
+		else:
+			hi = mid
+	return (lo)
+
+
+# Render one segment. Called in a pool process, with the snapshot (if
+# any) the segment starts from, the packet position of that snapshot,
+# the .cdg data from there to the segment's last frame, the positions
+# of the segment's frames, the output format and the part of the screen
+# to output. Returns the image of each frame, or None for a frame which
+# is the same as the one before it in the segment.
+def RenderSegment (args):
+	snapshot, start, cdgdata, frames, format, rect = args
+	renderer = cdgrender.CdgRenderer()
+	if snapshot != None:
+		renderer.Restore (snapshot.State())
+	packs = cdgpacks.CdgPacks (cdgdata)
+	commands = packs.Commands()
+	width = rect[2] - rect[0]
+	height = rect[3] - rect[1]
+
+	images = []
+	played = 0
+	previous = None
+	for position in frames:
+		renderer.Play (packs, played, position - start, commands)
+		played = position - start
+		dirty = renderer.TakeDirty()
+		if dirty == None:
+			images.append (None)
+			continue
+		# Something was drawn, but the screen may have ended up the same
+		# (e.g. a tile XORed twice)
+		screen = renderer.Indexes (rect) + bytes (renderer.palette)
+		if screen == previous:
+			images.append (None)
+			continue
+		previous = screen
+		rgb = renderer.RGB (rect)
+		if format == FORMAT_PNG:
+			images.append (EncodePng (width, height, rgb))
+		else:
+			images.append (rgb)
+	return (images)
+
+
+# Export a .cdg file as frames. Returns the number of frames, and the
+# number of them which were encoded (rather than repeated).
+def cdg2png (cdgfilename, outdir=None, fps=DEFAULT_FPS, format=FORMAT_PNG, crop=False,
+			 jobs=None, interval=cdgsnap.SNAPSHOT_INTERVAL):
+	if jobs == None:
+		jobs = multiprocessing.cpu_count()
+	rect = cdgrender.FULL_SCREEN
+	if crop:
+		rect = cdgrender.VISIBLE_SCREEN
+	base = os.path.splitext (os.path.basename (cdgfilename))[0]
+	if outdir == None:
+		outdir = os.path.dirname (cdgfilename)
+	elif not os.path.isdir (outdir):
+		os.makedirs (outdir)
+
+	cdgfile = open (cdgfilename, "rb")
+	try:
+		cdgdata = cdgfile.read()
+	finally:
+		cdgfile.close()
+	snapshots = cdgsnap.CdgSnapshots (cdgfilename, interval)
+	frames = FramePositions (len(cdgdata) // cdgpacks.PACK_SIZE, fps)
+	starts = SplitFrames (frames, snapshots, jobs * SEGMENTS_PER_JOB)
+
+	# The arguments of each segment. A file too short for a single frame
+	# has one empty segment, which is left out.
+	segments = []
+	for i in range (len(starts)):
+		first, snapshot = starts[i]
+		if i + 1 < len(starts):
+			last = starts[i + 1][0]
+		else:
+			last = len(frames)
+		if first == last:
+			continue
+		start = 0
+		if snapshot != None:
+			start = snapshot.position
+		end = frames[last - 1]
+		segments.append ((snapshot, start, cdgdata[start * cdgpacks.PACK_SIZE:end * cdgpacks.PACK_SIZE],
+						  frames[first:last], format, rect))
+
+	pool = None
+	if jobs > 1:
+		pool = multiprocessing.Pool (jobs)
+		results = pool.imap (RenderSegment, segments)
+	else:
+		results = (RenderSegment (segment) for segment in segments)
+
+	rgbfile = None
+	if format == FORMAT_RGB:
+		rgbfile = open (os.path.join (outdir, base + ".rgb"), "wb")
+	try:
+		frame = 0
+		encoded = 0
+		image = None
+		for images in results:
+			for segmentImage in images:
+				if segmentImage != None:
+					image = segmentImage
+					encoded = encoded + 1
+				if rgbfile != None:
+					rgbfile.write (image)
+				else:
+					pngfile = open (os.path.join (outdir, "%s-%06d.png" % (base, frame)), "wb")
+					try:
+						pngfile.write (image)
+					finally:
+						pngfile.close()
+				frame = frame + 1
+	finally:
+		if rgbfile != None:
+			rgbfile.close()
+		if pool != None:
+			pool.terminate()
+	return (frame, encoded)
+
+
+# Print out some instructions on error
+def usage():
+	print ("Usage:  %s [options] <CDG filename> [<CDG filename> ...]" % os.path.basename (sys.argv[0]))
+	print ("")
+	print ("Options:")
+	print ("  -h, --help                :    Print this help message")
+	print ("  --fps N                   :    Frames per second (default %d)" % DEFAULT_FPS)
+	print ("  --format png|rgb          :    Write a PNG image per frame (default),")
+	print ("                                 or one file of raw RGB frames")
+	print ("  --outdir DIR              :    Write the frames to DIR (default the")
+	print ("                                 .cdg file's directory)")
+	print ("  --crop                    :    Leave out the border")
+	print ("  -j, --jobs N              :    Render with N processes (default one")
+	print ("                                 per CPU)")
+
+
+# Can be called from the command line with the CDG filepaths as parameters
+def main():
+	try:
+		opts, args = getopt.getopt (sys.argv[1:], "hj:", ["help", "fps=", "format=", "outdir=",
+															 "crop", "jobs="])
+	except getopt.GetoptError:
+		usage()
+		sys.exit(2)
+	if len(args) == 0:
+		usage()
+		sys.exit(2)
+
+	fps = DEFAULT_FPS
+	format = FORMAT_PNG
+	outdir = None
+	crop = False
+	jobs = None
+	try:
+		for opt, arg in opts:
+			if opt in ("-h", "--help"):
+				usage()
+				sys.exit(2)
+			if opt == "--fps":
+				fps = float (arg)
+			if opt == "--format":
+				if arg not in (FORMAT_PNG, FORMAT_RGB):
+					raise ValueError
+				format = arg
+			if opt == "--outdir":
+				outdir = arg
+			if opt == "--crop":
+				crop = True
+			if opt in ("-j", "--jobs"):
+				jobs = int (arg)
+	except ValueError:
+		usage()
+		sys.exit(2)
+	if (fps <= 0) or ((jobs != None) and (jobs < 1)):
+		usage()
+		sys.exit(2)
+
+	for cdgfilename in args:
+		start = time.time()
+		frames, encoded = cdg2png (cdgfilename, outdir, fps, format, crop, jobs)
+		print ("-> %s: %d frames (%d encoded) in %.1f seconds"
+				% (cdgfilename, frames, encoded, time.time() - start))
+
+if __name__ == "__main__":
+	sys.exit(main())
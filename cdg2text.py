@@ -23,6 +23,9 @@
 #
 # cdg2text is a debugging tool for converting your binary .cdg files to
 # a textual representation.
+#
+# The whole .cdg file is decoded in one go by cdgpacks, and only the
+# CD+G graphics packets are then visited one by one to be printed.
 
 
 # REQUIREMENTS
@@ -39,34 +42,54 @@
 # You can pipe the output from cdg2text to a text file if you wish to save
 # the results:
 #       python cdg2text.py theboxer.cdg > theboxer.txt
+#
+# To see just part of the file, give the start and/or end time (in
+# seconds, or minutes:seconds), and optionally which instruction codes
+# to show. e.g. for the colour table loads between 1:00 and 1:30:
+#       python cdg2text.py --start 1:00 --end 1:30 --inst 30,31 theboxer.cdg
+#
+# Each instruction is then shown with its time and byte offset. This
+# uses an index of the file (see cdgindex.py), which is saved next to
+# the .cdg file (theboxer.cdgidx) the first time, so that later queries
+# don't need to decode the whole file again.
+#
+# To see what is on the screen at a given time instead, as one hex
+# digit (the colour index) per pixel, with the colour table:
+#       python cdg2text.py --screen 2:45 theboxer.cdg
+#
+# This uses snapshots of the screen (see cdgsnap.py), saved next to the
+# .cdg file (theboxer.cdgsnap), so only the last few seconds before the
+# requested time are played.
+#
+# To check a whole library of .cdg files, give --stats and any number
+# of files and directories (which are searched for .cdg files):
+#       python cdg2text.py --stats --jobs 4 /karaoke
+#
+# Rather than the instructions, this prints one report for all of the
+# files: how many of each instruction there are, unknown instructions,
+# malformed packets (tiles off the screen and invalid scrolls),
+# truncated files, colour table loads and changes, and how often each
+# tile of the screen is drawn. Each file's counts are worked out over
+# whole columns of packets at once (see cdgpacks.py), and the files are
+# shared out between the given number of processes.
 
 
-import struct, sys, os
-
-
-# CDG Command Code
-CDG_COMMAND 				= 0x09
-
-# CDG Instruction Codes
-CDG_INST_MEMORY_PRESET		= 1
-CDG_INST_BORDER_PRESET		= 2
-CDG_INST_TILE_BLOCK			= 6
-CDG_INST_SCROLL_PRESET		= 20
-CDG_INST_SCROLL_COPY		= 24
-CDG_INST_DEF_TRANSP_COL		= 28
-CDG_INST_LOAD_COL_TBL_0_7	= 30
-CDG_INST_LOAD_COL_TBL_8_15	= 31
-CDG_INST_TILE_BLOCK_XOR		= 38
-
-# Bitmask for all CDG fields
-CDG_MASK 					= 0x3F
+import sys, os, re, getopt, json, multiprocessing
+import cdgpacks, cdgindex, cdgrender, cdgsnap
 
 
 # cdgPlayer Class
 class cdgPlayer:
-	# Initialise the player instace
-	def __init__(self, cdgFileName):
+	# Initialise the player instace. If a start or end time (in seconds)
+	# or a list of instruction codes is given, only the instructions
+	# which match are shown, found using the file's index. If a screen
+	# time (in seconds) is given, the screen at that time is shown instead.
+	def __init__(self, cdgFileName, start=None, end=None, instructions=None, screen=None):
 		self.FileName = cdgFileName
+		self.start = start
+		self.end = end
+		self.instructions = instructions
+		self.screen = screen
 
 		# Check the CDG file exists
 		if not os.path.isfile(self.FileName):
@@ -80,87 +103,105 @@ class cdgPlayer:
 
 	def decode(self):
 
-		# Open the cdg file
-		self.cdgFile = open (self.FileName, "rb") 
-
-		# Main processing loop
-		while 1:
-			packd = self.cdgGetNextPacket()
-			if (packd):
-				self.cdgPacketProcess (packd)
-			else:
-				self.cdgFile.close()
-				return
-
-	# Decode the CDG commands read from the CDG file
-	def cdgPacketProcess (self, packd):
-		if (packd['command'] & CDG_MASK) == CDG_COMMAND:
-			inst_code = (packd['instruction'] & CDG_MASK)
-			if inst_code == CDG_INST_MEMORY_PRESET:
-				self.cdgMemoryPreset (packd)
-			elif inst_code == CDG_INST_BORDER_PRESET:
-				self.cdgBorderPreset (packd)
-			elif inst_code == CDG_INST_TILE_BLOCK:
-				self.cdgTileBlockCommon (packd, xor = 0)
-			elif inst_code == CDG_INST_SCROLL_PRESET:
-				self.cdgScrollPreset (packd)
-			elif inst_code == CDG_INST_SCROLL_COPY:
-				self.cdgScrollCopy (packd)
-			elif inst_code == CDG_INST_DEF_TRANSP_COL:
-				self.cdgDefineTransparentColour (packd)
-			elif inst_code == CDG_INST_LOAD_COL_TBL_0_7:
-				self.cdgLoadColourTableCommon (packd, 0)
-			elif inst_code == CDG_INST_LOAD_COL_TBL_8_15:
-				self.cdgLoadColourTableCommon (packd, 1)
-			elif inst_code == CDG_INST_TILE_BLOCK_XOR:
-				self.cdgTileBlockCommon (packd, xor = 1)
-			else:
-				ErrorString = "Unknown command in CDG file: " + str(inst_code)
-				print (ErrorString)
-
-	# Read the next CDG command from the file (24 bytes each)
-	def cdgGetNextPacket (self):
-		packd={}
-		packet = self.cdgFile.read(24)
-		if (len(packet) == 24):
-			packd['command']=struct.unpack('B', packet[0])[0]
-			packd['instruction']=struct.unpack('B', packet[1])[0]
-			packd['parityQ']=struct.unpack('2B', packet[2:4])[0:2]
-			packd['data']=struct.unpack('16B', packet[4:20])[0:16]
-			packd['parity']=struct.unpack('4B', packet[20:24])[0:4]
-			return packd
-		elif (len(packet) > 0):
+		if self.screen != None:
+			self.showScreen()
+			return
+
+		if (self.start != None) or (self.end != None) or (self.instructions != None):
+			self.query()
+			return
+
+		# Decode the whole cdg file at once
+		packs = cdgpacks.LoadFile (self.FileName)
+
+		# Main processing loop, over the CD+G graphics packets only
+		for index in packs.Commands():
+			self.cdgPacketProcess (packs.kind[index], packs.Data (index), packs.instruction[index])
+		if packs.trailing > 0:
 			print ("Didnt read 24 bytes")
-			return None
+
+	# Show only the matching instructions, with their time and offset
+	def query(self):
+		kinds = None
+		if self.instructions != None:
+			kinds = [inst for inst in self.instructions if inst in cdgpacks.CDG_INSTRUCTIONS]
+			if len(kinds) < len(self.instructions):
+				kinds.append (cdgpacks.CDG_INST_UNKNOWN)
+		index = cdgindex.CdgIndex (self.FileName)
+		try:
+			for pack in index.Query (self.start, self.end, kinds):
+				instruction = pack.Instruction()
+				if (self.instructions != None) and (instruction not in self.instructions):
+					continue
+				print ("%s (offset %d):" % (cdgindex.FormatTime (pack.time), pack.offset))
+				self.cdgPacketProcess (pack.kind, pack.Data(), instruction)
+		finally:
+			index.close()
+
+	# Show the screen at the screen time, found using the file's snapshots
+	def showScreen(self):
+		renderer = cdgsnap.CdgSnapshots (self.FileName).Seek (self.screen)
+		print ("Screen at %s:" % cdgindex.FormatTime (self.screen))
+		for i in range(16):
+			red, green, blue = renderer.palette[3 * i:(3 * i) + 3]
+			print ("  Colour %d = 0x%X" % (i, ((red // 17) << 8) | ((green // 17) << 4) | (blue // 17)))
+		print ("  Border=%d, Transparent=%s, hOffset=%d, vOffset=%d"
+				% (renderer.border, renderer.transparent, renderer.hOffset, renderer.vOffset))
+		indexes = renderer.Indexes().translate (_hexDigits)
+		for y in range(cdgrender.HEIGHT):
+			print (indexes[y * cdgrender.WIDTH:(y + 1) * cdgrender.WIDTH])
+
+	# Decode a CDG command from the CDG file
+	def cdgPacketProcess (self, inst_code, data_block, instruction):
+		if inst_code == cdgpacks.CDG_INST_MEMORY_PRESET:
+			self.cdgMemoryPreset (data_block)
+		elif inst_code == cdgpacks.CDG_INST_BORDER_PRESET:
+			self.cdgBorderPreset (data_block)
+		elif inst_code == cdgpacks.CDG_INST_TILE_BLOCK:
+			self.cdgTileBlockCommon (data_block, xor = 0)
+		elif inst_code == cdgpacks.CDG_INST_SCROLL_PRESET:
+			self.cdgScrollPreset (data_block)
+		elif inst_code == cdgpacks.CDG_INST_SCROLL_COPY:
+			self.cdgScrollCopy (data_block)
+		elif inst_code == cdgpacks.CDG_INST_DEF_TRANSP_COL:
+			self.cdgDefineTransparentColour (data_block)
+		elif inst_code == cdgpacks.CDG_INST_LOAD_COL_TBL_0_7:
+			self.cdgLoadColourTableCommon (data_block, 0)
+		elif inst_code == cdgpacks.CDG_INST_LOAD_COL_TBL_8_15:
+			self.cdgLoadColourTableCommon (data_block, 1)
+		elif inst_code == cdgpacks.CDG_INST_TILE_BLOCK_XOR:
+			self.cdgTileBlockCommon (data_block, xor = 1)
+		else:
+			ErrorString = "Unknown command in CDG file: " + str(instruction)
+			print (ErrorString)
 
 	# Set the preset colour
-	def cdgMemoryPreset (self, packd):
-		colour = packd['data'][0] & 0x0F
-		repeat = packd['data'][1] & 0x0F
+	def cdgMemoryPreset (self, data_block):
+		colour = data_block[0] & 0x0F
+		repeat = data_block[1] & 0x0F
 		print ("cdgMemoryPreset [Colour=%d, Repeat=%d]" % (colour, repeat))
 		return
 
 	# Set the border colour
-	def cdgBorderPreset (self, packd):
-		colour = packd['data'][0] & 0x0F
+	def cdgBorderPreset (self, data_block):
+		colour = data_block[0] & 0x0F
 		print ("cdgMemoryPreset [Colour=%d]" % colour)
 		return
 
 	# CDG Scroll Command - Set the scrolled in area with a fresh colour
-	def cdgScrollPreset (self, packd):
-		self.cdgScrollCommon (packd, copy = False)
+	def cdgScrollPreset (self, data_block):
+		self.cdgScrollCommon (data_block, copy = False)
 		return
 
 	# CDG Scroll Command - Wrap the scrolled out area into the opposite side
-	def cdgScrollCopy (self, packd):
-		self.cdgScrollCommon (packd, copy = True)
+	def cdgScrollCopy (self, data_block):
+		self.cdgScrollCommon (data_block, copy = True)
 		return
 
 	# Common function to handle the actual pixel scroll for Copy and Preset
-	def cdgScrollCommon (self, packd, copy):
+	def cdgScrollCommon (self, data_block, copy):
 
 		# Decode the scroll command parameters
-		data_block = packd['data']
 		colour = data_block[0] & 0x0F
 		hScroll = data_block[1] & 0x3F
 		vScroll = data_block[2] & 0x3F
@@ -178,9 +219,8 @@ class cdgPlayer:
 		return
 	
 	# Set the colours for a 12x6 tile. The main CDG command for display data
-	def cdgTileBlockCommon (self, packd, xor):
+	def cdgTileBlockCommon (self, data_block, xor):
 		# Decode the command parameters
-		data_block = packd['data']
 		colour0 = data_block[0] & 0x0F
 		colour1 = data_block[1] & 0x0F
 		column_index = ((data_block[2] & 0x1F) * 12)
@@ -196,14 +236,13 @@ class cdgPlayer:
 		return
 
 	# Set one of the colour indeces as transparent.
-	def cdgDefineTransparentColour (self, packd):
-		data_block = packd['data']
+	def cdgDefineTransparentColour (self, data_block):
 		colour = data_block[0] & 0x0F
 		print ("cdgDefineTransparentColour [Colour=%d]" % colour)
 		return
 
 	# Load the RGB value for colours 0..7 or 8..15 in the lookup table
-	def cdgLoadColourTableCommon (self, packd, table):
+	def cdgLoadColourTableCommon (self, data_block, table):
 		if table == 0:
 			colourTableStart = 0
 			print ("cdgLoadColourTable0..7")
@@ -211,23 +250,234 @@ class cdgPlayer:
 			colourTableStart = 8
 			print ("cdgLoadColourTable8..15")
 		for i in range(8):
-			colourEntry = ((packd['data'][2 * i] & CDG_MASK) << 8)
-			colourEntry = colourEntry + (packd['data'][(2 * i) + 1] & CDG_MASK)
+			colourEntry = ((data_block[2 * i] & cdgpacks.CDG_MASK) << 8)
+			colourEntry = colourEntry + (data_block[(2 * i) + 1] & cdgpacks.CDG_MASK)
 			colourEntry = ((colourEntry & 0x3F00) >> 2) | (colourEntry & 0x003F)
 			print ("  Colour %d = 0x%X" % ((i + colourTableStart), colourEntry))
 		return
 
+# Translate tables to mask tile rows and columns as cdgrender does, for
+# the checks of malformed packets, and to swap 0 and 0xFF flags
+_tileRowMask = bytes (bytearray ([byte & cdgrender.TILE_ROW_MASK for byte in range (256)]))
+_tileColumnMask = bytes (bytearray ([byte & cdgrender.TILE_COLUMN_MASK for byte in range (256)]))
+_badRow = cdgpacks.FlagTable (lambda row: row >= cdgrender.TILE_ROWS)
+_badColumn = cdgpacks.FlagTable (lambda column: column >= cdgrender.TILE_COLUMNS)
+_badScroll = cdgpacks.FlagTable (lambda scroll: (scroll & 0x30) == 0x30)
+_invert = bytes (bytearray ([byte ^ 0xFF for byte in range (256)]))
+
+# Characters for the tile heatmap, from no writes to the most
+_heatChars = " .:-=+*#%@"
+
+# Make an empty set of statistics
+def NewStats ():
+	return ({"files": 0, "packs": 0, "trailing_bytes": 0, "truncated_files": 0,
+			 "kinds": dict ([(cdgpacks.KIND_NAMES[kind], 0) for kind in cdgpacks.KIND_NAMES]),
+			 "malformed": 0, "colour_loads": 0, "colour_changes": 0,
+			 "heatmap": [[0] * cdgrender.TILE_COLUMNS for row in range (cdgrender.TILE_ROWS)],
+			 "problems": []})
+
+# Work out the statistics of one .cdg file
+def FileStats (cdgfilename):
+	stats = NewStats()
+	stats["files"] = 1
+	try:
+		packs = cdgpacks.LoadFile (cdgfilename)
+	except IOError:
+		stats["problems"].append ([cdgfilename, "unreadable"])
+		return (stats)
+	stats["packs"] = packs.count
+	stats["trailing_bytes"] = packs.trailing
+	if packs.trailing > 0:
+		stats["truncated_files"] = 1
+	for kind, name in cdgpacks.KIND_NAMES.items():
+		stats["kinds"][name] = packs.Count (kind)
+
+	# Tiles off the screen, and scrolls with an invalid command
+	rows = bytes (packs.data[2]).translate (_tileRowMask)
+	columns = bytes (packs.data[3]).translate (_tileColumnMask)
+	tiles = packs.Flags ((cdgpacks.CDG_INST_TILE_BLOCK, cdgpacks.CDG_INST_TILE_BLOCK_XOR))
+	badTiles = cdgpacks.AndBytes (tiles, cdgpacks.OrBytes (rows.translate (_badRow),
+														   columns.translate (_badColumn)))
+	scrolls = packs.Flags ((cdgpacks.CDG_INST_SCROLL_PRESET, cdgpacks.CDG_INST_SCROLL_COPY))
+	badScrolls = cdgpacks.AndBytes (scrolls, cdgpacks.OrBytes (bytes (packs.data[1]).translate (_badScroll),
+															   bytes (packs.data[2]).translate (_badScroll)))
+	stats["malformed"] = badTiles.count (b"\xff") + badScrolls.count (b"\xff")
+
+	# The row and column of every good tile, by setting every other packet
+	# to 0xFF and removing them
+	others = cdgpacks.OrBytes (tiles.translate (_invert), badTiles)
+	tileRows = cdgpacks.OrBytes (rows, others).replace (b"\xff", b"")
+	tileColumns = cdgpacks.OrBytes (columns, others).replace (b"\xff", b"")
+	for row in range (cdgrender.TILE_ROWS):
+		if tileRows.count (bytearray ([row])) == 0:
+			continue
+		otherRows = tileRows.translate (cdgpacks.FlagTable (lambda tileRow: tileRow != row))
+		rowColumns = cdgpacks.OrBytes (tileColumns, otherRows)
+		for column in range (cdgrender.TILE_COLUMNS):
+			stats["heatmap"][row][column] = rowColumns.count (bytearray ([column]))
+
+	# Colour table loads, and those which change the table
+	kinds = bytes (packs.kind)
+	for kind in (cdgpacks.CDG_INST_LOAD_COL_TBL_0_7, cdgpacks.CDG_INST_LOAD_COL_TBL_8_15):
+		previous = None
+		for match in re.finditer (re.escape (bytes (bytearray ([kind]))), kinds):
+			data = packs.Data (match.start())
+			stats["colour_loads"] = stats["colour_loads"] + 1
+			if data != previous:
+				stats["colour_changes"] = stats["colour_changes"] + 1
+			previous = data
+
+	problems = []
+	for count, text in ((stats["kinds"]["Unknown"], "unknown instructions"),
+						(stats["malformed"], "malformed packets"),
+						(stats["trailing_bytes"], "trailing bytes")):
+		if count > 0:
+			problems.append ("%d %s" % (count, text))
+	if problems:
+		stats["problems"].append ([cdgfilename, ", ".join (problems)])
+	return (stats)
+
+# Add one set of statistics to another
+def AddStats (total, stats):
+	for key in ("files", "packs", "trailing_bytes", "truncated_files", "malformed",
+				"colour_loads", "colour_changes"):
+		total[key] = total[key] + stats[key]
+	for name, count in stats["kinds"].items():
+		total["kinds"][name] = total["kinds"][name] + count
+	for row in range (cdgrender.TILE_ROWS):
+		for column in range (cdgrender.TILE_COLUMNS):
+			total["heatmap"][row][column] = total["heatmap"][row][column] + stats["heatmap"][row][column]
+	total["problems"].extend (stats["problems"])
+
+# Find the .cdg files among a list of files and directories
+def FindCdgFiles (paths):
+	cdgfilenames = []
+	for path in paths:
+		if not os.path.isdir (path):
+			cdgfilenames.append (path)
+			continue
+		for dirpath, dirnames, filenames in os.walk (path):
+			dirnames.sort()
+			for filename in sorted (filenames):
+				if filename.lower().endswith (".cdg"):
+					cdgfilenames.append (os.path.join (dirpath, filename))
+	return (cdgfilenames)
+
+# Work out the statistics of many .cdg files, using jobs processes
+def CorpusStats (cdgfilenames, jobs=1):
+	total = NewStats()
+	if (jobs > 1) and (len(cdgfilenames) > 1):
+		pool = multiprocessing.Pool (jobs)
+		try:
+			for stats in pool.imap_unordered (FileStats, cdgfilenames, 4):
+				AddStats (total, stats)
+		finally:
+			pool.terminate()
+	else:
+		for cdgfilename in cdgfilenames:
+			AddStats (total, FileStats (cdgfilename))
+	total["problems"].sort()
+	return (total)
+
+# Print a statistics report
+def PrintStats (stats):
+	print ("Files: %d (%d truncated)" % (stats["files"], stats["truncated_files"]))
+	print ("Packets: %d (%s)" % (stats["packs"], cdgindex.FormatTime (float (stats["packs"]) / cdgpacks.PACKS_PER_SECOND)))
+	print ("Instructions:")
+	for kind in (cdgpacks.CDG_KIND_NONE,) + cdgpacks.CDG_INSTRUCTIONS + (cdgpacks.CDG_INST_UNKNOWN,):
+		count = stats["kinds"][cdgpacks.KIND_NAMES[kind]]
+		print ("  %-26s %10d  (%5.1f%%)" % (cdgpacks.KIND_NAMES[kind], count,
+											100.0 * count / max (stats["packs"], 1)))
+	print ("Malformed packets: %d" % stats["malformed"])
+	print ("Trailing bytes: %d" % stats["trailing_bytes"])
+	print ("Colour table loads: %d (%d changes)" % (stats["colour_loads"], stats["colour_changes"]))
+	busiest = max ([max (row) for row in stats["heatmap"]])
+	print ("Tile writes (busiest tile %d):" % busiest)
+	for row in stats["heatmap"]:
+		line = ""
+		for count in row:
+			level = 0
+			if count > 0:
+				level = 1 + (((count * (len(_heatChars) - 1)) - 1) // busiest)
+			line = line + _heatChars[level]
+		print ("  |%s|" % line)
+	if stats["problems"]:
+		print ("Problems:")
+		for cdgfilename, text in stats["problems"]:
+			print ("  %s: %s" % (cdgfilename, text))
+
+# Translate table from colour index to hex digit
+_hexDigits = bytes (bytearray ([ord ("0123456789ABCDEF"[byte & 0x0F]) for byte in range (256)]))
+
+# Parse a time given as seconds or minutes:seconds
+def ParseTime (text):
+	minutes, sep, seconds = text.rpartition (":")
+	return ((float (minutes or 0) * 60) + float (seconds))
+
 # Print out some instructions on error
 def usage():
-    print "Usage:  %s <CDG filename>" % os.path.basename(sys.argv[0])
+    print "Usage:  %s [--start TIME] [--end TIME] [--inst CODE[,CODE...]] <CDG filename>" \
+          % os.path.basename(sys.argv[0])
+    print "        %s --screen TIME <CDG filename>" % os.path.basename(sys.argv[0])
+    print "        %s --stats [--jobs N] [--stats-json FILE] <CDG filename or directory> ..." \
+          % os.path.basename(sys.argv[0])
 
 # Can be called from the command line with the CDG filepath as parameter
 def main():
-	args = sys.argv[1:]
-	if (len(sys.argv) != 2) or ("-h" in args) or ("--help" in args):
+	try:
+		opts, args = getopt.getopt (sys.argv[1:], "h", ["help", "start=", "end=", "inst=", "screen=",
+													  "stats", "jobs=", "stats-json="])
+	except getopt.GetoptError:
+		usage()
+		sys.exit(2)
+	start = None
+	end = None
+	instructions = None
+	screen = None
+	stats = False
+	jobs = multiprocessing.cpu_count()
+	statsJson = None
+	try:
+		for opt, arg in opts:
+			if opt in ("-h", "--help"):
+				usage()
+				sys.exit(2)
+			if opt == "--start":
+				start = ParseTime (arg)
+			if opt == "--end":
+				end = ParseTime (arg)
+			if opt == "--inst":
+				instructions = [int (code) for code in arg.split (",")]
+			if opt == "--screen":
+				screen = ParseTime (arg)
+			if opt == "--stats":
+				stats = True
+			if opt == "--jobs":
+				jobs = max (int (arg), 1)
+			if opt == "--stats-json":
+				statsJson = arg
+	except ValueError:
+		usage()
+		sys.exit(2)
+
+	if stats:
+		if len(args) == 0:
+			usage()
+			sys.exit(2)
+		report = CorpusStats (FindCdgFiles (args), jobs)
+		PrintStats (report)
+		if statsJson != None:
+			jsonfile = open (statsJson, "w")
+			try:
+				json.dump (report, jsonfile, indent = 1, sort_keys = True)
+			finally:
+				jsonfile.close()
+		return
+
+	if len(args) != 1:
 		usage()
 		sys.exit(2)
-	player = cdgPlayer(sys.argv[1])
+	player = cdgPlayer(args[0], start, end, instructions, screen)
 
 if __name__ == "__main__":
     sys.exit(main())
@@ -0,0 +1,855 @@
+#!/usr/bin/python
+
+# cdgbench - cdgtools: Benchmarks for the ripping and burning code
+
+# Copyright (C) 2009  Kelvin Lawson (kelvinl@users.sf.net)
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+
+# OVERVIEW
+#
+# cdgbench is part of the cdgtools suite of CD+G karaoke software.
+#
+# It times the functions which do the real work when ripping a CD+G
+# disc (cdgdao.ParseToc(), and cdgparse's bin2pcm(), bin2cdg() and
+# Deinterleave() etc) or building one (cdg2bin's produce_bin()), so
+# that you can tell whether a change to them makes things faster or
+# slower.
+#
+# No real discs are needed. cdgbench generates a synthetic CD+G disc
+# (a BIN file and cdrdao TOC file) with as many tracks as you like, of
+# whatever length. The audio is noise, and the CD+G data is a stream
+# of valid CD+G packets (tile blocks, colour tables, presets and
+# scrolls, with empty packets in between as on a real disc), with
+# correct Reed-Solomon parity as on an undamaged disc. The disc
+# can be in either the RW (deinterleaved) or RW_RAW (interleaved)
+# subchannel layout. The same seed always generates the same disc.
+#
+# Each benchmark runs in its own child process, so that its peak
+# memory use can be measured separately. Each is run several times,
+# and the fastest time kept. For each function cdgbench reports:
+#
+#   . MB/s      - megabytes of input (bin file, CD+G data etc) per second
+#   . sectors/s - CD sectors (1/75th of a second of audio) per second
+#   . peak MB   - the peak memory use of the process running the benchmark
+#
+# There are also end-to-end benchmarks of complete cdgrip and cdg2bin
+# runs, using a stand-in for the mp3/ogg encoder (see below).
+#
+# The results can be saved as a JSON file, and compared against the
+# results of an earlier run (e.g. before making a change).
+
+
+# USAGE INSTRUCTIONS
+#
+# To run all of the benchmarks on a 3 track disc of 60 second tracks:
+#
+#   python cdgbench.py
+#
+# To use a bigger disc, and save the results:
+#
+#   python cdgbench.py --tracks 10 --seconds 240 --json before.json
+#
+# Then after making your changes, compare against the earlier results:
+#
+#   python cdgbench.py --tracks 10 --seconds 240 --compare before.json
+#
+# To time complete cdgrip and cdg2bin runs instead, with a stand-in
+# encoder which handles 20MB/s of audio (about 120x real time):
+#
+#   python cdgbench.py --e2e --encoder-speed 20
+#
+# Run "python cdgbench.py --help" for the full list of options.
+
+
+import sys, os, time, getopt, random, shutil, tempfile, json, platform, functools
+import cdgtools, cdgparse, cdgdao, cdgecc, cdgpacks, cdgrender, cdg2bin
+
+
+# Constants
+TITLE_STRING = " cdgbench %s" % cdgtools.VERSION_STRING
+DELIMITER = ("-----------------------------------------------------------")
+
+# CD sectors (frames) per second of audio
+SECTORS_PER_SECOND = 75
+
+# CD+G packets per sector
+PACKS_PER_SECTOR = 4
+PACK_SIZE = 24
+
+# CD+G command and instruction codes
+CDG_COMMAND = 0x09
+CDG_INST_MEMORY_PRESET = 1
+CDG_INST_BORDER_PRESET = 2
+CDG_INST_TILE_BLOCK = 6
+CDG_INST_SCROLL_PRESET = 20
+CDG_INST_SCROLL_COPY = 24
+CDG_INST_DEF_TRANSP_COL = 28
+CDG_INST_LOAD_COL_TBL_0_7 = 30
+CDG_INST_LOAD_COL_TBL_8_15 = 31
+CDG_INST_TILE_BLOCK_XOR = 38
+
+# Rough mix of the packets on a real disc: mostly tile blocks and
+# empty packets, with the occasional preset, colour table or scroll
+_packMix = ([None] * 40 + [CDG_INST_TILE_BLOCK] * 30 + [CDG_INST_TILE_BLOCK_XOR] * 20 +
+			[CDG_INST_LOAD_COL_TBL_0_7, CDG_INST_LOAD_COL_TBL_8_15, CDG_INST_MEMORY_PRESET,
+			 CDG_INST_BORDER_PRESET, CDG_INST_SCROLL_PRESET, CDG_INST_SCROLL_COPY,
+			 CDG_INST_DEF_TRANSP_COL])
+
+# Size of the block of noise repeated to make up the audio
+_NOISE_SIZE = 64 * 1024
+
+
+# Generate a CD+G packet stream of the given number of sectors, as it
+# would be once deinterleaved. Only the low 6 bits (R-W) of each byte
+# are used, and each packet has its parity filled in.
+def MakeCdgStream (sectors, rand):
+	packs = []
+	for pack in range (sectors * PACKS_PER_SECTOR):
+		instruction = rand.choice (_packMix)
+		if instruction == None:
+			packs.append (b"\x00" * PACK_SIZE)
+			continue
+		data = [rand.randrange (64) for i in range (16)]
+		if instruction in (CDG_INST_TILE_BLOCK, CDG_INST_TILE_BLOCK_XOR):
+			# Two colours, row 0-17, column 0-49, then 12 rows of pixels
+			data[0] = rand.randrange (16)
+			data[1] = rand.randrange (16)
+			data[2] = rand.randrange (18)
+			data[3] = rand.randrange (50)
+		elif instruction in (CDG_INST_MEMORY_PRESET, CDG_INST_BORDER_PRESET,
+							 CDG_INST_DEF_TRANSP_COL):
+			data[0] = rand.randrange (16)
+			data[1] = 0
+		packs.append (cdgecc.EncodePack ([CDG_COMMAND, instruction, 0, 0] + data + [0, 0, 0, 0]))
+	return (b"".join ([bytes (pack) for pack in packs]))
+
+
+# Interleave a CD+G packet stream as it is read from the disc in raw
+# mode (the reverse of cdgparse.Deinterleave()). Two extra sectors are
+# added to the end, for the bytes that the interleave spreads into.
+def Interleave (cdgdata):
+	sectors = len(cdgdata) // cdgparse.SUBCHAN_SIZE
+	interleavedData = bytearray ((sectors + 2) * cdgparse.SUBCHAN_SIZE)
+	for dest, src in cdgparse._DeinterleaveTable (sectors):
+		interleavedData[src] = cdgdata[dest]
+	return (bytes (interleavedData))
+
+
+# Generate the audio for a track of the given number of sectors
+def MakeAudio (sectors, rand):
+	noise = bytes (bytearray ([rand.randrange (256) for i in range (_NOISE_SIZE)]))
+	size = sectors * cdgparse.AUDIO_SIZE
+	return ((noise * ((size // _NOISE_SIZE) + 1))[:size])
+
+
+# Generate a synthetic CD+G disc in directory. Writes a bin file and a
+# cdrdao TOC file, plus the audio (.raw) and deinterleaved CD+G data
+# (.cdg) of each track, as used by cdg2bin. If raw is True the bin file
+# uses the RW_RAW layout, otherwise RW. Returns the TOC filename.
+def MakeDisc (directory, tracks=3, seconds=60, raw=True, seed=1):
+	rand = random.Random (seed)
+	if raw:
+		name = "disc-rw_raw"
+	else:
+		name = "disc-rw"
+	binname = os.path.join (directory, name + ".bin")
+	tocname = os.path.join (directory, name + ".toc")
+
+	binfile = open (binname, "wb")
+	toc = ""
+	offset = 0
+	for track in range (tracks):
+		trackname = os.path.join (directory, "%s-%02d" % (name, track + 1))
+		sectors = seconds * SECTORS_PER_SECOND
+		audio = MakeAudio (sectors, rand)
+		cdgdata = MakeCdgStream (sectors, rand)
+		cdgparse.pcmWriteToFile (trackname + ".raw", audio)
+		cdgparse.cdgWriteToFile (trackname + ".cdg", cdgdata)
+
+		# The interleave spreads each track into two extra sectors, so
+		# the raw layout is a little longer
+		if raw:
+			cdgdata = Interleave (cdgdata)
+			sectors = sectors + 2
+			audio = audio + (b"\x00" * 2 * cdgparse.AUDIO_SIZE)
+		for sector in range (sectors):
+			binfile.write (audio[sector * cdgparse.AUDIO_SIZE:(sector + 1) * cdgparse.AUDIO_SIZE])
+			binfile.write (cdgdata[sector * cdgparse.SUBCHAN_SIZE:(sector + 1) * cdgparse.SUBCHAN_SIZE])
+		toc = toc + cdg2bin.tocblock (os.path.basename (binname), track + 1, offset, sectors, raw)
+		offset = offset + (sectors * cdgparse.SECTOR_SIZE)
+	binfile.close()
+
+	tocfile = open (tocname, "w")
+	tocfile.write (toc)
+	tocfile.close()
+	return (tocname)
+
+
+# Benchmarks
+#
+# Each benchmark is a function taking the TOC filename of the disc, and
+# returning a function to time (which does one full run), and the
+# number of input bytes and sectors that one run processes.
+
+def _DiscDetails (tocname):
+	binfilename, interleaved, startBytes, trackSizeBytes = cdgdao.ParseToc (tocname)
+	binfilename = os.path.join (os.path.dirname (tocname), binfilename)
+	total = sum (trackSizeBytes)
+	return (binfilename, interleaved, startBytes, trackSizeBytes, total, total // cdgparse.SECTOR_SIZE)
+
+def BenchParseToc (tocname):
+	size = os.path.getsize (tocname)
+	binfilename, interleaved, startBytes, trackSizeBytes, total, sectors = _DiscDetails (tocname)
+	def run():
+		for i in range (100):
+			cdgdao.ParseToc (tocname)
+	return (run, size * 100, sectors * 100)
+
+def BenchBin2pcm (tocname):
+	binfilename, interleaved, startBytes, trackSizeBytes, total, sectors = _DiscDetails (tocname)
+	def run():
+		for track in range (len(startBytes)):
+			cdgparse.bin2pcm (binfilename, startBytes[track], trackSizeBytes[track])
+	return (run, total, sectors)
+
+def BenchBin2cdg (tocname):
+	binfilename, interleaved, startBytes, trackSizeBytes, total, sectors = _DiscDetails (tocname)
+	def run():
+		for track in range (len(startBytes)):
+			cdgparse.bin2cdg (binfilename, startBytes[track], trackSizeBytes[track])
+	return (run, total, sectors)
+
+def BenchBin2pcmcdg (tocname):
+	binfilename, interleaved, startBytes, trackSizeBytes, total, sectors = _DiscDetails (tocname)
+	def run():
+		for track in range (len(startBytes)):
+			cdgparse.bin2pcmcdg (binfilename, startBytes[track], trackSizeBytes[track])
+	return (run, total, sectors)
+
+def BenchIterDisc (tocname):
+	binfilename, interleaved, startBytes, trackSizeBytes, total, sectors = _DiscDetails (tocname)
+	def run():
+		for track, pcmchunk, cdgchunk in cdgparse.iter_disc (binfilename, startBytes, trackSizeBytes):
+			pass
+	return (run, total, sectors)
+
+def BenchDeinterleave (tocname):
+	binfilename, interleaved, startBytes, trackSizeBytes, total, sectors = _DiscDetails (tocname)
+	cdgdata = [cdgparse.bin2cdg (binfilename, startBytes[track], trackSizeBytes[track])
+				for track in range (len(startBytes))]
+	def run():
+		for trackdata in cdgdata:
+			cdgparse.Deinterleave (trackdata)
+	return (run, sum ([len(trackdata) for trackdata in cdgdata]), sectors)
+
+def BenchDeinterleaver (tocname):
+	binfilename, interleaved, startBytes, trackSizeBytes, total, sectors = _DiscDetails (tocname)
+	def run():
+		for track in range (len(startBytes)):
+			deinterleaver = cdgparse.Deinterleaver()
+			for cdgchunk in cdgparse.iter_cdg (binfilename, startBytes[track], trackSizeBytes[track]):
+				deinterleaver.Feed (cdgchunk)
+	return (run, total, sectors)
+
+# Get the deinterleaved CD+G data of each track, from the .cdg files
+# written with the disc
+def _TrackCdg (tocname):
+	base = os.path.splitext (tocname)[0]
+	tracks = []
+	track = 1
+	while os.path.exists ("%s-%02d.cdg" % (base, track)):
+		tracks.append (open ("%s-%02d.cdg" % (base, track), "rb").read())
+		track = track + 1
+	return (tracks)
+
+def _BenchCorrect (tracks):
+	chunksize = cdgparse.BLOCK_SECTORS * cdgparse.SUBCHAN_SIZE
+	def run():
+		for trackdata in tracks:
+			corrector = cdgecc.PackCorrector()
+			for offset in range (0, len(trackdata), chunksize):
+				corrector.Feed (trackdata[offset:offset + chunksize])
+	size = sum ([len(trackdata) for trackdata in tracks])
+	return (run, size, size // cdgparse.SUBCHAN_SIZE)
+
+def BenchCorrectPacks (tocname):
+	return (_BenchCorrect (_TrackCdg (tocname)))
+
+# As a badly scratched disc: one symbol damaged in every 100th packet
+def BenchCorrectDamaged (tocname):
+	tracks = []
+	for trackdata in _TrackCdg (tocname):
+		trackdata = bytearray (trackdata)
+		for offset in range (0, len(trackdata), PACK_SIZE * 100):
+			trackdata[offset + 10] = trackdata[offset + 10] ^ 0x15
+		tracks.append (bytes (trackdata))
+	return (_BenchCorrect (tracks))
+
+# Decode each track's .cdg file and find its graphics packets
+def BenchCdgPacks (tocname):
+	tracks = _TrackCdg (tocname)
+	def run():
+		for trackdata in tracks:
+			cdgpacks.CdgPacks (trackdata).Commands()
+	size = sum ([len(trackdata) for trackdata in tracks])
+	return (run, size, size // cdgparse.SUBCHAN_SIZE)
+
+# Play each track's graphics packets onto the screen, converting the
+# changed part of the screen to RGB after every packet
+def BenchRender (tocname):
+	tracks = [cdgpacks.CdgPacks (trackdata) for trackdata in _TrackCdg (tocname)]
+	def run():
+		for packs in tracks:
+			renderer = cdgrender.CdgRenderer()
+			for index in packs.Commands():
+				renderer.Process (packs.kind[index], packs.Data (index))
+				rect = renderer.TakeDirty()
+				if rect != None:
+					renderer.RGB (rect)
+	size = sum ([packs.count * cdgpacks.PACK_SIZE for packs in tracks])
+	return (run, size, size // cdgparse.SUBCHAN_SIZE)
+
+def BenchProduceBin (tocname):
+	directory = os.path.dirname (tocname)
+	base = os.path.splitext (tocname)[0]
+	tracks = []
+	track = 1
+	while os.path.exists ("%s-%02d.raw" % (base, track)):
+		tracks.append (("%s-%02d.raw" % (base, track), "%s-%02d.cdg" % (base, track)))
+		track = track + 1
+	size = sum ([os.path.getsize (raw) + os.path.getsize (cdg) for raw, cdg in tracks])
+	sectors = sum ([os.path.getsize (raw) // cdgparse.AUDIO_SIZE for raw, cdg in tracks])
+	outname = os.path.join (directory, "produce_bin.bin")
+	def run():
+		binfile = open (outname, "wb")
+		try:
+			for raw, cdg in tracks:
+				cdg2bin.produce_bin (raw, cdg, binfile)
+		finally:
+			binfile.close()
+			os.unlink (outname)
+	return (run, size, sectors)
+
+# All of the benchmarks, in the order they're run
+BENCHMARKS = [
+	("ParseToc", BenchParseToc),
+	("bin2pcm", BenchBin2pcm),
+	("bin2cdg", BenchBin2cdg),
+	("bin2pcmcdg", BenchBin2pcmcdg),
+	("iter_disc", BenchIterDisc),
+	("Deinterleave", BenchDeinterleave),
+	("Deinterleaver", BenchDeinterleaver),
+	("CorrectPacks", BenchCorrectPacks),
+	("CorrectDamaged", BenchCorrectDamaged),
+	("CdgPacks", BenchCdgPacks),
+	("Render", BenchRender),
+	("produce_bin", BenchProduceBin),
+]
+
+
+# End-to-end benchmarks
+#
+# These run a whole cdgrip or cdg2bin job the way it is run for real,
+# including starting the encoder processes and creating and deleting
+# the temporary files. lame and oggdec are replaced by a stand-in
+# encoder (see MakeStandInEncoder()) which runs at a fixed speed, so
+# that changes to the cdgtools code aren't lost in the codec's time.
+#
+# The wall time is split into phases, so that a slower rip due to the
+# orchestration (reading, deinterleaving, writing, waiting for the
+# encoder) can be told apart from a slower encoder:
+#
+#   . read         - reading and demultiplexing the bin file
+#   . deinterleave - deinterleaving the CD+G data
+#   . encode-wait  - waiting on the encoder (piping audio into it and
+#                    waiting for it to finish, or decoding for cdg2bin)
+#   . write        - writing the .cdg files (or bin file for cdg2bin)
+#   . other        - everything else: parsing the TOC, starting up and
+#                    finishing off, deleting files etc
+#
+# The cdgrip phases come from the rip pipeline's stage timings. As the
+# stages run at the same time, the phases add up to more than the wall
+# time, and "other" is the time outside the pipeline.
+
+# Source of the stand-in encoder. Handles the lame and oggdec command
+# lines used by cdgrip and cdg2bin. Encoding shrinks the audio by
+# about the same ratio as a 128kbps mp3, and decoding just copies.
+_standInSource = """#!%(python)s
+import sys, os, time
+SPEED = %(speed)f * 1024 * 1024
+args = sys.argv[1:]
+if os.path.basename (sys.argv[0]) == "oggdec":
+	infile = open (args[-1], "rb")
+	outfile = open (args[args.index ("-o") + 1], "wb")
+	ratio = 1
+elif "--decode" in args:
+	infile = open (args[-2], "rb")
+	outfile = open (args[-1], "wb")
+	ratio = 1
+else:
+	infile = sys.stdin
+	if hasattr (infile, "buffer"):
+		infile = infile.buffer
+	outfile = open (args[-1], "wb")
+	ratio = 11
+start = time.time()
+total = 0
+while True:
+	data = infile.read (65536)
+	if not data:
+		break
+	total = total + len(data)
+	outfile.write (data[:len(data) // ratio])
+	if SPEED > 0:
+		delay = (total / SPEED) - (time.time() - start)
+		if delay > 0:
+			time.sleep (delay)
+outfile.close()
+"""
+
+
+# Write the stand-in encoder into directory as "lame" and "oggdec".
+# speed is in MB/s of PCM audio, or 0 to run as fast as possible.
+def MakeStandInEncoder (directory, speed=0):
+	if not os.path.isdir (directory):
+		os.makedirs (directory)
+	for name in ("lame", "oggdec"):
+		filename = os.path.join (directory, name)
+		scriptfile = open (filename, "w")
+		scriptfile.write (_standInSource % {"python": sys.executable, "speed": speed})
+		scriptfile.close()
+		os.chmod (filename, 0755)
+
+
+# Put the stand-in encoder at the front of the PATH (in this process
+# only, as the benchmarks run in their own child process)
+def _UseStandInEncoder (tocname, speed):
+	directory = os.path.join (os.path.dirname (tocname), "standin")
+	MakeStandInEncoder (directory, speed)
+	os.environ["PATH"] = directory + os.pathsep + os.environ.get ("PATH", "")
+
+# Run func(*args) in workdir with the console output thrown away
+def _RunQuietly (workdir, func, *args):
+	cwd = os.getcwd()
+	stdout = sys.stdout
+	os.chdir (workdir)
+	sys.stdout = open (os.devnull, "w")
+	try:
+		return (func (*args))
+	finally:
+		sys.stdout.close()
+		sys.stdout = stdout
+		os.chdir (cwd)
+
+def BenchCdgrip (tocname, encoder_speed=0, single_pass=False):
+	import cdgrip, cdgpipe
+	binfilename, interleaved, startBytes, trackSizeBytes, total, sectors = _DiscDetails (tocname)
+	_UseStandInEncoder (tocname, encoder_speed)
+
+	# Get hold of the pipeline when cdgrip prints its stage timings
+	pipelines = []
+	printStageStats = cdgpipe.PrintStageStats
+	def KeepPipeline (pipeline, output=None):
+		pipelines.append (pipeline)
+	cdgpipe.PrintStageStats = KeepPipeline
+
+	def run():
+		# Rip a fresh copy of the disc each time, deleting the bin and TOC
+		# files afterwards as they would be for real
+		workdir = tempfile.mkdtemp (dir = os.path.dirname (tocname))
+		try:
+			shutil.copy (tocname, workdir)
+			shutil.copy (binfilename, workdir)
+			del pipelines[:]
+			start = time.time()
+			failed = _RunQuietly (workdir, cdgrip.cdgrip, os.path.basename (tocname),
+								  True, False, False, single_pass)
+			wall = time.time() - start
+		finally:
+			shutil.rmtree (workdir)
+		if len(failed) > 0:
+			raise Exception ("cdgrip failed to rip %s" % ", ".join (failed))
+
+		phases = {"wall": wall}
+		pipelineWall = 0.0
+		for stats in pipelines[0].StageStats():
+			name = {"read": "read", "deinterleave": "deinterleave", "encode": "encode-wait",
+					"write": "write"}[stats["name"]]
+			phases[name] = stats["busy"]
+			pipelineWall = max (pipelineWall, stats["wall"])
+		phases["other"] = max (wall - pipelineWall, 0.0)
+		return (phases)
+	return (run, total, sectors)
+
+def BenchCdgripSinglePass (tocname, encoder_speed=0):
+	return (BenchCdgrip (tocname, encoder_speed, single_pass = True))
+
+def BenchCdg2bin (tocname, encoder_speed=0):
+	_UseStandInEncoder (tocname, encoder_speed)
+	base = os.path.splitext (tocname)[0]
+	tracks = []
+	track = 1
+	while os.path.exists ("%s-%02d.raw" % (base, track)):
+		tracks.append (("%s-%02d.raw" % (base, track), "%s-%02d.cdg" % (base, track)))
+		track = track + 1
+	size = sum ([os.path.getsize (raw) + os.path.getsize (cdg) for raw, cdg in tracks])
+	sectors = sum ([os.path.getsize (raw) // cdgparse.AUDIO_SIZE for raw, cdg in tracks])
+
+	# Time the decoding and the writing of the bin file
+	phases = {}
+	def Timed (phase, func):
+		def timed (*args):
+			start = time.time()
+			try:
+				return (func (*args))
+			finally:
+				phases[phase] = phases.get (phase, 0.0) + (time.time() - start)
+		return (timed)
+	cdg2bin.decode_file = Timed ("encode-wait", cdg2bin.decode_file)
+	cdg2bin.produce_bin = Timed ("write", cdg2bin.produce_bin)
+
+	def run():
+		# Make a fresh set of .mp3+.cdg tracks each time (the stand-in
+		# encoder "decodes" the audio by copying it), as cdg2bin deletes
+		# the decoded audio afterwards
+		workdir = tempfile.mkdtemp (dir = os.path.dirname (tocname))
+		try:
+			cdgnames = []
+			for raw, cdg in tracks:
+				name = os.path.join (workdir, os.path.basename (os.path.splitext (cdg)[0]))
+				shutil.copy (raw, name + ".mp3")
+				shutil.copy (cdg, name + ".cdg")
+				cdgnames.append (name + ".cdg")
+			phases.clear()
+			argv = sys.argv
+			sys.argv = ["cdg2bin", "-o", os.path.join (workdir, "disc")] + cdgnames
+			start = time.time()
+			try:
+				_RunQuietly (workdir, cdg2bin.main)
+			finally:
+				sys.argv = argv
+			wall = time.time() - start
+		finally:
+			shutil.rmtree (workdir)
+		result = dict (phases)
+		result["wall"] = wall
+		result["other"] = max (wall - sum (phases.values()), 0.0)
+		return (result)
+	return (run, size, sectors)
+
+# All of the end-to-end benchmarks, in the order they're run
+E2E_BENCHMARKS = [
+	("cdgrip", BenchCdgrip),
+	("cdgrip-1pass", BenchCdgripSinglePass),
+	("cdg2bin", BenchCdg2bin),
+]
+
+
+# Get the peak memory use of this process so far, in bytes
+def PeakMemory ():
+	try:
+		import resource
+	except ImportError:
+		return (None)
+	peak = resource.getrusage (resource.RUSAGE_SELF).ru_maxrss
+	# Linux reports kilobytes, Mac OS X bytes
+	if sys.platform != "darwin":
+		peak = peak * 1024
+	return (peak)
+
+
+# Run a benchmark repeat times in this process, and return the results
+def _RunBenchmark (name, setup, tocname, repeat):
+	run, size, sectors = setup (tocname)
+	best = None
+	bestPhases = None
+	for i in range (repeat):
+		start = time.time()
+		phases = run()
+		elapsed = time.time() - start
+		# End-to-end benchmarks time themselves (leaving out their setup),
+		# and split the time up into phases
+		if phases != None:
+			elapsed = phases.pop ("wall")
+		if (best == None) or (elapsed < best):
+			best = elapsed
+			bestPhases = phases
+	best = max (best, 1e-9)
+	results = {"name": name, "seconds": best, "bytes": size, "sectors": sectors,
+			   "MBps": size / best / (1024 * 1024), "sectorsps": sectors / best,
+			   "peakBytes": PeakMemory()}
+	if bestPhases != None:
+		results["phases"] = bestPhases
+	return (results)
+
+
+# Run a benchmark in a child process (where possible), so that its
+# peak memory use isn't mixed up with the other benchmarks
+def RunBenchmark (name, setup, tocname, repeat=3):
+	if not hasattr (os, "fork"):
+		return (_RunBenchmark (name, setup, tocname, repeat))
+
+	readfd, writefd = os.pipe()
+	pid = os.fork()
+	if pid == 0:
+		# Child: run the benchmark and pass the results back
+		status = 0
+		try:
+			try:
+				os.close (readfd)
+				results = _RunBenchmark (name, setup, tocname, repeat)
+			except Exception:
+				results = {"name": name, "error": str (sys.exc_info()[1])}
+				status = 1
+			os.write (writefd, json.dumps (results))
+			os.close (writefd)
+		finally:
+			os._exit (status)
+
+	os.close (writefd)
+	output = []
+	while True:
+		data = os.read (readfd, 65536)
+		if not data:
+			break
+		output.append (data)
+	os.close (readfd)
+	os.waitpid (pid, 0)
+	try:
+		return (json.loads (b"".join (output)))
+	except ValueError:
+		return ({"name": name, "error": "benchmark process died"})
+
+
+# Run the benchmarks on a disc in each requested layout. Returns the
+# full report, ready to be saved as JSON.
+#
+# With e2e, the end-to-end benchmarks are run instead of the function
+# benchmarks, using a stand-in encoder running at encoder_speed MB/s.
+def RunBenchmarks (tracks=3, seconds=60, layouts=("RW", "RW_RAW"), names=None,
+					repeat=3, seed=1, directory=None, output=None, e2e=False, encoder_speed=0):
+	report = {"version": cdgtools.VERSION_STRING, "date": time.strftime ("%Y-%m-%d %H:%M:%S"),
+			  "python": platform.python_version(), "platform": platform.platform(),
+			  "tracks": tracks, "seconds": seconds, "repeat": repeat, "seed": seed,
+			  "results": []}
+	if e2e:
+		report["encoderSpeed"] = encoder_speed
+		benchmarks = [(name, functools.partial (setup, encoder_speed = encoder_speed))
+						for name, setup in E2E_BENCHMARKS]
+	else:
+		benchmarks = BENCHMARKS
+	for layout in layouts:
+		tempdir = directory or tempfile.mkdtemp (prefix = "cdgbench")
+		try:
+			tocname = MakeDisc (tempdir, tracks, seconds, (layout == "RW_RAW"), seed)
+			for name, setup in benchmarks:
+				if (names != None) and (name not in names):
+					continue
+				results = RunBenchmark (name, setup, tocname, repeat)
+				results["layout"] = layout
+				report["results"].append (results)
+				if output != None:
+					output (results)
+		finally:
+			if directory == None:
+				shutil.rmtree (tempdir)
+	return (report)
+
+
+# Format one line of results
+def FormatResults (results, previous=None):
+	if "error" in results:
+		return ("-> %-8s %-14s ERROR: %s" % (results["layout"], results["name"], results["error"]))
+	if results["peakBytes"] == None:
+		peak = "    n/a"
+	else:
+		peak = "%7.1f" % (results["peakBytes"] / (1024.0 * 1024))
+	line = ("-> %-8s %-14s %9.1f MB/s %11.0f sectors/s %s MB peak"
+			% (results["layout"], results["name"], results["MBps"], results["sectorsps"], peak))
+	if (previous != None) and ("error" not in previous):
+		line = line + "  (%+.1f%%)" % (100.0 * (results["MBps"] / previous["MBps"] - 1))
+	if "phases" in results:
+		phases = results["phases"]
+		line = line + "\n->%24.2fs wall:" % results["seconds"]
+		for phase in ("read", "deinterleave", "encode-wait", "write", "other"):
+			if phase in phases:
+				line = line + " %s %.2fs," % (phase, phases[phase])
+		line = line.rstrip (",")
+	return (line)
+
+
+# Usage instructions
+def usage():
+	print (TITLE_STRING)
+	print ("")
+	print ("Usage:  %s [options]" % os.path.basename(sys.argv[0]))
+	print ("")
+	print ("Options:")
+	print ("")
+	print ("  --tracks N                :    Number of tracks on the disc (default 3)")
+	print ("")
+	print ("  --seconds N               :    Length of each track in seconds (default 60)")
+	print ("")
+	print ("  --layout RW|RW_RAW        :    Only benchmark one subchannel layout")
+	print ("                                 (default both)")
+	print ("")
+	print ("  --only NAME[,NAME...]     :    Only run the named benchmarks, from:")
+	print ("                                 %s" % ", ".join ([name for name, setup in BENCHMARKS]))
+	print ("")
+	print ("  --repeat N                :    Run each benchmark N times, keeping the")
+	print ("                                 fastest (default 3)")
+	print ("")
+	print ("  --seed N                  :    Seed for generating the disc (default 1)")
+	print ("")
+	print ("  --json FILE               :    Save the results to FILE")
+	print ("")
+	print ("  --compare FILE            :    Compare with the results saved in FILE")
+	print ("")
+	print ("  --e2e                     :    Run the end-to-end benchmarks instead:")
+	print ("                                 %s" % ", ".join ([name for name, setup in E2E_BENCHMARKS]))
+	print ("")
+	print ("  --encoder-speed MBPS      :    Speed of the stand-in encoder used by the")
+	print ("                                 end-to-end benchmarks, in MB/s of audio")
+	print ("                                 (default 0, as fast as possible)")
+	print ("")
+	print ("  --generate DIR            :    Just generate the disc(s) in DIR, and exit")
+	print ("")
+	print ("  --help                    :    Display this message")
+	print ("")
+
+	return
+
+
+def main():
+
+	# Get the options out
+	try:
+		opts, args = getopt.getopt(sys.argv[1:], "h", ["help", "tracks=", "seconds=", "layout=",
+													"only=", "repeat=", "seed=", "json=",
+													"compare=", "generate=", "e2e", "encoder-speed="])
+	except getopt.GetoptError:
+		usage()
+		sys.exit(2)
+	if len(args) != 0:
+		usage()
+		sys.exit(2)
+
+	# Default settings
+	tracks = 3
+	seconds = 60
+	layouts = ("RW", "RW_RAW")
+	names = None
+	repeat = 3
+	seed = 1
+	jsonfile = None
+	comparefile = None
+	generate = None
+	e2e = False
+	encoder_speed = 0
+
+	# Parse the command-line options
+	try:
+		for opt, arg in opts:
+			if opt in ("-h", "--help"):
+				usage()
+				sys.exit()
+			elif opt == "--tracks":
+				tracks = int(arg)
+			elif opt == "--seconds":
+				seconds = int(arg)
+			elif opt == "--layout":
+				if arg.upper() not in ("RW", "RW_RAW"):
+					raise ValueError
+				layouts = (arg.upper(),)
+			elif opt == "--only":
+				names = arg.split (",")
+			elif opt == "--e2e":
+				e2e = True
+			elif opt == "--encoder-speed":
+				encoder_speed = float(arg)
+			elif opt == "--repeat":
+				repeat = int(arg)
+			elif opt == "--seed":
+				seed = int(arg)
+			elif opt == "--json":
+				jsonfile = arg
+			elif opt == "--compare":
+				comparefile = arg
+			elif opt == "--generate":
+				generate = arg
+	except ValueError:
+		usage()
+		sys.exit(2)
+	if (tracks < 1) or (seconds < 1) or (repeat < 1) or (encoder_speed < 0):
+		usage()
+		sys.exit(2)
+	if e2e:
+		allnames = [name for name, setup in E2E_BENCHMARKS]
+	else:
+		allnames = [name for name, setup in BENCHMARKS]
+	for name in names or []:
+		if name not in allnames:
+			usage()
+			sys.exit(2)
+
+	# Just generate the discs if requested
+	if generate != None:
+		if not os.path.isdir (generate):
+			os.makedirs (generate)
+		for layout in layouts:
+			print ("-> Generated %s" % MakeDisc (generate, tracks, seconds, (layout == "RW_RAW"), seed))
+		return
+
+	# Load the results to compare against
+	previous = {}
+	if comparefile != None:
+		comparefile = open (comparefile, "r")
+		for results in json.load (comparefile)["results"]:
+			previous[(results["layout"], results["name"])] = results
+		comparefile.close()
+
+	print (DELIMITER)
+	print (TITLE_STRING)
+	print (DELIMITER)
+	print ("-> %d tracks of %d seconds, best of %d runs" % (tracks, seconds, repeat))
+	if e2e:
+		if encoder_speed > 0:
+			print ("-> End-to-end runs, stand-in encoder at %g MB/s" % encoder_speed)
+		else:
+			print ("-> End-to-end runs, stand-in encoder at full speed")
+	print (DELIMITER)
+	def Output (results):
+		print (FormatResults (results, previous.get ((results["layout"], results["name"]))))
+		sys.stdout.flush()
+	report = RunBenchmarks (tracks, seconds, layouts, names, repeat, seed, output = Output,
+							e2e = e2e, encoder_speed = encoder_speed)
+	print (DELIMITER)
+
+	if jsonfile != None:
+		outfile = open (jsonfile, "w")
+		json.dump (report, outfile, indent = 1, sort_keys = True)
+		outfile.close()
+		print ("-> Results saved to %s" % jsonfile)
+		print (DELIMITER)
+
+	for results in report["results"]:
+		if "error" in results:
+			return (1)
+	return
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,275 @@
+# cdgcache - cdgtools: Cache of ripped track streams
+
+# Copyright (C) 2009  Kelvin Lawson (kelvinl@users.sf.net)
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+
+# OVERVIEW
+#
+# cdgcache is part of the cdgtools suite of CD+G karaoke software.
+#
+# This module keeps an on-disk cache of the PCM audio and deinterleaved
+# CD+G data ripped out of each track of a bin file. If the same disc is
+# encoded again (with different encoder settings, or new track names
+# from CDDB), the streams are read back from the cache rather than
+# demultiplexed and deinterleaved from the bin file all over again.
+#
+# Each cache entry is named by a SHA-1 checksum of the contents of the
+# track: the audio and CD+G subchannel data of the bin file region,
+# plus whether the CD+G data needed deinterleaving. The same track
+# ripped from two different bin files therefore shares one entry. The
+# checksum is worked out as the track is first ripped, and remembered
+# against the bin file's path, size and modification time and the
+# track's byte range, so that finding a track in the cache later on
+# doesn't mean reading the bin file again.
+#
+# The cache is limited in size. Entries are touched whenever they are
+# used, and once the cache grows beyond its size limit the least
+# recently used entries are deleted.
+#
+#   cache = StreamCache()
+#   key = cache.Lookup (binfilename, startByte, trackSize, interleaved)
+#   if key != None:
+#       for pcmchunk, cdgchunk in cache.iter_entry (key):
+#           ... use the audio and (already deinterleaved) CD+G data ...
+#   else:
+#       entry = cache.NewEntry (binfilename, startByte, trackSize, interleaved)
+#       for pcmchunk, cdgchunk in cdgparse.iter_pcmcdg (...):
+#           entry.AddRaw (pcmchunk, cdgchunk)
+#           ... deinterleave cdgchunk if required ...
+#           entry.AddCdg (cdgchunk)
+#       entry.Commit()
+#
+# See cdgpipe.py for an example which utilises this module.
+#
+# For further details see http://www.kibosh.org/cdgtools/
+
+import os, time, threading, hashlib, json
+import cdgparse, cdgstats
+
+
+# Default cache location and size limit
+DEFAULT_CACHE_DIR = os.path.join (os.path.expanduser ("~"), ".cdgtools", "cache")
+DEFAULT_CACHE_BYTES = 4 * 1024 * 1024 * 1024
+
+# Name of the file in the cache directory which records the checksum
+# of each bin file region seen
+INDEX_NAME = "regions.json"
+
+
+# Get the key used to remember a bin file region's checksum. This
+# changes if the bin file is replaced or modified.
+def _RegionName (binfilename, startByte, trackSize, interleaved):
+	binstat = os.stat (binfilename)
+	return ("%s|%d|%d|%d|%d|%d" % (os.path.abspath (binfilename), binstat.st_size,
+									int (binstat.st_mtime), startByte, trackSize, int (bool (interleaved))))
+
+
+# StreamCache Class
+#
+# The cache directory. May be shared between threads.
+class StreamCache:
+	def __init__(self, directory=None, max_bytes=DEFAULT_CACHE_BYTES):
+		self.directory = directory or DEFAULT_CACHE_DIR
+		self.maxBytes = max_bytes
+		self.lock = threading.Lock()
+		if not os.path.isdir (self.directory):
+			os.makedirs (self.directory)
+
+		# Load the region checksums. Anything unreadable is ignored (the
+		# tracks will just be ripped again). The bin filenames are saved
+		# as latin-1, to get back the original bytes whatever encoding
+		# they were in.
+		self.regions = {}
+		try:
+			indexfile = open (os.path.join (self.directory, INDEX_NAME), "r")
+			try:
+				for region, key in json.load (indexfile).items():
+					self.regions[region.encode ("latin-1")] = str (key)
+			finally:
+				indexfile.close()
+		except (IOError, ValueError, TypeError, AttributeError, UnicodeError):
+			self.regions = {}
+
+	# Get the filenames of a cache entry's PCM and CD+G data
+	def EntryFiles (self, key):
+		return (os.path.join (self.directory, key + ".pcm"),
+				os.path.join (self.directory, key + ".cdg"))
+
+	# Find a bin file region in the cache. Returns the entry's key, or
+	# None if the region hasn't been cached (or has since been evicted).
+	def Lookup (self, binfilename, startByte, trackSize, interleaved):
+		region = _RegionName (binfilename, startByte, trackSize, interleaved)
+		self.lock.acquire()
+		try:
+			key = self.regions.get (region)
+		finally:
+			self.lock.release()
+		if key == None:
+			return (None)
+		now = time.time()
+		try:
+			for filename in self.EntryFiles (key):
+				os.utime (filename, (now, now))
+		except OSError:
+			return (None)
+		return (key)
+
+	# Read back a cache entry chunk_sectors sectors at a time. Yields
+	# the audio and deinterleaved CD+G data for each chunk.
+	def iter_entry (self, key, chunk_sectors=cdgparse.BLOCK_SECTORS):
+		pcmname, cdgname = self.EntryFiles (key)
+		pcmfile = open (pcmname, "rb")
+		try:
+			cdgfile = open (cdgname, "rb")
+			try:
+				while True:
+					start = cdgstats.Start()
+					pcmchunk = pcmfile.read (chunk_sectors * cdgparse.AUDIO_SIZE)
+					cdgchunk = cdgfile.read (chunk_sectors * cdgparse.SUBCHAN_SIZE)
+					cdgstats.Stop (start, "cache", len(pcmchunk) + len(cdgchunk),
+								   len(pcmchunk) + len(cdgchunk), len(pcmchunk) // cdgparse.AUDIO_SIZE)
+					if (not pcmchunk) and (not cdgchunk):
+						break
+					yield (pcmchunk, cdgchunk)
+			finally:
+				cdgfile.close()
+		finally:
+			pcmfile.close()
+
+	# Start a new cache entry for a bin file region
+	def NewEntry (self, binfilename, startByte, trackSize, interleaved):
+		return (CacheEntry (self, _RegionName (binfilename, startByte, trackSize, interleaved),
+							interleaved))
+
+	# Total size of the cache entries, and a list of (last used, size,
+	# key) for each of them
+	def Usage (self):
+		entries = {}
+		for filename in os.listdir (self.directory):
+			key, ext = os.path.splitext (filename)
+			if ext in (".pcm", ".cdg"):
+				try:
+					filestat = os.stat (os.path.join (self.directory, filename))
+				except OSError:
+					continue
+				used, size = entries.get (key, (0, 0))
+				entries[key] = (max (used, filestat.st_mtime), size + filestat.st_size)
+		total = 0
+		usage = []
+		for key, (used, size) in entries.items():
+			total = total + size
+			usage.append ((used, size, key))
+		return (total, usage)
+
+	# Delete least recently used entries until the cache fits in its
+	# size limit. Returns the keys of the deleted entries.
+	def Evict (self):
+		total, usage = self.Usage()
+		usage.sort()
+		evicted = []
+		for used, size, key in usage:
+			if total <= self.maxBytes:
+				break
+			for filename in self.EntryFiles (key):
+				if os.path.exists (filename):
+					os.unlink (filename)
+			total = total - size
+			evicted.append (key)
+		return (evicted)
+
+	# Add a finished entry, and remember its key against its region
+	def _Add (self, region, key, pcmtemp, cdgtemp):
+		pcmname, cdgname = self.EntryFiles (key)
+		self.lock.acquire()
+		try:
+			for tempname, filename in ((pcmtemp, pcmname), (cdgtemp, cdgname)):
+				if os.name == "nt" and os.path.exists (filename):
+					os.unlink (filename)
+				os.rename (tempname, filename)
+			self.regions[region] = key
+			# Forget the regions of any entries which had to be deleted
+			evicted = self.Evict()
+			for region, key in self.regions.items():
+				if key in evicted:
+					del self.regions[region]
+			self._SaveIndex()
+		finally:
+			self.lock.release()
+
+	def _SaveIndex (self):
+		indexname = os.path.join (self.directory, INDEX_NAME)
+		tempname = "%s.%d.tmp" % (indexname, os.getpid())
+		indexfile = open (tempname, "w")
+		try:
+			json.dump (self.regions, indexfile, indent = 1, sort_keys = True, encoding = "latin-1")
+		finally:
+			indexfile.close()
+		if os.name == "nt" and os.path.exists (indexname):
+			os.unlink (indexname)
+		os.rename (tempname, indexname)
+
+
+# CacheEntry Class
+#
+# A cache entry being written. Feed the raw (demultiplexed) data of
+# the region to AddRaw() to work out the entry's checksum and store
+# the audio, and the deinterleaved CD+G data to AddCdg(). Then Commit()
+# the entry once the whole region has been read, or Abort() it.
+class CacheEntry:
+	def __init__(self, cache, region, interleaved):
+		self.cache = cache
+		self.region = region
+		self.interleaved = interleaved
+
+		# The audio and CD+G data are checksummed separately, so that the
+		# checksum doesn't depend on the chunk size they were read in
+		self.pcmsum = hashlib.sha1()
+		self.cdgsum = hashlib.sha1()
+
+		tempbase = os.path.join (cache.directory, "new-%d-%d" % (os.getpid(), id(self)))
+		self.pcmtemp = tempbase + ".pcm.tmp"
+		self.cdgtemp = tempbase + ".cdg.tmp"
+		self.pcmfile = open (self.pcmtemp, "wb")
+		self.cdgfile = open (self.cdgtemp, "wb")
+
+	def AddRaw (self, pcmchunk, cdgchunk):
+		start = cdgstats.Start()
+		self.pcmsum.update (pcmchunk)
+		self.cdgsum.update (cdgchunk)
+		self.pcmfile.write (pcmchunk)
+		cdgstats.Stop (start, "cache", len(pcmchunk) + len(cdgchunk), len(pcmchunk))
+
+	def AddCdg (self, cdgchunk):
+		start = cdgstats.Start()
+		self.cdgfile.write (cdgchunk)
+		cdgstats.Stop (start, "cache", len(cdgchunk), len(cdgchunk))
+
+	# Move the finished entry into the cache. Returns the entry's key.
+	def Commit (self):
+		self.pcmfile.close()
+		self.cdgfile.close()
+		key = hashlib.sha1 ("%s%s%d" % (self.pcmsum.hexdigest(), self.cdgsum.hexdigest(),
+										int (bool (self.interleaved)))).hexdigest()
+		self.cache._Add (self.region, key, self.pcmtemp, self.cdgtemp)
+		return (key)
+
+	def Abort (self):
+		self.pcmfile.close()
+		self.cdgfile.close()
+		for tempname in (self.pcmtemp, self.cdgtemp):
+			if os.path.exists (tempname):
+				os.unlink (tempname)
@@ -39,6 +39,8 @@
 #
 # For further details see http://www.kibosh.org/cdgtools/
 
+import os
+
 
 # Take a cdrdao-produced TOC file and return track details etc
 def ParseToc (tocfilename):
@@ -90,3 +92,16 @@ def ParseToc (tocfilename):
 	return (binfilename, interleaved, trackStartByte, trackSizeBytes)
 
 
+# Get the details of a rip from its TOC file, as from ParseToc(), or
+# None if the TOC file can't be parsed. A relative bin filename is
+# looked for next to the TOC file first, so that rips kept in other
+# directories can be read.
+def ReadRip (tocfilename):
+	binfilename, interleaved, startBytes, trackSizeBytes = ParseToc (tocfilename)
+	if binfilename == None:
+		return (None)
+	if not os.path.isabs (binfilename):
+		besidetoc = os.path.join (os.path.dirname (tocfilename), binfilename)
+		if os.path.exists (besidetoc):
+			binfilename = besidetoc
+	return (binfilename, interleaved, startBytes, trackSizeBytes)
@@ -0,0 +1,332 @@
+#!/usr/bin/python
+
+# cdgdiff - cdgtools: Compare two CDG files or rips
+
+# Copyright (C) 2009  Kelvin Lawson (kelvinl@users.sf.net)
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+
+# OVERVIEW
+#
+# cdgdiff is part of the cdgtools suite of CD+G karaoke software.
+#
+# It compares the CD+G graphics of two tracks, each either a .cdg file
+# or a track of a cdrdao rip (a TOC file), and shows where they differ:
+# each range of differing packets, with its time in each track and the
+# instructions (see cdg2text.py) that each track has there.
+#
+# A rip often starts a few packets earlier or later than the .cdg file
+# it is compared against. So that the whole track isn't then shown as
+# different, cdgdiff first finds how far apart the tracks are: packets
+# from the first track are looked for in the second, and the offsets at
+# which they are found are each tried, keeping the one at which most
+# packets match.
+#
+# The tracks are compared a block of packets at a time. Blocks which
+# are the same are skipped with one comparison; otherwise the blocks are
+# XORed together in one go, and the differing packets found by ORing
+# together the 24 columns of the result (one byte per packet), so that
+# only the packets which differ are looked at one at a time.
+
+
+# REQUIREMENTS
+#
+# cdgdiff requires the following to be installed on your system:
+# . Python (www.python.org)
+
+
+# USAGE INSTRUCTIONS
+#
+# To compare two .cdg files:
+#       python cdgdiff.py reference.cdg theboxer.cdg
+#
+# To compare a .cdg file against track 3 of a rip:
+#       python cdgdiff.py --track 3 reference.cdg mycd.toc
+#
+# The exit status is 0 if the tracks are the same (once lined up), and
+# 1 if they differ. Packets which are only in one of the tracks (e.g. if
+# one is cut short) count as differences, unless they are blank.
+#
+# Run "python cdgdiff.py --help" for the full list of options.
+
+
+import sys, os, re, getopt
+import cdgdao, cdgparse, cdgpacks, cdgindex
+
+
+# Default largest offset between the tracks looked for, in seconds
+DEFAULT_MAX_OFFSET = 5
+
+# Default number of differing packets shown in each range
+DEFAULT_DETAILS = 5
+
+# Number of packets compared in one go
+BLOCK_PACKS = 4096
+
+# Number of packets of the first track looked for in the second when
+# finding the offset, and how many places each is looked for in
+DEFAULT_SAMPLES = 64
+MAX_MATCHES = 16
+
+_nonZero = re.compile (b"[^\x00]")
+
+
+# Read the CD+G data of a track: a .cdg file, or a track (counting from
+# 1) of a rip given by its TOC file. Returns None if there is no such
+# track.
+def LoadTrack (filename, track=1):
+	if os.path.splitext (filename)[1].lower() != ".toc":
+		cdgfile = open (filename, "rb")
+		try:
+			return (cdgpacks.CdgPacks (cdgfile.read()))
+		finally:
+			cdgfile.close()
+
+	rip = cdgdao.ReadRip (filename)
+	if rip == None:
+		return (None)
+	binfilename, interleaved, startBytes, trackSizeBytes = rip
+	if (track < 1) or (track > len(startBytes)):
+		return (None)
+	cdgdata = cdgparse.bin2cdg (binfilename, startBytes[track - 1], trackSizeBytes[track - 1])
+	if interleaved:
+		cdgdata = cdgparse.Deinterleave (cdgdata)
+	return (cdgpacks.CdgPacks (cdgdata))
+
+
+# Flag the differing packets of two equal length runs of packets, with
+# a non-zero byte for each packet which differs
+def _PackFlags (a, b):
+	difference = cdgpacks.XorBytes (a, b)
+	flags = difference[0::cdgpacks.PACK_SIZE]
+	for i in range (1, cdgpacks.PACK_SIZE):
+		flags = cdgpacks.OrBytes (flags, difference[i::cdgpacks.PACK_SIZE])
+	return (flags)
+
+
+# Get the range of packets of track a which line up with track b when
+# packet i of a is packet i + offset of b
+def Overlap (a, b, offset):
+	return (max (0, -offset), max (min (a.count, b.count - offset), 0))
+
+
+# Find the packets of track a which differ from track b, lined up with
+# the given offset. Yields the index in a of each differing packet.
+def DifferingPacks (a, b, offset=0):
+	first, last = Overlap (a, b, offset)
+	for start in range (first, last, BLOCK_PACKS):
+		end = min (start + BLOCK_PACKS, last)
+		blockA = a.masked[start * cdgpacks.PACK_SIZE:end * cdgpacks.PACK_SIZE]
+		blockB = b.masked[(start + offset) * cdgpacks.PACK_SIZE:(end + offset) * cdgpacks.PACK_SIZE]
+		if blockA == blockB:
+			continue
+		for match in _nonZero.finditer (_PackFlags (blockA, blockB)):
+			yield (start + match.start())
+
+# Count the packets which differ, without finding them
+def CountDiffering (a, b, offset=0):
+	first, last = Overlap (a, b, offset)
+	count = 0
+	for start in range (first, last, BLOCK_PACKS):
+		end = min (start + BLOCK_PACKS, last)
+		blockA = a.masked[start * cdgpacks.PACK_SIZE:end * cdgpacks.PACK_SIZE]
+		blockB = b.masked[(start + offset) * cdgpacks.PACK_SIZE:(end + offset) * cdgpacks.PACK_SIZE]
+		if blockA != blockB:
+			flags = _PackFlags (blockA, blockB)
+			count = count + len(flags) - flags.count (b"\x00")
+	return (count)
+
+
+# Find the offset (in packets) of track b from track a, up to maxOffset
+# packets either way, at which most packets match. Packet i of a is then
+# packet i + offset of b.
+def FindOffset (a, b, maxOffset, samples=DEFAULT_SAMPLES):
+	# Look for a spread of a's graphics packets in b, counting the
+	# offsets at which they are found
+	commands = a.Commands()
+	step = max (len(commands) // samples, 1)
+	found = {}
+	for index in commands[::step][:samples]:
+		pack = a.masked[index * cdgpacks.PACK_SIZE:(index + 1) * cdgpacks.PACK_SIZE]
+		lo = max (index - maxOffset, 0) * cdgpacks.PACK_SIZE
+		hi = min (index + maxOffset + 1, b.count) * cdgpacks.PACK_SIZE
+		position = b.masked.find (pack, lo, hi)
+		matches = 0
+		while (position != -1) and (matches < MAX_MATCHES):
+			if position % cdgpacks.PACK_SIZE == 0:
+				offset = (position // cdgpacks.PACK_SIZE) - index
+				found[offset] = found.get (offset, 0) + 1
+				matches = matches + 1
+			position = b.masked.find (pack, position + 1, hi)
+
+	# Try the most common offsets (and no offset), keeping the one with
+	# the most matching packets, or the smallest if there's a tie
+	candidates = sorted (found.keys(), key = lambda offset: -found[offset])[:8]
+	if 0 not in candidates:
+		candidates.append (0)
+	best = None
+	for offset in candidates:
+		first, last = Overlap (a, b, offset)
+		matching = (last - first) - CountDiffering (a, b, offset)
+		if (best == None) or ((matching, -abs (offset)) > best[0]):
+			best = ((matching, -abs (offset)), offset)
+	return (best[1])
+
+
+# Group the indexes of differing packets into ranges of consecutive
+# packets, as (first, last) pairs (last included)
+def Ranges (indexes):
+	ranges = []
+	for index in indexes:
+		if ranges and (ranges[-1][1] == index - 1):
+			ranges[-1][1] = index
+		else:
+			ranges.append ([index, index])
+	return ([tuple (indexrange) for indexrange in ranges])
+
+
+# Describe a packet range, with its times
+def _Describe (first, last):
+	return ("%d-%d (%s-%s)" % (first, last, cdgindex.FormatTime (first / float (cdgpacks.PACKS_PER_SECOND)),
+							   cdgindex.FormatTime (last / float (cdgpacks.PACKS_PER_SECOND))))
+
+# Describe one packet of a track: its instruction name, or the
+# instruction code if it isn't known
+def _PacketName (packs, index):
+	kind = packs.kind[index]
+	if kind == cdgpacks.CDG_INST_UNKNOWN:
+		return ("Unknown(%d)" % packs.instruction[index])
+	return (cdgpacks.KIND_NAMES[kind])
+
+
+# Count the packets of a track from start up to end which aren't blank
+def CountNotBlank (packs, start, end):
+	count = 0
+	for block in range (start, end, BLOCK_PACKS):
+		data = packs.masked[block * cdgpacks.PACK_SIZE:min (block + BLOCK_PACKS, end) * cdgpacks.PACK_SIZE]
+		flags = _PackFlags (data, b"\x00" * len(data))
+		count = count + len(flags) - flags.count (b"\x00")
+	return (count)
+
+
+# Compare two tracks, printing the differences. offset is the offset of
+# b from a (see FindOffset()), and details the most differing packets
+# shown in each range. Returns the number of differing packets. This
+# includes the packets which are only in one of the tracks, except for
+# blank ones, which draw nothing just as a missing packet doesn't.
+def cdgdiff (a, b, offset=0, details=DEFAULT_DETAILS, names=("A", "B")):
+	if offset == 0:
+		print ("-> Alignment: no offset")
+	else:
+		print ("-> Alignment: %s is %d packets (%s) %s than %s"
+				% (names[1], abs (offset), cdgindex.FormatTime (abs (offset) / float (cdgpacks.PACKS_PER_SECOND)),
+				   ("later", "earlier")[offset < 0], names[0]))
+
+	# Packets before and after the part the tracks have in common
+	first, last = Overlap (a, b, offset)
+	onlyIn = 0
+	for name, packs, start, end in ((names[0], a, 0, first), (names[1], b, 0, first + offset),
+									(names[0], a, last, a.count), (names[1], b, last + offset, b.count)):
+		if end > start:
+			notBlank = CountNotBlank (packs, start, end)
+			onlyIn = onlyIn + notBlank
+			print ("-> Only in %s: packets %s, %d not blank" % (name, _Describe (start, end - 1), notBlank))
+
+	ranges = Ranges (DifferingPacks (a, b, offset))
+	differing = sum ([(end - start) + 1 for start, end in ranges])
+	if differing + onlyIn == 0:
+		print ("-> No differences")
+		return (0)
+	if differing == 0:
+		print ("-> No differences where the tracks overlap")
+		return (onlyIn)
+	print ("-> Differences: %d packets in %d ranges" % (differing, len(ranges)))
+	for start, end in ranges:
+		print ("   %s %s, %s %s: %d packets" % (names[0], _Describe (start, end), names[1],
+												_Describe (start + offset, end + offset), (end - start) + 1))
+		for index in range (start, min (end + 1, start + details)):
+			packA = a.Packet (index)
+			packB = b.Packet (index + offset)
+			fields = [str (i) for i in range (cdgpacks.PACK_SIZE) if packA[i] != packB[i]]
+			print ("     %s  %-26s %-26s bytes %s" % (cdgindex.FormatTime (index / float (cdgpacks.PACKS_PER_SECOND)),
+													 _PacketName (a, index), _PacketName (b, index + offset),
+													 ",".join (fields)))
+		if end + 1 - start > details:
+			print ("     ... %d more" % (end + 1 - start - details))
+	return (differing + onlyIn)
+
+
+# Print out some instructions on error
+def usage():
+	print ("Usage:  %s [options] <CDG or TOC file> <CDG or TOC file>" % os.path.basename (sys.argv[0]))
+	print ("")
+	print ("Options:")
+	print ("  --track N                 :    Track of any TOC file to compare")
+	print ("                                 (default 1)")
+	print ("  --max-offset SECS         :    Largest offset between the tracks to")
+	print ("                                 look for (default %d, 0 for none)" % DEFAULT_MAX_OFFSET)
+	print ("  --details N               :    Show up to N differing packets of each")
+	print ("                                 range (default %d)" % DEFAULT_DETAILS)
+	print ("  -h, --help                :    Display this message")
+
+
+# Can be called from the command line with the two filenames as parameters
+def main():
+	try:
+		opts, args = getopt.getopt (sys.argv[1:], "h", ["help", "track=", "max-offset=", "details="])
+	except getopt.GetoptError:
+		usage()
+		sys.exit(2)
+	if len(args) != 2:
+		usage()
+		sys.exit(2)
+
+	track = 1
+	maxOffset = DEFAULT_MAX_OFFSET
+	details = DEFAULT_DETAILS
+	try:
+		for opt, arg in opts:
+			if opt in ("-h", "--help"):
+				usage()
+				sys.exit()
+			if opt == "--track":
+				track = int (arg)
+			if opt == "--max-offset":
+				maxOffset = float (arg)
+			if opt == "--details":
+				details = int (arg)
+	except ValueError:
+		usage()
+		sys.exit(2)
+
+	tracks = []
+	for name, filename in zip (("A", "B"), args):
+		packs = LoadTrack (filename, track)
+		if packs == None:
+			print ("cdgdiff: Error: no track %d in %s" % (track, filename))
+			sys.exit(2)
+		print ("-> %s: %s (%d packets, %s)" % (name, filename, packs.count,
+											   cdgindex.FormatTime (packs.count / float (cdgpacks.PACKS_PER_SECOND))))
+		tracks.append (packs)
+
+	offset = 0
+	if maxOffset > 0:
+		offset = FindOffset (tracks[0], tracks[1], int (maxOffset * cdgpacks.PACKS_PER_SECOND))
+	if cdgdiff (tracks[0], tracks[1], offset, details) > 0:
+		sys.exit(1)
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,328 @@
+# cdgecc - cdgtools: CD+G subcode error correction
+
+# Copyright (C) 2009  Kelvin Lawson (kelvinl@users.sf.net)
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+
+# OVERVIEW
+#
+# cdgecc is part of the cdgtools suite of CD+G karaoke software.
+#
+# This module checks and corrects the CD+G packs ripped from a disc,
+# using the Reed-Solomon parity carried in every pack. A scratched disc
+# otherwise gives damaged packs, which show up as garbage on screen.
+#
+# Each 24-byte pack holds 24 six-bit symbols:
+#
+#   0      - command
+#   1      - instruction
+#   2-3    - parity Q, an RS(4,2) code over symbols 0-3, which can
+#            correct one bad symbol in the command and instruction
+#   4-19   - data
+#   20-23  - parity P, an RS(24,20) code over the whole pack, which can
+#            correct up to two bad symbols anywhere in the pack
+#
+# Both codes are over GF(64) with the field polynomial x^6 + x + 1.
+# The field arithmetic uses log/antilog tables built when the module
+# is imported.
+#
+# Correction must be done on deinterleaved packs (see cdgparse.py). A
+# batch of packs is first checked in bulk: each pack position's share
+# of each syndrome is looked up for all the packs at once with
+# translate(), and the shares summed (XORed) as big integers. Only the
+# packs with a non-zero syndrome, of which there are none on a clean
+# disc, are then decoded one at a time. Packs which can't be corrected
+# are left as they are.
+#
+#   corrector = PackCorrector()
+#   for cdgchunk in ... deinterleaved CD+G data ...:
+#       cdgchunk = corrector.Feed (cdgchunk)
+#   print corrector.corrected, corrector.uncorrectable
+#
+# See cdgrip.py for an example application which utilises this module.
+#
+# For further details see http://www.kibosh.org/cdgtools/
+
+import re
+import cdgstats, cdgpacks
+
+
+# Pack layout
+PACK_SIZE = 24
+PACKS_PER_SECTOR = 4
+
+# GF(64) field polynomial x^6 + x + 1
+_FIELD_POLY = 0x43
+
+# Results of correcting a pack
+PACK_CLEAN = 0
+PACK_CORRECTED = 1
+PACK_UNCORRECTABLE = 2
+
+
+# Log and antilog tables. The antilog table is doubled up so that
+# _exp[log a + log b] never needs reducing mod 63.
+_exp = [0] * 126
+_log = [0] * 64
+_value = 1
+for _power in range (63):
+	_exp[_power] = _value
+	_exp[_power + 63] = _value
+	_log[_value] = _power
+	_value = _value << 1
+	if _value & 0x40:
+		_value = _value ^ _FIELD_POLY
+
+def _Mul (a, b):
+	if (a == 0) or (b == 0):
+		return (0)
+	return (_exp[_log[a] + _log[b]])
+
+def _Div (a, b):
+	if a == 0:
+		return (0)
+	return (_exp[(_log[a] - _log[b]) % 63])
+
+# a^power
+def _Pow (power):
+	return (_exp[power % 63])
+
+
+# Syndrome weights. Syndrome j of the P code weights symbol i by
+# a^(j * (23 - i)), and of the Q code weights symbol i (of 0-3) by
+# a^(j * (3 - i)).
+_pWeights = [[_Pow (j * (PACK_SIZE - 1 - i)) for i in range (PACK_SIZE)] for j in range (4)]
+_qWeights = [[_Pow (j * (3 - i)) for i in range (4)] for j in range (2)]
+
+# For each weight, the product of each symbol value with it. Symbols
+# are masked to six bits, in case the P and Q subchannel bits are set.
+def _Products (weight):
+	return ([_Mul (value & 0x3F, weight) for value in range (256)])
+
+_pProducts = [[_Products (weight) for weight in weights] for weights in _pWeights]
+_qProducts = [[_Products (weight) for weight in weights] for weights in _qWeights]
+
+# The same as translate() tables, for checking packs in bulk
+def _Table (products):
+	return (bytes (bytearray (products)))
+
+_pTables = [[_Table (products) for products in syndrome] for syndrome in _pProducts]
+_qTables = [[_Table (products) for products in syndrome] for syndrome in _qProducts]
+
+# Generator polynomial of the P code, (x - 1)(x - a)(x - a^2)(x - a^3),
+# highest power first
+_pGenerator = [1]
+for _root in range (4):
+	_next = _pGenerator + [0]
+	for _i in range (len(_pGenerator)):
+		_next[_i + 1] = _next[_i + 1] ^ _Mul (_pGenerator[_i], _Pow (_root))
+	_pGenerator = _next
+
+# Matches the packs with a non-zero syndrome
+_nonZero = re.compile (b"[^\x00]")
+
+
+# Get the P syndromes (4) and Q syndromes (2) of a pack
+def _PSyndromes (pack):
+	return ([_Syndrome (products, pack) for products in _pProducts])
+
+def _QSyndromes (pack):
+	return ([_Syndrome (products, pack) for products in _qProducts])
+
+def _Syndrome (products, pack):
+	syndrome = 0
+	for i in range (len(products)):
+		syndrome = syndrome ^ products[i][pack[i]]
+	return (syndrome)
+
+
+# Correct up to two bad symbols in a pack using the P parity. Returns
+# True if the pack is (now) a P codeword.
+def _CorrectP (pack):
+	s0, s1, s2, s3 = _PSyndromes (pack)
+	if (s0 | s1 | s2 | s3) == 0:
+		return (True)
+
+	# Symbol i is at location a^(23 - i). Try one error first: the
+	# syndromes are then e, eX, eX^2, eX^3.
+	if s0 != 0:
+		location = _Div (s1, s0)
+		if (location != 0) and (_Mul (s1, location) == s2) and (_Mul (s2, location) == s3):
+			i = PACK_SIZE - 1 - _log[location]
+			if i >= 0:
+				pack[i] = pack[i] ^ s0
+				return (True)
+
+	# Two errors: solve for the error locator x^2 + l1 x + l2, whose
+	# roots are the error locations
+	det = _Mul (s1, s1) ^ _Mul (s0, s2)
+	if det == 0:
+		return (False)
+	l1 = _Div (_Mul (s1, s2) ^ _Mul (s0, s3), det)
+	l2 = _Div (_Mul (s1, s3) ^ _Mul (s2, s2), det)
+	if l2 == 0:
+		return (False)
+	locations = []
+	for i in range (PACK_SIZE):
+		x = _Pow (PACK_SIZE - 1 - i)
+		if (_Mul (x, x) ^ _Mul (l1, x) ^ l2) == 0:
+			locations.append ((i, x))
+	if len(locations) != 2:
+		return (False)
+	(i1, x1), (i2, x2) = locations
+	e1 = _Div (s1 ^ _Mul (s0, x2), x1 ^ x2)
+	e2 = s0 ^ e1
+	pack[i1] = pack[i1] ^ e1
+	pack[i2] = pack[i2] ^ e2
+	return (max (_PSyndromes (pack)) == 0)
+
+
+# Correct one bad symbol in the command, instruction and Q parity using
+# the Q parity. Returns True if symbols 0-3 are (now) a Q codeword.
+def _CorrectQ (pack):
+	s0, s1 = _QSyndromes (pack)
+	if (s0 | s1) == 0:
+		return (True)
+	if (s0 == 0) or (s1 == 0):
+		return (False)
+	i = 3 - _log[_Div (s1, s0)]
+	if i < 0:
+		return (False)
+	pack[i] = pack[i] ^ s0
+	return (True)
+
+
+# Check whether a pack (24 six-bit symbols) passes both parity checks
+def CheckPack (pack):
+	return ((max (_PSyndromes (pack)) == 0) and (max (_QSyndromes (pack)) == 0))
+
+
+# Check and correct a single pack (a bytearray, corrected in place).
+# Returns PACK_CLEAN, PACK_CORRECTED or PACK_UNCORRECTABLE. The pack is
+# only changed if it could be fully corrected.
+def CorrectPack (pack):
+	if CheckPack (pack):
+		return (PACK_CLEAN)
+
+	# Try the P code on its own, then with the header fixed up first by
+	# the Q code (which may leave few enough errors for the P code).
+	# Either way the result must pass both checks.
+	for useQ in (False, True):
+		candidate = bytearray (pack)
+		if useQ and not _CorrectQ (candidate):
+			continue
+		if _CorrectP (candidate) and (max (_QSyndromes (candidate)) == 0):
+			pack[:] = candidate
+			return (PACK_CORRECTED)
+	return (PACK_UNCORRECTABLE)
+
+
+# Get the indexes of the packs in a batch which fail either parity
+# check, without decoding each pack. A pack passes if all its syndromes
+# are zero, so the syndromes of all the packs are summed at once,
+# position by position, with each pack's syndrome held in one byte of
+# a big integer.
+def _BadPacks (cdgdata, packs):
+	bad = 0
+	for tables, positions in ((_pTables, PACK_SIZE), (_qTables, 4)):
+		columns = [cdgdata[i:packs * PACK_SIZE:PACK_SIZE] for i in range (positions)]
+		for syndrome in tables:
+			total = 0
+			for i in range (positions):
+				total = total ^ cdgpacks.BytesToInt (columns[i].translate (syndrome[i]))
+			bad = bad | total
+	if bad == 0:
+		return ([])
+	flags = cdgpacks.IntToBytes (bad, packs)
+	return ([match.start() for match in _nonZero.finditer (flags)])
+
+
+# Check and correct a batch of deinterleaved packs (any whole number of
+# packs, plus any partial pack at the end which is passed through).
+# Returns (cdgdata, corrected, uncorrectable) with the corrected data
+# and the number of packs corrected and which couldn't be corrected.
+def CorrectPacks (cdgdata):
+	start = cdgstats.Start()
+	cdgdata = bytes (cdgdata)
+	packs = len(cdgdata) // PACK_SIZE
+	corrected = 0
+	uncorrectable = 0
+	if packs > 0:
+		bad = _BadPacks (cdgdata, packs)
+		if len(bad) > 0:
+			data = bytearray (cdgdata)
+			for index in bad:
+				offset = index * PACK_SIZE
+				pack = data[offset:offset + PACK_SIZE]
+				result = CorrectPack (pack)
+				if result == PACK_CORRECTED:
+					data[offset:offset + PACK_SIZE] = pack
+					corrected = corrected + 1
+				elif result == PACK_UNCORRECTABLE:
+					uncorrectable = uncorrectable + 1
+			cdgdata = bytes (data)
+	cdgstats.Stop (start, "ecc", len(cdgdata), len(cdgdata), packs // PACKS_PER_SECTOR)
+	return (cdgdata, corrected, uncorrectable)
+
+
+# Fill in the Q and P parity of a pack (a list or bytearray of 24
+# symbols, of which the command, instruction and data are used).
+# Returns the pack as a bytearray.
+def EncodePack (pack):
+	pack = bytearray (pack)
+	for i in range (PACK_SIZE):
+		pack[i] = pack[i] & 0x3F
+
+	# Q parity: symbols 2 and 3 make both Q syndromes zero
+	a = pack[0] ^ pack[1]
+	b = _Mul (pack[0], _Pow (3)) ^ _Mul (pack[1], _Pow (2))
+	pack[2] = _Div (a ^ b, _Pow (1) ^ 1)
+	pack[3] = a ^ pack[2]
+
+	# P parity: the remainder of the pack divided by the generator
+	remainder = [0, 0, 0, 0]
+	for symbol in pack[:PACK_SIZE - 4]:
+		feedback = symbol ^ remainder[0]
+		remainder = remainder[1:] + [0]
+		for i in range (4):
+			remainder[i] = remainder[i] ^ _Mul (feedback, _pGenerator[i + 1])
+	pack[PACK_SIZE - 4:] = bytearray (remainder)
+	return (pack)
+
+
+# PackCorrector Class
+#
+# Corrects a track's packs as they are ripped, a chunk at a time, and
+# counts the packs seen, corrected and left uncorrectable. Feed() it
+# deinterleaved CD+G data in whole packs (such as the output of a
+# cdgparse.Deinterleaver) and it returns the corrected data.
+class PackCorrector:
+	def __init__(self):
+		self.packs = 0
+		self.corrected = 0
+		self.uncorrectable = 0
+
+	def Feed (self, cdgdata):
+		cdgdata, corrected, uncorrectable = CorrectPacks (cdgdata)
+		self.packs = self.packs + (len(cdgdata) // PACK_SIZE)
+		self.corrected = self.corrected + corrected
+		self.uncorrectable = self.uncorrectable + uncorrectable
+		return (cdgdata)
+
+	# Describe the results for display
+	def Summary (self):
+		return ("%d of %d packs corrected, %d uncorrectable"
+				% (self.corrected, self.packs, self.uncorrectable))
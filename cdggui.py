@@ -88,8 +88,7 @@
 
 
 import wx
-from threading import *
-import cdgtools, cdgdao, cdgparse, cdgcddb
+import cdgtools, cdgdao, cdgparse, cdgcddb, cdgpipe
 import os, time, sys, types
 
 TITLE_STRING = "cdgtools %s" % cdgtools.VERSION_STRING
@@ -106,9 +105,6 @@ class SettingsStruct:
 		self.DestDir		= DestDir			# Destination directory for MP3+G files
 		self.LameLoc		= LameLoc			# Lame executable location
 
-# Define notification event for worker thread completion
-EVT_DONE_ID = wx.NewId()
-
 
 # Generic function for popping up errors
 def ErrorPopup (ErrorString):
@@ -303,11 +299,6 @@ class cdgtoolsWindow(wx.Frame):
 		wx.EVT_MENU(self, self.idEncode, self.OnEncode)
 		wx.EVT_MENU(self, self.idRescanCDDB, self.OnRescanCDDB)
 
-		# Set up event handler for worker thread done event
-		EVT_DONE(self, self.OnThreadDone)
-		self.ThreadDone = False
-		self.worker = None
-
 
 	def OnOpen(self,e):
 		dlg = wx.FileDialog(self)
@@ -416,10 +407,6 @@ class cdgtoolsWindow(wx.Frame):
 		# Return True if we should keep going, otherwise cancel was clicked
 		return (cont)
 
-	def OnThreadDone(self, event):
-		self.ThreadDone = True
-		self.worker = None
-
 	# Encode from main menu (encodes all tracks)
 	def OnEncode (self,e):
 		# Create a list of all tracks
@@ -437,144 +424,95 @@ class cdgtoolsWindow(wx.Frame):
 			# Set the binfile and tocfile locations (assume same dir)
 			binfilepath = os.path.join (self.tocDirName, self.binfilename)
 			tocfilepath = os.path.join (self.tocDirName, self.tocFileName)
-			tmpfilepath = os.path.join(self.Settings.DestDir, "temp.pcm")
 
 			# Check the binfile exists
 			if (not os.path.isfile(binfilepath)):
 				ErrorPopup("Bin file %s does not exist" % binfilepath)
 			else:
 
-				# Create a progress dialog.
-				# The progress bar just treats each track as the same size, so
-				# for 5 tracks, the update values are 20, 40, 60, 80, 100 (complete).
+				# Create a progress dialog. The progress bar follows the
+				# sectors encoded out of the total for all the tracks.
 				progressDlg = wx.ProgressDialog ("Please wait...", "Encoding tracks",
 								style=(wx.PD_CAN_ABORT | wx.PD_AUTO_HIDE | wx.PD_APP_MODAL))
 				keep_going = True
 
-				# Loop through encoding each requested track
+				# Use configured lame location. If not configured, hope it's in the path
+				if self.Settings.LameLoc == "":
+					lameloc = "lame"
+				else:
+					lameloc = self.Settings.LameLoc
+
+				# Map the bin file once, to be shared by all of the tracks
+				binimage = cdgparse.BinImage (binfilepath, self.startBytes, self.trackSizeBytes)
+
+				# Now palm off the ripping and encoding to the rip pipeline's
+				# threads, so that track N+1 is read while track N is still
+				# being encoded. This also allows the GUI to be updated because
+				# lame isn't run in the GUI thread context. Only the error
+				# lines of the log are kept, to be reported at the end.
+				errors = []
+				def KeepErrors (message):
+					if message.startswith ("-> ERROR"):
+						errors.append (message[3:])
+				# Keep the latest progress report from the pipeline, to be
+				# shown by the GUI thread
+				latest = [(0, 0, 0.0)]
+				def KeepProgress (done, total, rate):
+					latest[0] = (done, total, rate)
+				pipeline = cdgpipe.RipPipeline (binimage, self.interleaved,
+								log = cdgpipe.OrderedLog (output = KeepErrors),
+								progress = KeepProgress)
 				for track in trackNumList:
-
-					# Update the progress bar. If cancel was pressed, quit at this point
-					if num_tracks > 1:
-						progress = (100 / num_tracks) * (track + 1)
-					else:
-						progress = 50
-					keep_going = self.SetProgress (progressDlg, progress, 
-									"Track %d: Ripping audio" % (track + 1))
-					if keep_going == False:
-						break
+					trackname = self.TracksPanel.GetItemText (track)
+					fullmp3path = os.path.join (self.Settings.DestDir, "%s.mp3" % trackname)
+					fullcdgpath = os.path.join (self.Settings.DestDir, "%s.cdg" % trackname)
+					pipeline.AddTrack (self.startBytes[track], self.trackSizeBytes[track],
+									fullcdgpath, cdgparse.LameCommand (fullmp3path, lameloc),
+									trackname)
+				pipeline.Start()
+
+				while not pipeline.Finished():
+					# Update the progress bar with the sectors encoded so far,
+					# and the track being read. If cancel was pressed, stop
+					# reading the bin file (the tracks already started are
+					# finished off).
+					current = pipeline.CurrentTrack() or 0
+					done, total, rate = latest[0]
+					if total > 0:
+						progress = min ((100 * done) // total, 99)
+						status = cdgparse.ProgressText (done, total, rate)
 					else:
-						# Rip the audio to a raw PCM file
-						pcmdata = cdgparse.bin2pcm (binfilepath,
-										self.startBytes[track],	self.trackSizeBytes[track])
-						cdgparse.pcmWriteToFile (tmpfilepath, pcmdata)
-						if (not os.path.isfile(tmpfilepath)):
-							ErrorPopup("Cannot find raw audio rip (%s)" % tmpfilename)
-							keep_going = False
-							break
-
-						# Update the progress bar. If cancel was pressed, quit at this point
-						keep_going = self.SetProgress (progressDlg, progress, 
-										"Track %d: MP3 encoding" % (track + 1))
-						if keep_going == False:
-							break
-		
-						# Encode with lame
-						mp3name = "%s.mp3" % self.TracksPanel.GetItemText (track)
-						# Quote any songnames with spaces in before calling lame
-						if mp3name.find(" ") != -1:
-							mp3name = "\"%s\"" % mp3name
-						# Use configured lame location. If not configured, hope it's in the path
-						if self.Settings.LameLoc == "":
-							lameloc = "lame"
-						else:
-							lameloc = self.Settings.LameLoc
-						# Create the lame string
-						fullmp3path = os.path.join (self.Settings.DestDir, mp3name)
-						lame_string = "%s -r --silent --cbr --big-endian %s %s" % (lameloc, tmpfilepath, fullmp3path)
-
-						# Now palm off the actual execution of lame to another thread.
-						# This allows the GUI to be updated because lame isn't run in
-						# the GUI thread context.
-						self.ThreadDone = False
-						self.worker = WorkerThread (self, lame_string)
-						while (self.ThreadDone == False):
-							# Repaint once per second
-							time.sleep(1)
-							wx.Yield()
-
-						# Update the progress bar. If cancel was pressed, quit at this point
-						keep_going = self.SetProgress (progressDlg, progress, 
-										"Track %d: Ripping CD+G data" % (track + 1))
-						if keep_going == False:
-							break
-		
-						# Rip the CD+G subchannel data
-						cdgdata = cdgparse.bin2cdg (binfilepath,
-										self.startBytes[track], self.trackSizeBytes[track])
-
-						# Deinterleave if the data is in raw format
-						if (self.interleaved):
-							# Update the progress bar. If cancel was pressed, quit at this point
-							keep_going = self.SetProgress (progressDlg, progress, 
-											"Track %d: CD+G Deinterleaving" % (track + 1))
-							if keep_going == False:
-								break
-							cdgdata = cdgparse.Deinterleave (cdgdata)
-
-						# Update the progress bar. If cancel was pressed, quit at this point
+						progress = 0
+						status = "Starting"
+					if keep_going == True:
 						keep_going = self.SetProgress (progressDlg, progress,
-										"Track %d: Writing CDG file" % (track + 1))
+										"Track %d: Ripping and MP3 encoding\n%s"
+										% (trackNumList[current] + 1, status))
 						if keep_going == False:
-							break
-	
-						# Write the finished CDG data out to a file
-						cdgname = "%s.cdg" % self.TracksPanel.GetItemText (track)
-						fullcdgpath = os.path.join(self.Settings.DestDir, cdgname)
-						cdgparse.cdgWriteToFile (fullcdgpath, cdgdata)
+							pipeline.Cancel()
+					# Repaint twice per second, as often as the progress is reported
+					time.sleep(cdgparse.PROGRESS_INTERVAL)
+					wx.Yield()
+
+				# Report any failures
+				if len(errors) > 0:
+					ErrorPopup ("\n".join (errors))
+				failed = pipeline.Failed()
+
+				binimage.close()
 		
-				# Finished, remove the TOC/BIN if requested (and encode wasn't cancelled)
-				if (self.Settings.DeleteTocBin == True) and (keep_going == True):
+				# Finished, remove the TOC/BIN if requested (and encode wasn't
+				# cancelled, and no tracks failed)
+				if (self.Settings.DeleteTocBin == True) and (keep_going == True) \
+						and (len(failed) == 0):
 					os.unlink(tocfilepath)
 					os.unlink(binfilepath)
 
-				# Delete the temporary PCM audio file
-				if os.path.isfile(tmpfilepath):
-					os.unlink (tmpfilepath)
-
 				# Update the progress dialog
 				self.SetProgress (progressDlg, 100, "Finished encoding all tracks")
 				progressDlg = None
 		
 
-# Thread done event installer
-def EVT_DONE(win, func):
-	win.Connect(-1, -1, EVT_DONE_ID, func)
-
-
-# Thread done handler
-class ThreadDoneEvent(wx.PyEvent):
-	def __init__(self, data):
-		wx.PyEvent.__init__(self)
-		self.SetEventType(EVT_DONE_ID)
-		self.data = data
-
-
-# Thread class that executes lame - so that not run in the GUI thread
-class WorkerThread(Thread):
-	def __init__(self, notify_window, execute_string):
-		Thread.__init__(self)
-		self.notify_window = notify_window
-		self.execute_string = execute_string
-		self.start()
-
-	def run(self):
-		# Execute lame within a secondary thread
-		os.system (self.execute_string)
-		# Post the event, not actually passing any data at the moment
-		wx.PostEvent(self.notify_window, ThreadDoneEvent(0))
-
-
 # Start the wx app
 def StartGUI():
 	cdgtoolsApp = wx.PySimpleApp()
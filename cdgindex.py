@@ -0,0 +1,278 @@
+# cdgindex - cdgtools: Time index of CDG files
+
+# Copyright (C) 2009  Kelvin Lawson (kelvinl@users.sf.net)
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+
+# OVERVIEW
+#
+# cdgindex is part of the cdgtools suite of CD+G karaoke software.
+#
+# This module answers questions like "which colour table loads happen
+# between 1:00 and 1:30?" about a .cdg file, without decoding the whole
+# file each time. Packets are played at 300 per second, so a packet's
+# position in the file gives both its byte offset (24 bytes per packet)
+# and its time.
+#
+# The index holds, for each kind of CD+G instruction (see cdgpacks.py),
+# the sorted positions of the packets of that kind. It is built once,
+# with cdgpacks, and saved next to the .cdg file (theboxer.cdg has the
+# index theboxer.cdgidx) as a compact binary file of 4 bytes per
+# graphics packet. The saved index is used as long as the .cdg file's
+# size and modification time are unchanged, and otherwise rebuilt.
+#
+# A query finds the range of each requested kind by bisecting its
+# positions, and merges them into time order. Only the packets that
+# are returned are read from the .cdg file, as they are used:
+#
+#   index = cdgindex.CdgIndex ("theboxer.cdg")
+#   for pack in index.Query (60, 90, [cdgpacks.CDG_INST_LOAD_COL_TBL_0_7,
+#                                     cdgpacks.CDG_INST_LOAD_COL_TBL_8_15]):
+#       print pack.time, pack.offset, pack.kind, list (pack.Data())
+#
+# See cdg2text.py for an example application which utilises this module.
+#
+# For further details see http://www.kibosh.org/cdgtools/
+
+import os, sys, re, math, struct, array, bisect, heapq
+import cdgpacks
+
+
+# Version of the index file format
+INDEX_VERSION = 1
+
+# Index file header: magic, version, .cdg file size and mtime, and the
+# number of kinds. Each kind then has its code and number of positions,
+# followed by the positions as 4-byte little-endian integers.
+_MAGIC = b"CDGIDX"
+_header = struct.Struct ("<6sHQQI")
+_kindHeader = struct.Struct ("<BI")
+
+# Every kind of packet which is indexed
+INDEXED_KINDS = cdgpacks.CDG_INSTRUCTIONS + (cdgpacks.CDG_INST_UNKNOWN,)
+
+
+# Get the index filename for a .cdg file
+def IndexName (cdgfilename):
+	return (os.path.splitext (cdgfilename)[0] + ".cdgidx")
+
+
+# Convert a time in seconds to a packet position, rounding up
+def TimeToPack (seconds):
+	return (int (math.ceil (round (seconds * cdgpacks.PACKS_PER_SECOND, 6))))
+
+
+# Format a time in seconds as minutes:seconds
+def FormatTime (seconds):
+	return ("%d:%06.3f" % (seconds // 60, seconds % 60))
+
+
+# Make a new array of positions
+def _Positions ():
+	positions = array.array ("I")
+	if positions.itemsize != 4:
+		positions = array.array ("L")
+	return (positions)
+
+
+# IndexedPack Class
+#
+# One packet returned by a query. Its position, offset, time and kind
+# come from the index. The packet itself is only read from the .cdg
+# file (and masked with CDG_MASK) when Packet() or Data() is called.
+class IndexedPack:
+	def __init__(self, index, position, kind):
+		self.cdgIndex = index
+		self.position = position
+		self.offset = position * cdgpacks.PACK_SIZE
+		self.time = float (position) / cdgpacks.PACKS_PER_SECOND
+		self.kind = kind
+		self.packet = None
+
+	# Get the whole (masked) packet, as a bytearray
+	def Packet (self):
+		if self.packet == None:
+			self.packet = self.cdgIndex._ReadPacket (self.offset)
+		return (self.packet)
+
+	# Get the 16 (masked) data bytes, as a bytearray
+	def Data (self):
+		return (self.Packet()[4:20])
+
+	# Get the (masked) instruction code, which for unknown instructions
+	# isn't the same as the kind
+	def Instruction (self):
+		return (self.Packet()[1])
+
+
+# CdgIndex Class
+#
+# The index of a .cdg file, loaded from the saved index if it's still
+# valid, and otherwise built (and saved, unless save is False). If the
+# index can't be saved (e.g. the directory is read-only) it is just
+# kept in memory.
+class CdgIndex:
+	def __init__(self, cdgfilename, save=True):
+		self.FileName = cdgfilename
+		self.indexFileName = IndexName (cdgfilename)
+		cdgstat = os.stat (cdgfilename)
+		self.size = cdgstat.st_size
+		self.mtime = int (cdgstat.st_mtime)
+		self.count = self.size // cdgpacks.PACK_SIZE
+		self.cdgfile = None
+
+		self.positions = self._Load()
+		if self.positions == None:
+			self.positions = self._Build()
+			if save:
+				try:
+					self._Save()
+				except (IOError, OSError):
+					pass
+
+	# Close the .cdg file, if any packets have been read
+	def close (self):
+		if self.cdgfile != None:
+			self.cdgfile.close()
+			self.cdgfile = None
+
+	# Get the length of the file in seconds
+	def Duration (self):
+		return (float (self.count) / cdgpacks.PACKS_PER_SECOND)
+
+	# Count the packets of a kind
+	def Count (self, kind):
+		return (len(self.positions.get (kind, ())))
+
+	# Get the times (in seconds) of all the packets of a kind
+	def Times (self, kind):
+		return ([float (position) / cdgpacks.PACKS_PER_SECOND
+					for position in self.positions.get (kind, ())])
+
+	# Find the packets from start seconds up to (but not including) end
+	# seconds, of the given kinds (default all the graphics packets).
+	# Returns a list of IndexedPacks in time order.
+	def Query (self, start=None, end=None, kinds=None):
+		if kinds == None:
+			kinds = INDEXED_KINDS
+		first = 0
+		if start != None:
+			first = max (TimeToPack (start), 0)
+		last = self.count
+		if end != None:
+			last = min (TimeToPack (end), self.count)
+
+		ranges = []
+		for kind in kinds:
+			positions = self.positions.get (kind)
+			if not positions:
+				continue
+			lo = bisect.bisect_left (positions, first)
+			hi = bisect.bisect_left (positions, last)
+			if hi > lo:
+				ranges.append ([(position, kind) for position in positions[lo:hi]])
+		if len(ranges) == 1:
+			merged = ranges[0]
+		else:
+			merged = heapq.merge (*ranges)
+		return ([IndexedPack (self, position, kind) for position, kind in merged])
+
+	# Find the last packet of one of the given kinds before time seconds
+	# (e.g. the colour table load in effect at a given time). Returns an
+	# IndexedPack, or None if there isn't one.
+	def Before (self, time, kinds):
+		target = TimeToPack (time)
+		best = None
+		for kind in kinds:
+			positions = self.positions.get (kind)
+			if not positions:
+				continue
+			i = bisect.bisect_left (positions, target)
+			if (i > 0) and ((best == None) or (positions[i - 1] > best[0])):
+				best = (positions[i - 1], kind)
+		if best == None:
+			return (None)
+		return (IndexedPack (self, best[0], best[1]))
+
+	# Build the index by decoding the whole file
+	def _Build (self):
+		kinds = bytes (cdgpacks.LoadFile (self.FileName).kind)
+		index = {}
+		for kind in INDEXED_KINDS:
+			positions = _Positions()
+			positions.extend ([match.start() for match in
+								re.finditer (re.escape (bytes (bytearray ([kind]))), kinds)])
+			if len(positions) > 0:
+				index[kind] = positions
+		return (index)
+
+	# Load the saved index. Returns None if there isn't one, or it is
+	# out of date or unreadable.
+	def _Load (self):
+		try:
+			indexfile = open (self.indexFileName, "rb")
+		except IOError:
+			return (None)
+		try:
+			try:
+				magic, version, size, mtime, kinds = _header.unpack (indexfile.read (_header.size))
+				if (magic != _MAGIC) or (version != INDEX_VERSION) or (size != self.size) \
+						or (mtime != self.mtime):
+					return (None)
+				index = {}
+				for i in range (kinds):
+					kind, count = _kindHeader.unpack (indexfile.read (_kindHeader.size))
+					data = indexfile.read (count * 4)
+					if len(data) != count * 4:
+						return (None)
+					positions = _Positions()
+					positions.fromstring (data)
+					if sys.byteorder == "big":
+						positions.byteswap()
+					index[kind] = positions
+				return (index)
+			except (struct.error, ValueError, EOFError):
+				return (None)
+		finally:
+			indexfile.close()
+
+	# Save the index, to a temporary file which is then renamed over the
+	# old one
+	def _Save (self):
+		tempname = "%s.%d.tmp" % (self.indexFileName, os.getpid())
+		indexfile = open (tempname, "wb")
+		try:
+			indexfile.write (_header.pack (_MAGIC, INDEX_VERSION, self.size, self.mtime,
+										   len(self.positions)))
+			for kind in sorted (self.positions.keys()):
+				positions = self.positions[kind]
+				indexfile.write (_kindHeader.pack (kind, len(positions)))
+				if sys.byteorder == "big":
+					positions = array.array (positions.typecode, positions)
+					positions.byteswap()
+				indexfile.write (positions.tostring())
+		finally:
+			indexfile.close()
+		if os.name == "nt" and os.path.exists (self.indexFileName):
+			os.unlink (self.indexFileName)
+		os.rename (tempname, self.indexFileName)
+
+	# Read a packet from the .cdg file
+	def _ReadPacket (self, offset):
+		if self.cdgfile == None:
+			self.cdgfile = open (self.FileName, "rb")
+		self.cdgfile.seek (offset)
+		return (bytearray (cdgpacks.Mask (self.cdgfile.read (cdgpacks.PACK_SIZE))))
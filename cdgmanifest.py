@@ -0,0 +1,183 @@
+# cdgmanifest - cdgtools: Rip progress manifest
+
+# Copyright (C) 2009  Kelvin Lawson (kelvinl@users.sf.net)
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+
+# OVERVIEW
+#
+# cdgmanifest is part of the cdgtools suite of CD+G karaoke software.
+#
+# This module keeps a record of how far a rip has got, so that a rip
+# which was interrupted part way through (killed, out of memory, or an
+# encoder crash) can be restarted without redoing the tracks which were
+# already finished.
+#
+# The manifest is kept next to the TOC file (mycd.toc has the manifest
+# mycd.manifest). It records the size and modification time of the bin
+# file, and for each finished track the byte range of the track within
+# the bin file, the rip options which affect the output files (such as
+# the encoder command and error correction), and the size and MD5
+# checksum of each output file:
+#
+#   manifest = RipManifest ("mycd.toc", binfilename)
+#   if not manifest.IsDone ("track01", startByte, trackSize, outputs, options):
+#       ... rip track01 to the files in outputs ...
+#       manifest.TrackDone ("track01", startByte, trackSize, outputs, options)
+#
+# A track only counts as done if its byte range and rip options are
+# unchanged and all of its output files are still there with the
+# recorded size and checksum. If the bin file has changed since the
+# manifest was written (i.e. it was ripped again), the whole manifest
+# is thrown away.
+#
+# The manifest is rewritten after every finished track, to a temporary
+# file which is then renamed over the old one, so an interruption
+# never leaves a half-written manifest behind.
+#
+# See cdgrip.py for an example application which utilises this module.
+#
+# For further details see http://www.kibosh.org/cdgtools/
+
+import os, threading, hashlib, json
+
+
+# Version of the manifest file format
+MANIFEST_VERSION = 2
+
+# Size of the reads used when checksumming an output file
+CHECKSUM_CHUNK = 1024 * 1024
+
+
+# Get the manifest filename for a TOC file
+def ManifestName (tocfilename):
+	return (os.path.splitext (tocfilename)[0] + ".manifest")
+
+
+# Get the size and MD5 checksum (as a hex string) of a file
+def FileChecksum (filename):
+	md5 = hashlib.md5()
+	size = 0
+	infile = open (filename, "rb")
+	try:
+		while True:
+			data = infile.read (CHECKSUM_CHUNK)
+			if not data:
+				break
+			md5.update (data)
+			size = size + len(data)
+	finally:
+		infile.close()
+	return (size, md5.hexdigest())
+
+
+# Track names (from CDDB) and filenames may not be ASCII, and we don't
+# know their encoding. They are stored in the manifest as latin-1, which
+# keeps the original bytes, and converted back to the original bytes
+# when the manifest is loaded.
+def _Name (name):
+	return (name.encode ("latin-1"))
+
+
+# RipManifest Class
+#
+# Loads the manifest for a TOC file (if there is one) and keeps it up to
+# date as tracks are finished. TrackDone() may be called from several
+# threads at once.
+class RipManifest:
+	def __init__(self, tocfilename, binfilename):
+		self.filename = ManifestName (tocfilename)
+		self.lock = threading.Lock()
+
+		# Record the state of the bin file the tracks are ripped from
+		binstat = os.stat (binfilename)
+		self.bin = {"name": os.path.basename (binfilename),
+					"size": binstat.st_size, "mtime": int (binstat.st_mtime)}
+		self.tracks = {}
+
+		# Load the tracks from the previous manifest, if it was for
+		# the same bin file. Anything unreadable is just ignored.
+		try:
+			manifestfile = open (self.filename, "r")
+			try:
+				previous = json.load (manifestfile)
+			finally:
+				manifestfile.close()
+			previous["bin"]["name"] = _Name (previous["bin"]["name"])
+			if (previous.get ("version") == MANIFEST_VERSION) and (previous["bin"] == self.bin):
+				for trackname, entry in previous["tracks"].items():
+					entry["files"] = dict ([(_Name (filename), details)
+								for filename, details in entry["files"].items()])
+					self.tracks[_Name (trackname)] = entry
+		except (IOError, ValueError, TypeError, AttributeError, KeyError, UnicodeError):
+			pass
+
+	# Check whether a track was finished by a previous rip. outputs is
+	# the list of output filenames for the track, and options a
+	# dictionary of the rip options which affect them (which must be
+	# JSON serialisable, and the same as when the track was done).
+	def IsDone (self, trackname, startByte, trackSize, outputs, options=None):
+		entry = self.tracks.get (trackname)
+		if (entry == None) or (entry.get ("start") != startByte) or (entry.get ("size") != trackSize):
+			return (False)
+		if entry.get ("options") != options:
+			return (False)
+		files = entry.get ("files", {})
+		if sorted (files.keys()) != sorted (outputs):
+			return (False)
+		for filename in outputs:
+			# Compare the size first, to avoid reading files which are
+			# obviously wrong
+			try:
+				if os.path.getsize (filename) != files[filename]["size"]:
+					return (False)
+				if FileChecksum (filename) != (files[filename]["size"], files[filename]["md5"]):
+					return (False)
+			except (OSError, IOError, KeyError, TypeError):
+				return (False)
+		return (True)
+
+	# Record a finished track, and write out the updated manifest
+	def TrackDone (self, trackname, startByte, trackSize, outputs, options=None):
+		files = {}
+		for filename in outputs:
+			size, md5 = FileChecksum (filename)
+			files[filename] = {"size": size, "md5": md5}
+		self.lock.acquire()
+		try:
+			self.tracks[trackname] = {"start": startByte, "size": trackSize, "options": options,
+									  "files": files}
+			self._Save()
+		finally:
+			self.lock.release()
+
+	# Delete the manifest file (e.g. when the bin file is deleted)
+	def Remove (self):
+		if os.path.exists (self.filename):
+			os.unlink (self.filename)
+
+	def _Save (self):
+		tempname = self.filename + ".tmp"
+		manifestfile = open (tempname, "w")
+		try:
+			json.dump ({"version": MANIFEST_VERSION, "bin": self.bin, "tracks": self.tracks},
+						manifestfile, indent = 1, sort_keys = True, encoding = "latin-1")
+		finally:
+			manifestfile.close()
+		if os.name == "nt" and os.path.exists (self.filename):
+			# rename() won't replace an existing file on Windows
+			os.unlink (self.filename)
+		os.rename (tempname, self.filename)
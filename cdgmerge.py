@@ -0,0 +1,424 @@
+#!/usr/bin/python
+
+# cdgmerge - cdgtools: Merge several rips of a CD+G disk
+
+# Copyright (C) 2009  Kelvin Lawson (kelvinl@users.sf.net)
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+
+# OVERVIEW
+#
+# cdgmerge is part of the cdgtools suite of CD+G karaoke software.
+#
+# A scratched disk often gives a few bad subchannel bytes when it is
+# ripped, but usually in different places on each rip. cdgmerge takes
+# two or more cdrdao rips (BIN and TOC files) of the same disk, and
+# builds one repaired rip from them, which can then be passed to cdgrip
+# as usual.
+#
+# The rips are lined up track by track, using the track start offsets
+# in each TOC file, and every subchannel byte (and optionally every
+# audio byte) is decided by a majority vote between the rips. The vote
+# is done a block of sectors at a time over the whole block at once:
+# blocks which are the same in every rip are simply copied, and
+# otherwise the number of rips agreeing with each rip is counted for
+# every byte at once, one byte per byte position of a big integer.
+#
+# Where there is no majority (which is always the case for a byte that
+# differs between just two rips) the CD+G pack holding the byte is
+# looked at. Each combination of the rips' values for its undecided
+# bytes is tried, and the first which passes the pack's Reed-Solomon
+# parity checks (see cdgecc.py) is used. Otherwise the first rip's byte
+# is kept. Audio bytes without a majority are kept from the first rip.
+#
+# The number of bytes which differed in each track, and how they were
+# decided, is shown as the rips are merged.
+
+
+# REQUIREMENTS
+#
+# cdgmerge requires the following to be installed on your system:
+# . Python (www.python.org)
+
+
+# USAGE INSTRUCTIONS
+#
+# Rip the disk two or more times with cdrdao, e.g. once on each of two
+# drives, then merge the rips:
+#       python cdgmerge.py --output mycd.toc rip1.toc rip2.toc rip3.toc
+#
+# This writes mycd.toc and mycd.bin, which can be passed to cdgrip:
+#       python cdgrip.py mycd.toc
+#
+# The audio is taken from the first rip unless --audio is given, in
+# which case the audio is voted on too.
+#
+# Run "python cdgmerge.py --help" for the full list of options.
+
+
+import sys, os, getopt, re, itertools
+import cdgtools, cdgdao, cdgparse, cdgecc, cdgpacks
+
+
+TITLE_STRING = " cdgmerge %s / Kelvin Lawson 2005" % cdgtools.VERSION_STRING
+DELIMITER = ("-----------------------------------------------------------")
+
+# Most combinations of values tried for the undecided bytes of a pack
+MAX_COMBINATIONS = 256
+
+# Size of the pieces a block is voted on in, so that only the pieces
+# which differ are worked on
+VOTE_CHUNK = 1024
+
+# Translate tables to flag bytes which are zero (with 1), and to clear
+# flags (0xFF to 0 and 0 to 0xFF)
+_zeroFlag = bytes (bytearray ([int (byte == 0) for byte in range (256)]))
+_invert = bytes (bytearray ([byte ^ 0xFF for byte in range (256)]))
+
+_nonZero = re.compile (b"[^\x00]")
+
+# Position in the subchannel stream of each of the 24 bytes of a pack,
+# relative to 24 times the pack number, in the raw (interleaved) layout,
+# and the pack byte found at each position modulo 24. The offsets are
+# all different modulo 24, so the pack holding any byte can be found.
+_rawPositions = cdgparse.offsets
+_rawColumns = dict ([(_rawPositions[column] % cdgecc.PACK_SIZE, column)
+					 for column in range (cdgecc.PACK_SIZE)])
+
+
+# Vote on each byte of some equal length strings of bytes, one from
+# each rip. Returns the result (taking the first string's byte where
+# there is no majority), the number of bytes which differed, and the
+# positions of the bytes without a majority.
+def Vote (blocks):
+	reference = blocks[0]
+	size = len(reference)
+	if all ([block == reference for block in blocks[1:]]):
+		return (reference, 0, [])
+	if size > VOTE_CHUNK:
+		results = []
+		differing = 0
+		undecided = []
+		for offset in range (0, size, VOTE_CHUNK):
+			result, differ, positions = Vote ([block[offset:offset + VOTE_CHUNK] for block in blocks])
+			results.append (result)
+			differing = differing + differ
+			undecided.extend ([offset + position for position in positions])
+		return (b"".join (results), differing, undecided)
+
+	# Count, for every byte of every block, how many of the other blocks
+	# have the same byte. A count can't reach 256, so one byte of a big
+	# integer holds each byte's count without carrying into the next.
+	values = [cdgpacks.BytesToInt (block) for block in blocks]
+	votes = [0] * len(blocks)
+	differ = 0
+	for i in range (len(blocks)):
+		for j in range (i + 1, len(blocks)):
+			equal = cdgpacks.BytesToInt (cdgpacks.IntToBytes (values[i] ^ values[j], size).translate (_zeroFlag))
+			votes[i] = votes[i] + equal
+			votes[j] = votes[j] + equal
+		if i > 0:
+			differ = differ | (values[0] ^ values[i])
+	differing = size - cdgpacks.IntToBytes (differ, size).count (b"\x00")
+
+	# A block's byte wins if it has a majority, counting itself
+	majority = bytes (bytearray ([0xFF * ((count + 1) * 2 > len(blocks)) for count in range (256)]))
+	result = 0
+	decided = 0
+	for i in range (len(blocks)):
+		winners = cdgpacks.BytesToInt (cdgpacks.IntToBytes (votes[i], size).translate (majority))
+		result = result | (values[i] & winners)
+		decided = decided | winners
+	undecided = cdgpacks.IntToBytes (decided, size).translate (_invert)
+	result = result | (values[0] & cdgpacks.BytesToInt (undecided))
+	return (cdgpacks.IntToBytes (result, size), differing,
+			[match.start() for match in _nonZero.finditer (undecided)])
+
+
+# Split a block of whole sectors into its audio and subchannel data
+def _SplitSectors (block):
+	sectors = len(block) // cdgparse.SECTOR_SIZE
+	audio = b"".join ([block[sector * cdgparse.SECTOR_SIZE:(sector * cdgparse.SECTOR_SIZE) + cdgparse.AUDIO_SIZE]
+					   for sector in range (sectors)])
+	subchannel = bytearray (sectors * cdgparse.SUBCHAN_SIZE)
+	for column in range (cdgparse.SUBCHAN_SIZE):
+		subchannel[column::cdgparse.SUBCHAN_SIZE] = block[cdgparse.AUDIO_SIZE + column::cdgparse.SECTOR_SIZE]
+	return (audio, bytes (subchannel))
+
+# Put audio and subchannel data back together into sectors
+def _JoinSectors (audio, subchannel):
+	sectors = len(subchannel) // cdgparse.SUBCHAN_SIZE
+	return (b"".join ([audio[sector * cdgparse.AUDIO_SIZE:(sector + 1) * cdgparse.AUDIO_SIZE] +
+					   subchannel[sector * cdgparse.SUBCHAN_SIZE:(sector + 1) * cdgparse.SUBCHAN_SIZE]
+					   for sector in range (sectors)]))
+
+
+# TrackMerger Class
+#
+# Merges one track of the rips. The rips are given as BinImages, with
+# the track's start byte and size in each. The output follows the first
+# rip's layout.
+class TrackMerger:
+	def __init__(self, images, starts, sizes, interleaved, audio):
+		self.images = images
+		self.starts = starts
+		self.sizes = [min (size, image.size - start) for image, start, size in zip (images, starts, sizes)]
+		self.size = sizes[0]
+		self.interleaved = interleaved
+		self.audio = audio
+		# Length of the track's subchannel stream in each rip
+		self.streamSizes = [(size // cdgparse.SECTOR_SIZE) * cdgparse.SUBCHAN_SIZE for size in self.sizes]
+
+		# Results
+		self.subchanDiffer = 0
+		self.subchanParity = 0
+		self.subchanUnresolved = 0
+		self.audioDiffer = 0
+		self.audioUnresolved = 0
+
+		# Values decided by parity, by subchannel stream position
+		self.decided = {}
+		self.packsTried = set()
+
+	# Merge the track, writing it to outfile
+	def Merge (self, outfile):
+		blockSize = cdgparse.BLOCK_SECTORS * cdgparse.SECTOR_SIZE
+		for offset in range (0, self.size, blockSize):
+			length = min (blockSize, self.size - offset)
+			reference = self._Read (0, offset, length)
+			blocks = [reference]
+			for rip in range (1, len(self.images)):
+				block = self._Read (rip, offset, length)
+				# A rip which doesn't have all of this block can't vote on it
+				if len(block) == len(reference):
+					blocks.append (block)
+			outfile.write (self._MergeBlock (blocks, offset // cdgparse.SECTOR_SIZE))
+
+	# Describe the results for display
+	def Summary (self):
+		text = ("%d subchannel bytes differ (%d by vote, %d by parity, %d unresolved)"
+				% (self.subchanDiffer, self.subchanDiffer - self.subchanParity - self.subchanUnresolved,
+				   self.subchanParity, self.subchanUnresolved))
+		if self.audio:
+			text = text + (", %d audio bytes differ (%d unresolved)" % (self.audioDiffer, self.audioUnresolved))
+		return (text)
+
+	# Read part of the track from one rip
+	def _Read (self, rip, offset, length):
+		start = self.starts[rip] + offset
+		end = self.starts[rip] + min (offset + length, self.sizes[rip])
+		return (bytes (self.images[rip].map[start:max (end, start)]))
+
+	# Merge a block of the track, starting at sector firstSector
+	def _MergeBlock (self, blocks, firstSector):
+		reference = blocks[0]
+		if (len(blocks) == 1) or all ([block == reference for block in blocks[1:]]):
+			return (reference)
+
+		# Leave any partial sector at the end as it is in the first rip
+		whole = (len(reference) // cdgparse.SECTOR_SIZE) * cdgparse.SECTOR_SIZE
+		split = [_SplitSectors (block[:whole]) for block in blocks]
+
+		audio = split[0][0]
+		if self.audio:
+			audio, differ, undecided = Vote ([pcm for pcm, subchannel in split])
+			self.audioDiffer = self.audioDiffer + differ
+			self.audioUnresolved = self.audioUnresolved + len(undecided)
+
+		subchannel, differ, undecided = Vote ([subchannel for pcm, subchannel in split])
+		self.subchanDiffer = self.subchanDiffer + differ
+		if len(undecided) > 0:
+			subchannel = bytearray (subchannel)
+			base = firstSector * cdgparse.SUBCHAN_SIZE
+			for position in undecided:
+				value = self._DecideByParity (base + position)
+				if value == None:
+					self.subchanUnresolved = self.subchanUnresolved + 1
+				else:
+					subchannel[position] = value
+					self.subchanParity = self.subchanParity + 1
+			subchannel = bytes (subchannel)
+		return (_JoinSectors (audio, subchannel) + reference[whole:])
+
+	# Get the subchannel stream positions of the bytes of the pack holding
+	# the byte at a position
+	def _PackPositions (self, position):
+		if self.interleaved:
+			column = _rawColumns[position % cdgecc.PACK_SIZE]
+			pack = (position - _rawPositions[column]) // cdgecc.PACK_SIZE
+			return ([(pack * cdgecc.PACK_SIZE) + offset for offset in _rawPositions])
+		pack = position // cdgecc.PACK_SIZE
+		return (range (pack * cdgecc.PACK_SIZE, (pack + 1) * cdgecc.PACK_SIZE))
+
+	# Read a byte of the subchannel stream from one rip
+	def _SubchannelByte (self, rip, position):
+		sector, column = divmod (position, cdgparse.SUBCHAN_SIZE)
+		offset = self.starts[rip] + (sector * cdgparse.SECTOR_SIZE) + cdgparse.AUDIO_SIZE + column
+		return (bytearray (self.images[rip].map[offset:offset + 1])[0])
+
+	# Decide a subchannel byte without a majority, by trying the rips'
+	# values for the undecided bytes of its pack until the pack passes
+	# its parity checks. Returns the value, or None if no combination
+	# passes.
+	def _DecideByParity (self, position):
+		if position in self.decided:
+			return (self.decided[position])
+		positions = self._PackPositions (position)
+		pack = positions[0] // cdgecc.PACK_SIZE
+		if (pack < 0) or (pack in self.packsTried):
+			return (None)
+		self.packsTried.add (pack)
+
+		# Only the rips which have the whole pack can be used
+		end = max (positions)
+		rips = [rip for rip in range (len(self.images)) if end < self.streamSizes[rip]]
+		if (len(rips) < 2) or (rips[0] != 0):
+			return (None)
+
+		# The choices for each byte of the pack: the majority value if
+		# there is one, otherwise every rip's value (the first rip's first)
+		choices = []
+		for bytePosition in positions:
+			values = [self._SubchannelByte (rip, bytePosition) for rip in rips]
+			counts = [values.count (value) for value in values]
+			if max (counts) * 2 > len(values):
+				choices.append ([values[counts.index (max (counts))]])
+			else:
+				unique = []
+				for value in values:
+					if value not in unique:
+						unique.append (value)
+				choices.append (unique)
+		combinations = 1
+		for choice in choices:
+			combinations = combinations * len(choice)
+		if combinations > MAX_COMBINATIONS:
+			return (None)
+
+		for combination in itertools.product (*choices):
+			if cdgecc.CheckPack (bytearray ([value & 0x3F for value in combination])):
+				for bytePosition, value, choice in zip (positions, combination, choices):
+					if len(choice) > 1:
+						self.decided[bytePosition] = value
+				return (self.decided.get (position))
+		return (None)
+
+
+# Merge several rips of the same disk into one, writing the TOC file
+# outtoc and its BIN file (named after it). The output has the same
+# layout as the first rip. Returns a list of the TrackMergers, with
+# the results for each track, or None if the rips don't match.
+def cdgmerge (tocfilenames, outtoc, audio=False):
+	print (DELIMITER)
+	print (TITLE_STRING)
+	print (DELIMITER)
+
+	rips = []
+	for tocfilename in tocfilenames:
+		rip = cdgdao.ReadRip (tocfilename)
+		if rip == None:
+			return (None)
+		print ("-> Rip: %s (%d tracks)" % (rip[0], len(rip[2])))
+		rips.append (rip)
+
+	# The rips must be of the same disk, in the same subchannel layout
+	binfilename, interleaved, startBytes, trackSizeBytes = rips[0]
+	binfilenames = [os.path.realpath (rip[0]) for rip in rips]
+	if len(set (binfilenames)) < len(binfilenames):
+		print ("cdgmerge: Error: the same bin file is given more than once")
+		return (None)
+	for otherbin, otherinterleaved, otherstarts, othersizes in rips[1:]:
+		if len(othersizes) != len(trackSizeBytes):
+			print ("cdgmerge: Error: %s has a different number of tracks" % otherbin)
+			return (None)
+		if otherinterleaved != interleaved:
+			print ("cdgmerge: Error: %s has a different subchannel layout" % otherbin)
+			return (None)
+
+	images = [cdgparse.BinImage (rip[0], rip[2], rip[3]) for rip in rips]
+	outbin = os.path.splitext (outtoc)[0] + ".bin"
+	mergers = []
+	try:
+		binfile = open (outbin, "wb")
+		try:
+			for track in range (len(trackSizeBytes)):
+				merger = TrackMerger (images, [rip[2][track] for rip in rips],
+									  [rip[3][track] for rip in rips], interleaved, audio)
+				merger.Merge (binfile)
+				print ("-> Track %02d: %s" % (track + 1, merger.Summary()))
+				mergers.append (merger)
+		finally:
+			binfile.close()
+	finally:
+		for image in images:
+			image.close()
+
+	# The TOC file is the first rip's, with the new bin file
+	tocfile = open (tocfilenames[0], "r")
+	tocdata = tocfile.read()
+	tocfile.close()
+	originalbin = cdgdao.ParseToc (tocfilenames[0])[0]
+	tocdata = tocdata.replace ("\"%s\"" % originalbin, "\"%s\"" % os.path.basename (outbin))
+	tocfile = open (outtoc, "w")
+	tocfile.write (tocdata)
+	tocfile.close()
+
+	print (DELIMITER)
+	print ("-> Merged rip: %s" % outtoc)
+	print (DELIMITER)
+	return (mergers)
+
+
+# Print out some instructions on error
+def usage():
+	print ("Usage:  %s [options] <TOC file> <TOC file> [<TOC file> ...]" % os.path.basename (sys.argv[0]))
+	print ("")
+	print ("Options:")
+	print ("  -o, --output FILE         :    Write the merged rip to FILE (a TOC")
+	print ("                                 file) and its BIN file (default")
+	print ("                                 merged.toc)")
+	print ("  --audio                   :    Vote on the audio too, rather than")
+	print ("                                 taking it from the first rip")
+	print ("  -h, --help                :    Display this message")
+
+
+# Can be called from the command line with the TOC filenames as parameters
+def main():
+	try:
+		opts, args = getopt.getopt (sys.argv[1:], "ho:", ["help", "output=", "audio"])
+	except getopt.GetoptError:
+		usage()
+		sys.exit(2)
+	if len(args) < 2:
+		usage()
+		sys.exit(2)
+
+	outtoc = "merged.toc"
+	audio = False
+	for opt, arg in opts:
+		if opt in ("-h", "--help"):
+			usage()
+			sys.exit()
+		if opt in ("-o", "--output"):
+			outtoc = arg
+		if opt == "--audio":
+			audio = True
+
+	if cdgmerge (args, outtoc, audio) == None:
+		sys.exit(1)
+
+if __name__ == "__main__":
+	sys.exit(main())
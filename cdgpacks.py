@@ -0,0 +1,222 @@
+# cdgpacks - cdgtools: Bulk decoding of CDG files
+
+# Copyright (C) 2009  Kelvin Lawson (kelvinl@users.sf.net)
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+
+# OVERVIEW
+#
+# cdgpacks is part of the cdgtools suite of CD+G karaoke software.
+#
+# This module decodes a whole .cdg file at once. Rather than reading
+# and unpacking the file a 24-byte packet at a time, the packets are
+# held as columns: one string of bytes for each field of the packet,
+# holding that field for every packet in the file:
+#
+#   . command      - the command code (CDG_COMMAND for CD+G graphics)
+#   . instruction  - the instruction code
+#   . parityQ      - 2 columns, the Q parity
+#   . data         - 16 columns, the instruction's data
+#   . parity       - 4 columns, the P parity
+#
+# The columns are sliced out of the file with one extended slice each,
+# and every byte masked with CDG_MASK in one translate() of the whole
+# file. Each packet is also classified in bulk into the "kind" column:
+# its instruction code if it is a CD+G graphics packet with a known
+# instruction, CDG_INST_UNKNOWN for any other instruction, and
+# CDG_KIND_NONE if it isn't a CD+G graphics packet at all (such as the
+# empty packets between the graphics).
+#
+#   packs = cdgpacks.LoadFile ("theboxer.cdg")
+#   for index in packs.Commands():
+#       kind = packs.kind[index]
+#       data = packs.Data (index)
+#       ... handle the instruction ...
+#
+# Commands() finds the graphics packets without looking at the rest,
+# and Count() counts the packets of a kind, without a loop in Python.
+#
+# See cdg2text.py for an example application which utilises this
+# module.
+#
+# For further details see http://www.kibosh.org/cdgtools/
+
+import re, binascii, operator
+
+
+# CDG Command Code
+CDG_COMMAND 				= 0x09
+
+# CDG Instruction Codes
+CDG_INST_MEMORY_PRESET		= 1
+CDG_INST_BORDER_PRESET		= 2
+CDG_INST_TILE_BLOCK			= 6
+CDG_INST_SCROLL_PRESET		= 20
+CDG_INST_SCROLL_COPY		= 24
+CDG_INST_DEF_TRANSP_COL		= 28
+CDG_INST_LOAD_COL_TBL_0_7	= 30
+CDG_INST_LOAD_COL_TBL_8_15	= 31
+CDG_INST_TILE_BLOCK_XOR		= 38
+
+# All of the instruction codes above
+CDG_INSTRUCTIONS = (CDG_INST_MEMORY_PRESET, CDG_INST_BORDER_PRESET, CDG_INST_TILE_BLOCK,
+					CDG_INST_SCROLL_PRESET, CDG_INST_SCROLL_COPY, CDG_INST_DEF_TRANSP_COL,
+					CDG_INST_LOAD_COL_TBL_0_7, CDG_INST_LOAD_COL_TBL_8_15,
+					CDG_INST_TILE_BLOCK_XOR)
+
+# Packet kinds, besides the instruction codes. Neither can clash with
+# an instruction code, which is only 6 bits.
+CDG_KIND_NONE				= 0
+CDG_INST_UNKNOWN			= 0xFF
+
+# Name of each kind of packet
+KIND_NAMES = {
+	CDG_KIND_NONE:					"Empty",
+	CDG_INST_MEMORY_PRESET:			"MemoryPreset",
+	CDG_INST_BORDER_PRESET:			"BorderPreset",
+	CDG_INST_TILE_BLOCK:			"TileBlockNormal",
+	CDG_INST_SCROLL_PRESET:			"ScrollPreset",
+	CDG_INST_SCROLL_COPY:			"ScrollCopy",
+	CDG_INST_DEF_TRANSP_COL:		"DefineTransparentColour",
+	CDG_INST_LOAD_COL_TBL_0_7:		"LoadColourTable0..7",
+	CDG_INST_LOAD_COL_TBL_8_15:		"LoadColourTable8..15",
+	CDG_INST_TILE_BLOCK_XOR:		"TileBlockXOR",
+	CDG_INST_UNKNOWN:				"Unknown",
+}
+
+# Bitmask for all CDG fields
+CDG_MASK 					= 0x3F
+
+# Packet layout
+PACK_SIZE = 24
+PACKS_PER_SECOND = 300
+
+
+# Translate tables to mask every byte, to classify instruction codes,
+# and to flag CD+G graphics commands (0xFF for a graphics command,
+# otherwise 0)
+_maskTable = bytes (bytearray ([byte & CDG_MASK for byte in range (256)]))
+_kindTable = bytes (bytearray ([(byte & CDG_MASK) if (byte & CDG_MASK) in CDG_INSTRUCTIONS
+								else CDG_INST_UNKNOWN for byte in range (256)]))
+_commandTable = bytes (bytearray ([0xFF * ((byte & CDG_MASK) == CDG_COMMAND) for byte in range (256)]))
+
+_nonZero = re.compile (b"[^\x00]")
+
+
+# Mask every byte of some CD+G data with CDG_MASK
+def Mask (cdgdata):
+	return (bytes (cdgdata).translate (_maskTable))
+
+
+# Convert a string of bytes to a big integer, one byte of the string
+# to each byte of the integer, and back again (to size bytes). There is
+# no bulk AND (or OR, or XOR) of strings, but there is of integers.
+def BytesToInt (data):
+	if len(data) == 0:
+		return (0)
+	return (int (binascii.hexlify (data), 16))
+
+def IntToBytes (value, size):
+	if size == 0:
+		return (b"")
+	return (binascii.unhexlify ("%0*x" % (size * 2, value)))
+
+# Combine two equal length strings of bytes, byte by byte, with a
+# bitwise operator (operator.and_, operator.or_ or operator.xor)
+def BitwiseBytes (op, a, b):
+	return (IntToBytes (op (BytesToInt (a), BytesToInt (b)), len(a)))
+
+# AND (or OR, or XOR) two equal length strings of bytes together
+def AndBytes (a, b):
+	return (BitwiseBytes (operator.and_, a, b))
+
+def OrBytes (a, b):
+	return (BitwiseBytes (operator.or_, a, b))
+
+def XorBytes (a, b):
+	return (BitwiseBytes (operator.xor, a, b))
+
+# Make a translate table which flags (with 0xFF) the bytes for which
+# test is true, and clears the rest to 0
+def FlagTable (test):
+	return (bytes (bytearray ([0xFF * bool (test (byte)) for byte in range (256)])))
+
+
+# CdgPacks Class
+#
+# The decoded packets of a .cdg file, as described above. Each column
+# is a bytearray, so column[index] gives the (masked) field of packet
+# index as a number. Any partial packet at the end of the file is left
+# out, and its size kept in "trailing".
+class CdgPacks:
+	def __init__(self, cdgdata):
+		cdgdata = bytes (cdgdata)
+		self.count = len(cdgdata) // PACK_SIZE
+		self.trailing = len(cdgdata) % PACK_SIZE
+		self.masked = Mask (cdgdata[:self.count * PACK_SIZE])
+
+		# Slice out the columns
+		columns = [bytearray (self.masked[i::PACK_SIZE]) for i in range (PACK_SIZE)]
+		self.command = columns[0]
+		self.instruction = columns[1]
+		self.parityQ = columns[2:4]
+		self.data = columns[4:20]
+		self.parity = columns[20:24]
+
+		# Classify the packets. Those whose command isn't CDG_COMMAND are
+		# cleared to CDG_KIND_NONE.
+		kinds = bytes (self.instruction).translate (_kindTable)
+		commands = bytes (self.command).translate (_commandTable)
+		self.kind = bytearray (AndBytes (kinds, commands))
+
+	def __len__ (self):
+		return (self.count)
+
+	# Get the 16 (masked) data bytes of a packet, as a bytearray
+	def Data (self, index):
+		offset = (index * PACK_SIZE) + 4
+		return (bytearray (self.masked[offset:offset + 16]))
+
+	# Get the whole (masked) packet, as a bytearray
+	def Packet (self, index):
+		offset = index * PACK_SIZE
+		return (bytearray (self.masked[offset:offset + PACK_SIZE]))
+
+	# Get the indexes of the CD+G graphics packets, in order
+	def Commands (self):
+		return ([match.start() for match in _nonZero.finditer (bytes (self.kind))])
+
+	# Count the packets of a kind
+	def Count (self, kind):
+		return (self.kind.count (bytearray ([kind])))
+
+	# Get a column flagging (with 0xFF) the packets of any of the given
+	# kinds, with 0 for the rest
+	def Flags (self, kinds):
+		return (bytes (self.kind).translate (FlagTable (lambda kind: kind in kinds)))
+
+	# Get the time of a packet from the start of the file, in seconds
+	def Time (self, index):
+		return (float (index) / PACKS_PER_SECOND)
+
+
+# Load and decode a whole .cdg file
+def LoadFile (cdgfilename):
+	cdgfile = open (cdgfilename, "rb")
+	try:
+		return (CdgPacks (cdgfile.read()))
+	finally:
+		cdgfile.close()
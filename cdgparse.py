@@ -37,7 +37,7 @@
 # If you want to use this with other ripping software, you need to 
 # find out the start byte and length in bytes of the track(s) you
 # would like to rip. You can then call bin2cdg() to get the CD+G
-# data out. If the rip contains raw/interleaved subchannel data
+# data out as one contiguous string of bytes. If the rip contains raw/interleaved subchannel data
 # then you can pass the results from bin2cdg() into Deinterleave().
 # Otherwise if the rip is already deinterleaved, then there is no
 # more processing necessary. Once you have the block of deinterleaved
@@ -47,7 +47,31 @@
 # is required. Pass the track start byte and length into bin2pcm()
 # to get the raw PCM audio data. You can write it out to a file
 # using pcmWriteToFile(), and then encode the file to mp3 using
-# lame or similar.
+# lame or similar. Alternatively use a PcmEncoder (or
+# pcmEncodeStream()) to pipe the audio straight into the encoder.
+#
+# If you need both the audio and the CD+G data for a track, then
+# bin2pcmcdg() reads the track just once and returns both, saving
+# a second pass over the bin file.
+#
+# All of the above return whole tracks. To keep memory use down on
+# long tracks, iter_pcm(), iter_cdg() and iter_pcmcdg() instead yield
+# the data a chunk at a time as the track is read. The chunks can be
+# written out with pcmWriteStream() and cdgWriteStream(). Raw CD+G
+# chunks can be deinterleaved on the way using a Deinterleaver.
+# iter_disc() does the same for every track on the disc in a single
+# sequential read of the bin file.
+#
+# The chunked readers, and pcmEncodeStream(), can report their progress
+# through a Progress object, which calls back with the number of
+# sectors done, the total and the current throughput at most every
+# half a second (or as configured). Progress is counted a chunk at a
+# time, so it costs nothing per sector.
+#
+# When ripping several tracks from the same bin file, open it once
+# as a BinImage (passing in the track details from cdgdao.ParseToc())
+# and pass that to bin2cdg() and bin2pcm() in place of the filename.
+# The file is then memory-mapped once and shared by all the tracks.
 #
 # Note that not all drives can return the subchannel data during
 # ripping. If your drive supports one of the subchannel modes
@@ -59,7 +83,8 @@
 #
 # For further details see http://www.kibosh.org/cdgtools/
 
-import struct
+import os, time, mmap, subprocess, threading
+import cdgstats
 
 
 # Offsets for deinterleaving, thanks to the author of karaoke-dx
@@ -68,104 +93,627 @@ offsets = ( 0, 66, 125, 191, 100, 50, 150, 175,
 			16, 41, 25, 91, 116, 141, 166, 75)
 
 
+# Sector layout of the bin file: 2352 bytes audio followed by 96 bytes
+# subchannel data.
+SECTOR_SIZE		= 2448
+AUDIO_SIZE		= 2352
+SUBCHAN_SIZE	= 96
+
+# Number of sectors read from the bin file in one go by the bulk readers
+BLOCK_SECTORS	= 1024
+
+# Default minimum time between progress reports, in seconds
+PROGRESS_INTERVAL = 0.5
+
+# Audio sectors played per second, for showing speeds as a multiple of
+# real time
+SECTORS_PER_SECOND = 75
+
+# Maximum number of buffers that can be passed to one vectored read
+try:
+	_IOV_MAX = os.sysconf ("SC_IOV_MAX")
+except (AttributeError, ValueError, OSError):
+	_IOV_MAX = 16
+
+# Translation table which masks out the PQ bits of a subchannel byte,
+# leaving only the R-W channels
+_rwMask = bytes(bytearray([byte & 0x3F for byte in range(256)]))
+
+
+# Slice the 96 subchannel bytes out of the first sectors sectors of a
+# block. Treating the block as a (sectors, 2448) table, each extended
+# slice copies one subchannel column for all the sectors at once. The
+# slices stop at the end of the whole sectors, so that a partial sector
+# at the end of the block is left for the caller.
+def _SubchannelColumns (block, sectors):
+	columns = bytearray(sectors * SUBCHAN_SIZE)
+	end = sectors * SECTOR_SIZE
+	for column in range (SUBCHAN_SIZE):
+		columns[column::SUBCHAN_SIZE] = block[AUDIO_SIZE + column:end:SECTOR_SIZE]
+	return columns
+
+
+# Zero-copy view onto part of a string or memory-mapped file
+try:
+	_View = buffer
+except NameError:
+	def _View (obj, offset, size):
+		return memoryview(obj)[offset:offset + size]
+
+
+# BinImage Class
+#
+# Memory-maps a bin file once so that all of the tracks in a rip can be
+# extracted without reopening and walking the file for every track.
+# Pass in the track start bytes and sizes from cdgdao.ParseToc() to
+# address the tracks by number using Track(). Any other region of the
+# image can be addressed by byte range using Region().
+class BinImage:
+	def __init__(self, binfilename, startBytes=None, trackSizeBytes=None):
+		self.FileName = binfilename
+		self.startBytes = startBytes or []
+		self.trackSizeBytes = trackSizeBytes or []
+
+		self.binfile = open (binfilename, "rb")
+		self.size = os.fstat(self.binfile.fileno()).st_size
+		# Empty files can't be mapped, but slice the same as an empty map
+		if self.size > 0:
+			self.map = mmap.mmap (self.binfile.fileno(), 0, access = mmap.ACCESS_READ)
+		else:
+			self.map = b""
+
+	# Get the BinTrack for a track number (counting from 0)
+	def Track (self, track):
+		return BinTrack (self, self.startBytes[track], self.trackSizeBytes[track])
+
+	# Get a BinTrack for an arbitrary start byte and length in bytes
+	def Region (self, start_offset, binsize):
+		return BinTrack (self, start_offset, binsize)
+
+	def NumTracks (self):
+		return len(self.startBytes)
+
+	def close (self):
+		if self.size > 0:
+			self.map.close()
+		self.binfile.close()
+
+
+# BinTrack Class
+#
+# A track (or other region) of a BinImage. The audio and subchannel
+# streams are available as zero-copy views of each sector in the map.
+# As with the original file walk, a region that doesn't end on a sector
+# boundary is rounded up to a whole sector, and sectors past the end of
+# the image are dropped.
+class BinTrack:
+	def __init__(self, image, start_offset, binsize):
+		self.image = image
+		self.start = start_offset
+		self.size = binsize
+		self.sectors = (binsize + SECTOR_SIZE - 1) // SECTOR_SIZE
+
+	# Get the views for one part of every sector in the track
+	def _SectorViews (self, offset, size):
+		views = []
+		pos = self.start + offset
+		for sector in range (self.sectors):
+			if pos >= self.image.size:
+				break
+			views.append (_View (self.image.map, pos, min (size, self.image.size - pos)))
+			pos = pos + SECTOR_SIZE
+		return views
+
+	# Zero-copy views of the 2352 bytes audio data in each sector
+	def AudioViews (self):
+		return self._SectorViews (0, AUDIO_SIZE)
+
+	# Zero-copy views of the 96 bytes raw subchannel data in each sector
+	def SubchannelViews (self):
+		return self._SectorViews (AUDIO_SIZE, SUBCHAN_SIZE)
+
+	# Copies of the 2352 bytes audio data in each sector
+	def Audio (self):
+		return [bytes(view) for view in self.AudioViews()]
+
+	# The masked R-W subchannel data for the whole track, returned as
+	# one contiguous string.
+	def Subchannel (self):
+		return (b"".join(iter_cdg (self.image, self.start, self.size)))
+
+	# Demultiplex the track in one pass into the audio data and the
+	# masked R-W subchannel data, each as one contiguous buffer.
+	def Demux (self):
+		_audiodata = bytearray()
+		_cdgdata = []
+		for pcmchunk, cdgchunk in iter_pcmcdg (self.image, self.start, self.size):
+			_audiodata += pcmchunk
+			_cdgdata.append (cdgchunk)
+		return (_audiodata, b"".join(_cdgdata))
+
+
 # Take the bin output from cdrdao and rip out the 96 subchannel
 # bytes in each sector. Use start_offset and binsize to select
 # particular tracks in the (entire CD) bin file. Also masks out
 # any non-CDG (PQ) bits from each byte.
+#
+# The subchannel data is returned as one contiguous string of bytes.
+# binfilename can also be an open BinImage, which saves remapping
+# the file when ripping several tracks.
 def bin2cdg (binfilename, start_offset, binsize):
+	start = cdgstats.Start()
+	if isinstance(binfilename, BinImage):
+		_cdgdata = binfilename.Region (start_offset, binsize).Subchannel()
+	else:
+		image = BinImage (binfilename)
+		_cdgdata = image.Region (start_offset, binsize).Subchannel()
+		image.close()
+	cdgstats.Stop (start, "bin2cdg", binsize, len(_cdgdata), len(_cdgdata) // SUBCHAN_SIZE)
+	return (_cdgdata)
 
-	# Open the binfile and seek to the track start
-	binfile = open (binfilename, "rb")
-	binfile.seek (start_offset, 0)
-
-	_cdgdata = []
-	donesize = 0
-
-	# Loop through each sector, skipping the 2352 bytes audio data, and 
-	# ripping out out the 96 bytes subchannel data.
-	while donesize < binsize:
-
-		# Skip 2352 bytes from current location
-		binfile.seek(2352, 1)
-		donesize = donesize + 2352
-
-		# Read 96 bytes subchannel data
-		chunk = binfile.read(96)
-		chunksize = len(chunk)
-		if chunksize > 0:
-			# Mask out the PQ data, only returning the R-W channels
-			for unmasked in chunk:
-				byte = struct.unpack("b", unmasked)[0]
-				byte = byte & 0x3F
-				masked = struct.pack("b", byte)
-				_cdgdata.append(masked)
-			donesize = donesize + chunksize
-		else:
+# Read a track once, scattering the audio and subchannel parts of each
+# sector straight into their own buffers with os.preadv(). Each call
+# reads a run of sectors into a list of alternating audio/subchannel
+# slices of the two output buffers, so nothing is copied on the way.
+def _ScatterDemux (binfilename, start_offset, binsize):
+	sectors = (binsize + SECTOR_SIZE - 1) // SECTOR_SIZE
+	_audiodata = bytearray(sectors * AUDIO_SIZE)
+	_cdgdata = bytearray(sectors * SUBCHAN_SIZE)
+	audioView = memoryview(_audiodata)
+	cdgView = memoryview(_cdgdata)
+
+	binfd = os.open (binfilename, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+	batch = max (1, _IOV_MAX // 2)
+	done = 0
+	audioLen = 0
+	cdgLen = 0
+	while done < sectors:
+		count = min (batch, sectors - done)
+		buffers = []
+		for sector in range (done, done + count):
+			buffers.append (audioView[sector * AUDIO_SIZE:(sector + 1) * AUDIO_SIZE])
+			buffers.append (cdgView[sector * SUBCHAN_SIZE:(sector + 1) * SUBCHAN_SIZE])
+		readsize = os.preadv (binfd, buffers, start_offset + (done * SECTOR_SIZE))
+		for view in buffers:
+			view.release()
+
+		# Work out how far the data reached in each buffer. A short read
+		# means we hit the end of the file.
+		whole, partial = divmod (readsize, SECTOR_SIZE)
+		audioLen = ((done + whole) * AUDIO_SIZE) + min (partial, AUDIO_SIZE)
+		cdgLen = ((done + whole) * SUBCHAN_SIZE) + max (partial - AUDIO_SIZE, 0)
+		if whole < count:
 			break
+		done = done + count
+	os.close (binfd)
+
+	audioView.release()
+	cdgView.release()
+	del _audiodata[audioLen:]
+	del _cdgdata[cdgLen:]
+	return (_audiodata, bytes(_cdgdata.translate(_rwMask)))
+
+
+# Read a track from the bin file in a single pass, splitting every
+# sector into its audio and subchannel data at the same time. This
+# saves walking the file twice with bin2pcm() and bin2cdg().
+#
+# Returns a tuple (pcmdata, cdgdata), where pcmdata is the raw audio
+# as one contiguous buffer, and cdgdata is the masked subchannel data
+# exactly as returned by bin2cdg(). Uses vectored reads where the
+# platform supports them (os.preadv), otherwise a BinImage.
+def bin2pcmcdg (binfilename, start_offset, binsize):
+	start = cdgstats.Start()
+	if isinstance(binfilename, BinImage):
+		_audiodata, _cdgdata = binfilename.Region (start_offset, binsize).Demux()
+	elif hasattr(os, "preadv"):
+		_audiodata, _cdgdata = _ScatterDemux (binfilename, start_offset, binsize)
+	else:
+		image = BinImage (binfilename)
+		_audiodata, _cdgdata = image.Region (start_offset, binsize).Demux()
+		image.close()
+	cdgstats.Stop (start, "bin2pcmcdg", binsize, len(_audiodata) + len(_cdgdata),
+				   len(_cdgdata) // SUBCHAN_SIZE)
+	return (_audiodata, _cdgdata)
+
+
+# Build the deinterleave table for a number of sectors. Each of the 96
+# byte positions in a sector is filled from a fixed position (taken from
+# the offsets table) in the same or a later sector. So the permutation
+# for a whole track is described by one (destination, source) pair of
+# extended slices per byte position, each stepping a sector at a time.
+# Tables are cached by the number of sectors, i.e. the track length.
+_deinterleaveTables = {}
+def _DeinterleaveTable (sectors):
+	table = _deinterleaveTables.get (sectors)
+	if table is None:
+		table = []
+		end = sectors * SUBCHAN_SIZE
+		for pack in range (4):
+			for column in range (24):
+				dest = (pack * 24) + column
+				src = (pack * 24) + offsets[column]
+				table.append ((slice (dest, end, SUBCHAN_SIZE),
+								slice (src, src + end, SUBCHAN_SIZE)))
+		if len(_deinterleaveTables) >= 64:
+			_deinterleaveTables.clear()
+		_deinterleaveTables[sectors] = table
+	return (table)
 
-	binfile.close()
-	return (_cdgdata)
 
-# Deinterleave subchannel data if read from the drive in raw mode
+# Deinterleave subchannel data if read from the drive in raw mode.
+# Accepts either the contiguous form returned by bin2cdg() (and returns
+# the same), or a list of single bytes (and returns a list).
 def Deinterleave (cdgdata):
+	start = cdgstats.Start()
+
+	contiguous = isinstance(cdgdata, (bytes, bytearray))
+	if not contiguous:
+		cdgdata = b"".join(cdgdata)
 
 	# Skip the last two sectors as we don't have the upcoming spread bytes
-	sectors = (len(cdgdata) / 96) - 2
-	deinterleavedData = []
+	sectors = max ((len(cdgdata) // SUBCHAN_SIZE) - 2, 0)
+	deinterleavedData = bytearray(sectors * SUBCHAN_SIZE)
 
 	# Swap the byte positions to deinterleave the data
-	for sector in range (sectors):
-		for pack in range (4):
-			for column in range (24):
-				try:
-					deinterleavedData.append(cdgdata[(sector * 96) + (pack * 24) + offsets[column]])
-				except:
-					print ("ERROR: Sector %d, Pack %d, column %d" % (sector, pack, column))
+	for dest, src in _DeinterleaveTable (sectors):
+		deinterleavedData[dest] = cdgdata[src]
+
+	cdgstats.Stop (start, "deinterleave", len(cdgdata), len(deinterleavedData), sectors)
+	if contiguous:
+		return (bytes(deinterleavedData))
+	return (list(bytes(deinterleavedData)))
+
+
+# Deinterleaver Class
+#
+# Streaming version of Deinterleave(), for deinterleaving raw subchannel
+# data as it is ripped rather than once the whole track is in memory.
+# Feed() it the data one sector at a time or in chunks of any size (for
+# example from iter_cdg()), and it returns whatever packs can now be
+# deinterleaved. Only the two sectors of lookahead that the offsets
+# spread reaches into (plus any partial sector) are kept between calls.
+# As with Deinterleave(), the last two sectors of the stream are never
+# returned, so the output in total is identical.
+class Deinterleaver:
+	def __init__(self):
+		self.pending = b""
 
-	return (deinterleavedData)
+	def Feed (self, cdgdata):
+		self.pending = self.pending + bytes(cdgdata)
+		sectors = (len(self.pending) // SUBCHAN_SIZE) - 2
+		if sectors <= 0:
+			return (b"")
+		deinterleavedData = Deinterleave (self.pending[:(sectors + 2) * SUBCHAN_SIZE])
+		self.pending = self.pending[sectors * SUBCHAN_SIZE:]
+		return (deinterleavedData)
 
 
-# Rip the raw audio data to a raw PCM file
+# Rip the raw audio data to a raw PCM file. Returns a list with
+# the 2352 bytes audio data from each sector. If binfilename is an
+# open BinImage, the list holds zero-copy views into the image which
+# are only valid until it is closed.
 def bin2pcm (binfilename, start_offset, binsize):
+	start = cdgstats.Start()
+	if isinstance(binfilename, BinImage):
+		_audiodata = binfilename.Region (start_offset, binsize).AudioViews()
+	else:
+		image = BinImage (binfilename)
+		_audiodata = image.Region (start_offset, binsize).Audio()
+		image.close()
+	cdgstats.Stop (start, "bin2pcm", binsize, sum ([len(sector) for sector in _audiodata]),
+				   len(_audiodata))
+	return (_audiodata)
+
+
+# Progress Class
+#
+# Counts the sectors processed out of a total, and reports the progress
+# by calling callback (done, total, rate), where done and total are
+# numbers of sectors and rate is the current throughput in sectors per
+# second (averaged with the previous rate, so that the estimated time
+# left doesn't jump about with every short stall). The callback is
+# called from whichever thread calls Add(), at most once every interval
+# seconds, and always once the total is reached. Add() may be called
+# from several threads at once.
+class Progress:
+	def __init__(self, total, callback, interval=PROGRESS_INTERVAL):
+		self.total = total
+		self.callback = callback
+		self.interval = interval
+		self.done = 0
+		self.rate = 0.0
+		self.lock = threading.Lock()
+		self.lastTime = time.time()
+		self.lastDone = 0
+
+	# Add some sectors to the count, reporting the progress if due
+	def Add (self, sectors):
+		self.lock.acquire()
+		try:
+			self.done = self.done + sectors
+			now = time.time()
+			if (now - self.lastTime < self.interval) and (self.done < self.total):
+				return
+			if now > self.lastTime:
+				rate = (self.done - self.lastDone) / (now - self.lastTime)
+				if self.rate > 0:
+					rate = (self.rate + rate) / 2
+				self.rate = rate
+			self.lastTime = now
+			self.lastDone = self.done
+			done, total, rate = self.done, self.total, self.rate
+		finally:
+			self.lock.release()
+		self.callback (done, total, rate)
 
-	# Open the binfile and seek to the track start
-	binfile = open (binfilename, "rb")
-	binfile.seek (start_offset, 0)
+	# Get the estimated seconds remaining at the current rate, or None
+	# if not yet known
+	def Eta (self):
+		return (ProgressEta (self.done, self.total, self.rate))
 
-	_audiodata = []
-	donesize = 0
 
-	# Loop through each sector, reading the 2352 bytes audio data,
-	# and skipping the 96 bytes subchannel data.
-	while donesize < binsize:
+# Get the estimated seconds remaining, given the sectors done, the total
+# and the current rate in sectors per second. Returns None if unknown.
+def ProgressEta (done, total, rate):
+	if rate <= 0:
+		return (None)
+	return (max (total - done, 0) / rate)
 
-		# Read 2352 bytes raw audio data
-		chunk = binfile.read (2352)
-		# Skip 96 bytes subchannel data
-		binfile.seek (96, 1)
 
-		chunksize = len(chunk)
-		if chunksize > 0:
-			_audiodata.append(chunk)
-			donesize = donesize + chunksize + 96
+# Describe the progress for display, e.g. "42% (12.3 MB/s, 20.1x, 1:23 left)"
+def ProgressText (done, total, rate):
+	if total > 0:
+		percent = (100 * done) // total
+	else:
+		percent = 100
+	text = "%d%% (%.1f MB/s, %.1fx" % (percent, rate * SECTOR_SIZE / (1024 * 1024),
+									   rate / SECTORS_PER_SECOND)
+	eta = ProgressEta (done, total, rate)
+	if (eta != None) and (done < total):
+		eta = int (eta + 0.5)
+		if eta >= 3600:
+			text = text + ", %d:%02d:%02d left" % (eta // 3600, (eta // 60) % 60, eta % 60)
 		else:
-			break
+			text = text + ", %d:%02d left" % (eta // 60, eta % 60)
+	return (text + ")")
+
+
+# Get the number of sectors in a track, counting a partial final sector
+def TrackSectors (binsize):
+	return ((binsize + SECTOR_SIZE - 1) // SECTOR_SIZE)
+
+
+# Read a track from the bin file in blocks of up to chunk_sectors whole
+# sectors. Reads from the map if passed a BinImage, otherwise the file
+# is read a block at a time, so only one block is held in memory. An
+# already open file can also be passed in, in which case it is only
+# seeked if not already at the track start. The final block can be
+# short (or end in a partial sector) if the track runs off the end of
+# the file. If a Progress is given, the sectors of each block are added
+# to it as the block is read.
+def _iter_blocks (binfilename, start_offset, binsize, chunk_sectors, progress=None):
+	sectors = TrackSectors (binsize)
+	binfile = None
+	ownfile = False
+	if isinstance(binfilename, BinImage):
+		image = binfilename
+	elif hasattr(binfilename, "read"):
+		binfile = binfilename
+		if binfile.tell() != start_offset:
+			binfile.seek (start_offset, 0)
+	else:
+		binfile = open (binfilename, "rb")
+		binfile.seek (start_offset, 0)
+		ownfile = True
+
+	try:
+		pos = start_offset
+		while sectors > 0:
+			start = cdgstats.Start()
+			blocksize = min (sectors, chunk_sectors) * SECTOR_SIZE
+			if binfile:
+				block = binfile.read (blocksize)
+			else:
+				block = image.map[pos:pos + blocksize]
+			cdgstats.Stop (start, "read", len(block), len(block), len(block) // SECTOR_SIZE)
+			if len(block) == 0:
+				break
+			if progress != None:
+				progress.Add (TrackSectors (len(block)))
+			yield block
+			if len(block) < blocksize:
+				break
+			sectors = sectors - (blocksize // SECTOR_SIZE)
+			pos = pos + blocksize
+	finally:
+		if ownfile:
+			binfile.close()
+
+
+# Get the audio data out of a block of sectors. For the statistics, the
+# block's sectors are counted here (and not for the subchannel data).
+def _BlockAudio (block):
+	start = cdgstats.Start()
+	audio = b"".join([block[sector:sector + AUDIO_SIZE]
+			for sector in range (0, len(block), SECTOR_SIZE)])
+	cdgstats.Stop (start, "demux", len(block), len(audio), len(block) // SECTOR_SIZE)
+	return (audio)
+
+
+# Get the masked subchannel data out of a block of sectors, including
+# whatever subchannel bytes a final partial sector has.
+def _BlockSubchannel (block):
+	start = cdgstats.Start()
+	whole = len(block) // SECTOR_SIZE
+	columns = _SubchannelColumns (block, whole)
+	columns += block[(whole * SECTOR_SIZE) + AUDIO_SIZE:]
+	cdgdata = bytes(columns.translate(_rwMask))
+	cdgstats.Stop (start, "demux", 0, len(cdgdata))
+	return (cdgdata)
 
-	binfile.close()
-	return (_audiodata)
 
+# Generator versions of bin2pcm(), bin2cdg() and bin2pcmcdg(). Rather
+# than returning the whole track at once, these read chunk_sectors
+# sectors at a time and yield the data for each chunk as it is read
+# (2352 bytes audio and 96 bytes CD+G data per sector). Memory use is
+# then fixed by the chunk size, however long the track is.
+#
+# Pass the chunks to pcmWriteStream() or cdgWriteStream() to write them
+# out to a file as they are generated. Pass a Progress to follow the
+# progress of the read (its total being TrackSectors (binsize)).
+def iter_pcm (binfilename, start_offset, binsize, chunk_sectors=BLOCK_SECTORS, progress=None):
+	for block in _iter_blocks (binfilename, start_offset, binsize, chunk_sectors, progress):
+		yield _BlockAudio (block)
+
+def iter_cdg (binfilename, start_offset, binsize, chunk_sectors=BLOCK_SECTORS, progress=None):
+	for block in _iter_blocks (binfilename, start_offset, binsize, chunk_sectors, progress):
+		yield _BlockSubchannel (block)
+
+# Yields (pcmdata, cdgdata) tuples for each chunk
+def iter_pcmcdg (binfilename, start_offset, binsize, chunk_sectors=BLOCK_SECTORS, progress=None):
+	for block in _iter_blocks (binfilename, start_offset, binsize, chunk_sectors, progress):
+		yield (_BlockAudio (block), _BlockSubchannel (block))
+
+
+# Stream an entire disc from the bin file in one sequential read.
+# Pass in the track start bytes and sizes from cdgdao.ParseToc(). The
+# read is split at the track boundaries, and yields (track, pcmdata,
+# cdgdata) tuples for each chunk in disc order, so that the caller
+# can hand each track's data on as the read passes through it.
+#
+# The reads are recorded in the statistics (see cdgstats.py) against
+# each track's name from names, or otherwise the track number. A
+# Progress can be passed in to follow the progress through the disc.
+def iter_disc (binfilename, startBytes, trackSizeBytes, chunk_sectors=BLOCK_SECTORS, names=None,
+				progress=None):
+	if isinstance(binfilename, BinImage):
+		binfile = binfilename
+	else:
+		binfile = open (binfilename, "rb")
 
-# Write the entire CDG data block out to a file
+	try:
+		for track in range (len(startBytes)):
+			if names != None:
+				cdgstats.SetTrack (names[track])
+			else:
+				cdgstats.SetTrack (track + 1)
+			for block in _iter_blocks (binfile, startBytes[track], trackSizeBytes[track], chunk_sectors,
+										progress):
+				yield (track, _BlockAudio (block), _BlockSubchannel (block))
+	finally:
+		if binfile is not binfilename:
+			binfile.close()
+
+
+# Write the entire CDG data block out to a file. The block can be
+# either one contiguous string of bytes or a list of strings.
 def cdgWriteToFile (cdgfilename, cdgdata):
 	cdgfile = open (cdgfilename, "wb")
-	for byte in cdgdata:
-		cdgfile.write (byte)
+	if isinstance(cdgdata, (bytes, bytearray)):
+		cdgfile.write (cdgdata)
+	else:
+		for byte in cdgdata:
+			cdgfile.write (byte)
 	cdgfile.close()
 
 
-# Write the entire PCM audio data block out to a file
+# Write the entire PCM audio data block out to a file. The block can
+# be either one contiguous buffer or a list of strings.
 def pcmWriteToFile (pcmfilename, pcmdata):
 	pcmfile = open (pcmfilename, "wb")
-	for byte in pcmdata:
-		pcmfile.write (byte)
+	if isinstance(pcmdata, (bytes, bytearray)):
+		pcmfile.write (pcmdata)
+	else:
+		for byte in pcmdata:
+			pcmfile.write (byte)
 	pcmfile.close()
+
+
+# Write a stream of data chunks, such as those generated by iter_pcm()
+# and iter_cdg(), out to a file as they arrive. Returns the number of
+# bytes written.
+def _WriteStream (filename, chunks):
+	written = 0
+	outfile = open (filename, "wb")
+	try:
+		for chunk in chunks:
+			start = cdgstats.Start()
+			outfile.write (chunk)
+			cdgstats.Stop (start, "write", len(chunk), len(chunk))
+			written = written + len(chunk)
+	finally:
+		outfile.close()
+	return (written)
+
+# Write a stream of CDG data chunks out to a file
+def cdgWriteStream (cdgfilename, cdgchunks):
+	return (_WriteStream (cdgfilename, cdgchunks))
+
+# Write a stream of PCM audio data chunks out to a file
+def pcmWriteStream (pcmfilename, pcmchunks):
+	return (_WriteStream (pcmfilename, pcmchunks))
+
+
+# Build the command-line to run lame, encoding raw (big-endian) PCM
+# audio read from stdin into mp3name. Pass lameloc if lame is not in
+# the path.
+def LameCommand (mp3name, lameloc="lame"):
+	return ([lameloc, "-r", "--silent", "--cbr", "--big-endian", "-", mp3name])
+
+
+# PcmEncoder Class
+#
+# Runs an encoder (such as lame, see LameCommand()) as a subprocess
+# which reads raw PCM audio on its stdin. The audio can then be
+# streamed straight into the encoder as it is ripped, with no
+# temporary PCM file. The command is a list of arguments and is run
+# without a shell, so filenames with spaces etc need no quoting.
+#
+# The time spent writing to the encoder and waiting for it to finish is
+# recorded as the "encode" stage in the statistics, along with the CPU
+# time used by the encoder process (where os.wait4() is available).
+class PcmEncoder:
+	def __init__(self, command):
+		self.process = subprocess.Popen (command, stdin = subprocess.PIPE)
+
+	def Write (self, pcmdata):
+		start = cdgstats.Start()
+		self.process.stdin.write (pcmdata)
+		cdgstats.Stop (start, "encode", len(pcmdata), 0, len(pcmdata) // AUDIO_SIZE)
+
+	# Finish the encode. Returns the encoder's exit status.
+	def Close (self):
+		start = cdgstats.Start()
+		try:
+			self.process.stdin.close()
+		except IOError:
+			# The encoder has already gone, its exit status tells us why
+			pass
+		if (self.process.returncode == None) and hasattr(os, "wait4"):
+			pid, status, usage = os.wait4 (self.process.pid, 0)
+			if os.WIFSIGNALED (status):
+				self.process.returncode = -os.WTERMSIG (status)
+			else:
+				self.process.returncode = os.WEXITSTATUS (status)
+			cdgstats.Add ("encode", time.time() - start[0], usage.ru_utime + usage.ru_stime, calls = 0)
+		else:
+			self.process.wait()
+			cdgstats.Add ("encode", time.time() - start[0], calls = 0)
+		return (self.process.returncode)
+
+
+# Encode a stream of PCM audio chunks, such as those generated by
+# iter_pcm(), by piping them into the encoder command. Returns the
+# encoder's exit status. If a Progress is given, the sectors of audio
+# are added to it as they are passed to the encoder.
+def pcmEncodeStream (command, pcmchunks, progress=None):
+	encoder = PcmEncoder (command)
+	try:
+		for chunk in pcmchunks:
+			encoder.Write (chunk)
+			if progress != None:
+				progress.Add ((len(chunk) + AUDIO_SIZE - 1) // AUDIO_SIZE)
+	finally:
+		status = encoder.Close()
+	return (status)
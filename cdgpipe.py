@@ -0,0 +1,573 @@
+# cdgpipe - cdgtools: Staged rip pipeline
+
+# Copyright (C) 2009  Kelvin Lawson (kelvinl@users.sf.net)
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+
+# OVERVIEW
+#
+# cdgpipe is part of the cdgtools suite of CD+G karaoke software.
+#
+# This module rips a list of tracks from a bin file to .mp3 and .cdg
+# files as a pipeline of stages. Each stage runs in its own thread,
+# and is joined to the next stage by a bounded queue:
+#
+#   read/demux --+--> encode                  (audio piped into lame)
+#                |
+#                +--> deinterleave --> write  (CD+G data to .cdg file)
+#
+# The read stage demultiplexes the bin file a chunk at a time using
+# cdgparse. As the queues hold only a few chunks each, memory use is
+# fixed. But the I/O-bound reading (and deinterleaving) of the next
+# track can carry on while the CPU-bound encode of the current track
+# is still running.
+#
+# Each stage keeps track of how long it spends waiting for input, and
+# waiting for room in the next stage's queue. The rest of the time the
+# stage is busy. The stage with the highest occupancy (busy time as a
+# proportion of the total) is the bottleneck.
+#
+# If the pipeline is given a cdgcache.StreamCache, tracks which are in
+# the cache are read back from there (with the CD+G data already
+# deinterleaved) instead of from the bin file. Tracks which aren't are
+# added to the cache as they are ripped.
+#
+# If error correction is turned on, the deinterleave stage also checks
+# and corrects each pack of CD+G data (see cdgecc.py) before it is
+# written. The cache keeps the data as it was ripped, so correcting is
+# done the same way whether or not a track came from the cache.
+#
+# See cdgrip.py for an example application which utilises this module.
+#
+# For further details see http://www.kibosh.org/cdgtools/
+
+import sys, time, threading, Queue
+import cdgparse, cdgstats, cdgecc
+
+
+# Number of chunks held in each queue between the stages
+QUEUE_CHUNKS = 4
+
+
+# Default output function for console output. The line is written in
+# one go, so that lines output by different threads can't run together.
+def _Print (message):
+	sys.stdout.write (message + "\n")
+
+
+# OrderedLog Class
+#
+# Orders the console output of tracks being processed at the same time.
+# Output for the earliest unfinished track is passed straight through,
+# and output for later tracks is held back until all the tracks before
+# them are done. Tracks are numbered from 0 in the order they are to
+# be reported.
+class OrderedLog:
+	def __init__(self, output=None):
+		self.output = output or _Print
+		self.nextReport = 0
+		self.pending = {}
+		self.done = {}
+		self.lock = threading.Lock()
+
+	# Output (or hold back) a line of output for a track
+	def Log (self, seq, message):
+		self.lock.acquire()
+		try:
+			if seq == self.nextReport:
+				self.output (message)
+			else:
+				self.pending.setdefault (seq, []).append (message)
+		finally:
+			self.lock.release()
+
+	# Mark a track as finished, and output the held back output of any
+	# following tracks which are now at the front of the queue
+	def Done (self, seq):
+		self.lock.acquire()
+		try:
+			self.done[seq] = True
+			while self.done.get (self.nextReport):
+				self.nextReport = self.nextReport + 1
+				for message in self.pending.pop (self.nextReport, []):
+					self.output (message)
+		finally:
+			self.lock.release()
+
+
+# Stage Class
+#
+# One stage of the pipeline, with its input queue and timing counters.
+class Stage:
+	def __init__(self, name, queue_chunks):
+		self.name = name
+		self.queue = Queue.Queue (queue_chunks)
+		self.startTime = None
+		self.endTime = None
+		self.inputWait = 0.0
+		self.outputWait = 0.0
+		self.items = 0
+		self.queueTotal = 0
+
+	# Take the next item off the stage's input queue
+	def Get (self):
+		start = time.time()
+		self.queueTotal = self.queueTotal + self.queue.qsize()
+		item = self.queue.get()
+		self.inputWait = self.inputWait + (time.time() - start)
+		if item != None:
+			self.items = self.items + 1
+		return (item)
+
+	# Pass an item on to the next stage's input queue
+	def Send (self, stage, item):
+		start = time.time()
+		stage.queue.put (item)
+		self.outputWait = self.outputWait + (time.time() - start)
+
+	# Get the timing details for the stage, as a dictionary
+	def Stats (self):
+		if self.startTime == None:
+			wall = 0.0
+		else:
+			wall = (self.endTime or time.time()) - self.startTime
+		busy = max (wall - self.inputWait - self.outputWait, 0.0)
+		stats = {"name": self.name, "wall": wall, "busy": busy,
+				 "inputWait": self.inputWait, "outputWait": self.outputWait,
+				 "items": self.items, "occupancy": 0.0, "avgQueue": 0.0}
+		if wall > 0:
+			stats["occupancy"] = busy / wall
+		if self.items > 0:
+			stats["avgQueue"] = float(self.queueTotal) / self.items
+		return (stats)
+
+
+# RipPipeline Class
+#
+# Rips and encodes a list of tracks from a bin file using the stages
+# described above. binfile can be a filename, in which case the tracks
+# are read from the file in one sequential pass, or a BinImage shared
+# with the rest of the application.
+#
+# Add each track with AddTrack() giving the track's start byte and size
+# from cdgdao.ParseToc(), the .cdg filename, the encoder command to pipe
+# the audio into (see cdgparse.LameCommand()) and a name for the output.
+# Then Run() the pipeline, or Start() it and poll Finished() if the
+# caller has other things to do in the meantime (such as a GUI).
+#
+# Progress is reported through an OrderedLog, so each track's output
+# is kept together. By default it is printed to the console. If a
+# separator line is given, it is output before each track, and verbose
+# adds the byte range of each track. If on_finished is given, it is
+# called with the track number as each track is successfully finished
+# (from one of the pipeline's threads), which a track cut short by
+# Cancel() never is. If a cache is given (see
+# cdgcache.py), ripped tracks are read from and added to the cache.
+#
+# If a progress callback is given, it is called as progress (done, total,
+# rate) at most every progress_interval seconds (see cdgparse.Progress)
+# with the number of sectors of audio encoded so far, the total for all
+# the tracks, and the current rate in sectors per second. The encode is
+# the slowest stage, so this is how far through the rip we really are.
+#
+# If ecc is True, the CD+G packs are corrected, and the number of packs
+# corrected and left uncorrectable are reported for each track (and
+# kept in the track's "eccCorrected" and "eccUncorrectable").
+class RipPipeline:
+	def __init__(self, binfile, interleaved, log=None, queue_chunks=QUEUE_CHUNKS,
+					chunk_sectors=cdgparse.BLOCK_SECTORS, separator=None, verbose=False,
+					on_finished=None, cache=None, progress=None,
+					progress_interval=cdgparse.PROGRESS_INTERVAL, ecc=False):
+		self.binfile = binfile
+		if isinstance(binfile, cdgparse.BinImage):
+			self.binfilename = binfile.FileName
+		else:
+			self.binfilename = binfile
+		self.onFinished = on_finished
+		self.cache = cache
+		self.progressCallback = progress
+		self.progressInterval = progress_interval
+		self.progress = None
+		self.interleaved = interleaved
+		self.ecc = ecc
+		self.orderedLog = log or OrderedLog()
+		self.separator = separator
+		self.verbose = verbose
+		self.chunkSectors = chunk_sectors
+		self.tracks = []
+		self.threads = []
+		self.cancelled = False
+		self.currentTrack = None
+		self.lock = threading.Lock()
+
+		self.readStage = Stage ("read", 1)
+		self.encodeStage = Stage ("encode", queue_chunks)
+		self.deinterleaveStage = Stage ("deinterleave", queue_chunks)
+		self.writeStage = Stage ("write", queue_chunks)
+		self.stages = [self.readStage, self.deinterleaveStage, self.encodeStage, self.writeStage]
+
+	def _Log (self, track, message):
+		self.orderedLog.Log (track, message)
+
+	# Add a track to be ripped. Returns the track number in the pipeline.
+	def AddTrack (self, startByte, trackSize, cdgpath, command, name):
+		self.tracks.append ({"start": startByte, "size": trackSize, "cdgpath": cdgpath,
+							 "command": command, "name": name, "status": None, "error": None,
+							 "encoded": False, "written": False, "cacheKey": None,
+							 "cacheEntry": None, "cacheError": None, "readComplete": False,
+							 "eccCorrected": 0, "eccUncorrectable": 0})
+		return (len(self.tracks) - 1)
+
+	def Start (self):
+		if self.progressCallback != None:
+			self.progress = cdgparse.Progress (self.TotalSectors(), self.progressCallback,
+											   self.progressInterval)
+		for target, stage in ((self._Read, self.readStage),
+							  (self._Encode, self.encodeStage),
+							  (self._Deinterleave, self.deinterleaveStage),
+							  (self._Write, self.writeStage)):
+			thread = threading.Thread (target = self._RunStage, args = (target, stage))
+			thread.setDaemon (True)
+			thread.start()
+			self.threads.append (thread)
+
+	# Wait for the pipeline to finish. Returns the names of any tracks
+	# which failed.
+	def Wait (self):
+		for thread in self.threads:
+			thread.join()
+		return (self.Failed())
+
+	def Run (self):
+		self.Start()
+		return (self.Wait())
+
+	# Stop reading any more of the bin file. The track being read is
+	# finished off with the data read so far, and reported as cancelled.
+	def Cancel (self):
+		self.cancelled = True
+
+	def Finished (self):
+		for thread in self.threads:
+			if thread.isAlive():
+				return (False)
+		return (True)
+
+	# Get the number of the track being read, or None before the start
+	def CurrentTrack (self):
+		return (self.currentTrack)
+
+	# Get the total number of sectors in the tracks to be ripped
+	def TotalSectors (self):
+		return (sum ([cdgparse.TrackSectors (track["size"]) for track in self.tracks]))
+
+	# Get the names of the tracks which failed (or were never finished,
+	# or were cut short by Cancel())
+	def Failed (self):
+		return ([track["name"] for track in self.tracks
+					if (track["error"] != None) or (track["status"] != 0)
+						or not (track["encoded"] and track["written"] and track["readComplete"])])
+
+	# Get the timing details for each stage, as a list of dictionaries
+	def StageStats (self):
+		return ([stage.Stats() for stage in self.stages])
+
+	# Get the name of the stage with the highest occupancy
+	def Bottleneck (self):
+		best = None
+		for stats in self.StageStats():
+			if (best == None) or (stats["occupancy"] > best["occupancy"]):
+				best = stats
+		return (best["name"])
+
+	def _RunStage (self, target, stage):
+		stage.startTime = time.time()
+		try:
+			target (stage)
+		finally:
+			stage.endTime = time.time()
+
+	# Record an error on a track. Only the first error is kept.
+	def _TrackError (self, track, error):
+		if self.tracks[track]["error"] == None:
+			self.tracks[track]["error"] = error
+
+	# Called by the encode and write stages when done with a track.
+	# Once both are done, the track is finished.
+	def _TrackDone (self, track, part):
+		self.lock.acquire()
+		try:
+			trackd = self.tracks[track]
+			trackd[part] = True
+			finished = trackd["encoded"] and trackd["written"]
+		finally:
+			self.lock.release()
+		if finished:
+			self._CacheDone (track)
+			if trackd["status"] == None:
+				# Nothing was read for the track, so there was nothing to encode
+				trackd["status"] = 0
+			if trackd["status"] != 0:
+				self._Log (track, "-> ERROR: Encoding %s failed (exit status %d)"
+									% (trackd["name"], trackd["status"]))
+			elif trackd["error"] != None:
+				self._Log (track, "-> ERROR: Ripping %s failed (%s)" % (trackd["name"], trackd["error"]))
+			elif not trackd["readComplete"]:
+				self._Log (track, "-> Cancelled: %s" % trackd["name"])
+			else:
+				self._Log (track, "-> Finished: %s" % trackd["name"])
+				if self.onFinished != None:
+					self.onFinished (track)
+			self.orderedLog.Done (track)
+
+	# Read stage: demultiplex each track into audio and CD+G chunks
+	def _Read (self, stage):
+		current = None
+		try:
+			try:
+				for track, pcmchunk, cdgchunk in self._iter_tracks():
+					if self.cancelled:
+						break
+					if track != current:
+						if current != None:
+							self.tracks[current]["readComplete"] = True
+							self._EndTrack (stage, current)
+						current = track
+						self.currentTrack = track
+						self._StartTrack (track)
+					stage.items = stage.items + 1
+					self._CacheRaw (track, pcmchunk, cdgchunk)
+					stage.Send (self.encodeStage, (track, pcmchunk))
+					stage.Send (self.deinterleaveStage, (track, cdgchunk))
+				else:
+					if current != None:
+						self.tracks[current]["readComplete"] = True
+			except Exception:
+				if current == None:
+					current = 0
+					self._StartTrack (current)
+				self._TrackError (current, sys.exc_info()[1])
+		finally:
+			if current != None:
+				self._EndTrack (stage, current)
+			stage.Send (self.encodeStage, None)
+			stage.Send (self.deinterleaveStage, None)
+
+	# Generate the audio and CD+G chunks of every track in turn. Tracks
+	# found in the cache are read back from there, and runs of tracks
+	# which aren't are read from the bin file.
+	def _iter_tracks (self):
+		run = []
+		for track in range (len(self.tracks)) + [None]:
+			if (track != None) and (self.cache != None):
+				trackd = self.tracks[track]
+				try:
+					trackd["cacheKey"] = self.cache.Lookup (self.binfilename, trackd["start"],
+															trackd["size"], self.interleaved)
+				except (IOError, OSError):
+					trackd["cacheKey"] = None
+			if (track != None) and (self.tracks[track]["cacheKey"] == None):
+				run.append (track)
+				continue
+
+			# Read the run of uncached tracks before this one from the bin file
+			if len(run) > 0:
+				for runtrack, pcmchunk, cdgchunk in cdgparse.iter_disc (self.binfile,
+											[self.tracks[t]["start"] for t in run],
+											[self.tracks[t]["size"] for t in run],
+											self.chunkSectors,
+											[self.tracks[t]["name"] for t in run]):
+					yield (run[runtrack], pcmchunk, cdgchunk)
+				run = []
+			if track != None:
+				cdgstats.SetTrack (self.tracks[track]["name"])
+				for pcmchunk, cdgchunk in self.cache.iter_entry (self.tracks[track]["cacheKey"],
+																 self.chunkSectors):
+					yield (track, pcmchunk, cdgchunk)
+
+	def _StartTrack (self, track):
+		if self.separator != None:
+			self._Log (track, self.separator)
+		self._Log (track, "-> Starting: %s" % self.tracks[track]["name"])
+		if self.verbose == True:
+			self._Log (track, "-> Track start byte = %d, Track Size = %d"
+								% (self.tracks[track]["start"], self.tracks[track]["size"]))
+		if self.tracks[track]["cacheKey"] != None:
+			self._Log (track, "-> Reading audio and CD+G data from the cache")
+		else:
+			self._Log (track, "-> Ripping audio and CD+G subchannel data")
+			if self.cache != None:
+				try:
+					self.tracks[track]["cacheEntry"] = self.cache.NewEntry (self.binfilename,
+								self.tracks[track]["start"], self.tracks[track]["size"], self.interleaved)
+				except (IOError, OSError):
+					self.tracks[track]["cacheError"] = sys.exc_info()[1]
+
+	# Add a chunk of a track being ripped to its cache entry. Problems
+	# with the cache don't stop the rip, the track just isn't cached.
+	def _CacheRaw (self, track, pcmchunk, cdgchunk):
+		trackd = self.tracks[track]
+		if (trackd["cacheEntry"] != None) and (trackd["cacheError"] == None):
+			try:
+				trackd["cacheEntry"].AddRaw (pcmchunk, cdgchunk)
+			except (IOError, OSError):
+				trackd["cacheError"] = sys.exc_info()[1]
+
+	def _CacheCdg (self, track, cdgchunk):
+		trackd = self.tracks[track]
+		if (trackd["cacheEntry"] != None) and (trackd["cacheError"] == None):
+			try:
+				trackd["cacheEntry"].AddCdg (cdgchunk)
+			except (IOError, OSError):
+				trackd["cacheError"] = sys.exc_info()[1]
+
+	# Add a track's cache entry to the cache, if the whole track was read
+	def _CacheDone (self, track):
+		trackd = self.tracks[track]
+		entry = trackd["cacheEntry"]
+		if entry == None:
+			return
+		trackd["cacheEntry"] = None
+		try:
+			if (trackd["cacheError"] == None) and trackd["readComplete"]:
+				entry.Commit()
+			else:
+				entry.Abort()
+				if trackd["cacheError"] != None:
+					self._Log (track, "-> WARNING: Could not cache %s (%s)"
+										% (trackd["name"], trackd["cacheError"]))
+		except (IOError, OSError):
+			self._Log (track, "-> WARNING: Could not cache %s (%s)" % (trackd["name"], sys.exc_info()[1]))
+
+	# Pass the end of track marker on to both branches
+	def _EndTrack (self, stage, track):
+		stage.Send (self.encodeStage, (track, None))
+		stage.Send (self.deinterleaveStage, (track, None))
+
+	# Encode stage: pipe each track's audio into its own encoder
+	def _Encode (self, stage):
+		encoder = None
+		failedTrack = None
+		while True:
+			item = stage.Get()
+			if item == None:
+				break
+			track, pcmchunk = item
+			cdgstats.SetTrack (self.tracks[track]["name"])
+			if pcmchunk == None:
+				if encoder != None:
+					self.tracks[track]["status"] = encoder.Close()
+					encoder = None
+				self._TrackDone (track, "encoded")
+				continue
+			if (encoder == None) and (self.tracks[track]["status"] == None) \
+					and (failedTrack != track):
+				try:
+					self._Log (track, "-> Encoding audio to mp3")
+					encoder = cdgparse.PcmEncoder (self.tracks[track]["command"])
+				except (IOError, OSError):
+					# Couldn't start the encoder
+					self._TrackError (track, sys.exc_info()[1])
+					failedTrack = track
+			if encoder != None:
+				try:
+					encoder.Write (pcmchunk)
+				except (IOError, OSError):
+					# The encoder has died, drop the rest of the track's audio.
+					# Its exit status normally says why, rather than the error.
+					error = sys.exc_info()[1]
+					self.tracks[track]["status"] = encoder.Close()
+					if self.tracks[track]["status"] == 0:
+						self._TrackError (track, error)
+					encoder = None
+			# Count the audio even if it couldn't be encoded, so that the
+			# progress still reaches the end
+			if self.progress != None:
+				self.progress.Add ((len(pcmchunk) + cdgparse.AUDIO_SIZE - 1) // cdgparse.AUDIO_SIZE)
+
+	# Deinterleave stage: deinterleave raw CD+G data a chunk at a time,
+	# add it to the cache, and correct it if requested
+	def _Deinterleave (self, stage):
+		deinterleaver = None
+		corrector = None
+		while True:
+			item = stage.Get()
+			if item == None:
+				break
+			track, cdgchunk = item
+			cdgstats.SetTrack (self.tracks[track]["name"])
+			if cdgchunk == None:
+				deinterleaver = None
+				if corrector != None:
+					self.tracks[track]["eccCorrected"] = corrector.corrected
+					self.tracks[track]["eccUncorrectable"] = corrector.uncorrectable
+					self._Log (track, "-> CD+G error correction: %s" % corrector.Summary())
+					corrector = None
+			else:
+				if self.interleaved and (self.tracks[track]["cacheKey"] == None):
+					if deinterleaver == None:
+						deinterleaver = cdgparse.Deinterleaver()
+						self._Log (track, "-> Deinterleaving raw CD+G data")
+					cdgchunk = deinterleaver.Feed (cdgchunk)
+				self._CacheCdg (track, cdgchunk)
+				if self.ecc:
+					if corrector == None:
+						corrector = cdgecc.PackCorrector()
+					cdgchunk = corrector.Feed (cdgchunk)
+			stage.Send (self.writeStage, (track, cdgchunk))
+		stage.Send (self.writeStage, None)
+
+	# Write stage: write out the .cdg files
+	def _Write (self, stage):
+		cdgfile = None
+		failedTrack = None
+		while True:
+			item = stage.Get()
+			if item == None:
+				break
+			track, cdgchunk = item
+			cdgstats.SetTrack (self.tracks[track]["name"])
+			try:
+				if (cdgfile == None) and (failedTrack != track):
+					cdgfile = open (self.tracks[track]["cdgpath"], "wb")
+				if cdgchunk == None:
+					if cdgfile != None:
+						cdgfile.close()
+						cdgfile = None
+				elif cdgfile != None:
+					start = cdgstats.Start()
+					cdgfile.write (cdgchunk)
+					cdgstats.Stop (start, "write", len(cdgchunk), len(cdgchunk))
+			except (IOError, OSError):
+				self._TrackError (track, sys.exc_info()[1])
+				failedTrack = track
+				if cdgfile != None:
+					cdgfile.close()
+					cdgfile = None
+			if cdgchunk == None:
+				self._TrackDone (track, "written")
+
+
+# Print the stage occupancy details for a pipeline
+def PrintStageStats (pipeline, output=_Print):
+	output ("-> Pipeline stage occupancy:")
+	for stats in pipeline.StageStats():
+		output ("->   %-12s busy %5.1f%%, waiting for input %5.1f%%, for output %5.1f%%, avg queue %.1f"
+				% (stats["name"], 100 * stats["occupancy"],
+				   100 * stats["inputWait"] / max (stats["wall"], 1e-9),
+				   100 * stats["outputWait"] / max (stats["wall"], 1e-9),
+				   stats["avgQueue"]))
+	output ("-> Bottleneck stage: %s" % pipeline.Bottleneck())
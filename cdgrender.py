@@ -0,0 +1,317 @@
+# cdgrender - cdgtools: CD+G screen renderer
+
+# Copyright (C) 2009  Kelvin Lawson (kelvinl@users.sf.net)
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+
+# OVERVIEW
+#
+# cdgrender is part of the cdgtools suite of CD+G karaoke software.
+#
+# This module plays the instructions of a .cdg file (see cdgpacks.py)
+# onto a copy of the CD+G screen, so that the picture at any point in
+# the song can be looked at or saved.
+#
+# The screen is 300x216 pixels, of which the middle 288x192 is shown
+# inside a border of 6 pixels each side and 12 pixels top and bottom.
+# It is drawn in 6x12 pixel tiles, 50 across and 18 down. Each pixel
+# is one of 16 colours from the colour table. The renderer keeps:
+#
+#   . pixels   - the colour index of each pixel, as a bytearray of 216
+#                rows of 300 pixels
+#   . palette  - the colour table, as a bytearray of 16 (red, green,
+#                blue) entries of 0-255
+#   . border, transparent, hOffset, vOffset - the border colour, the
+#                transparent colour and the fine scroll offsets
+#
+# The instructions are applied to whole rows of pixels at a time: each
+# 6 pixel row of a tile is written (or XORed) with one struct call, a
+# scroll rotates the whole screen with one slice and fixes up the
+# wrapped columns with extended slices, and a colour table load
+# replaces 8 entries of the palette with one slice assignment.
+#
+# The renderer also keeps track of the rectangle of the screen which
+# has changed, so that a viewer only needs to convert that part to RGB
+# (with RGB(), which translates the colour indexes through the palette
+# a colour channel at a time):
+#
+#   renderer = cdgrender.CdgRenderer()
+#   packs = cdgpacks.LoadFile ("theboxer.cdg")
+#   for index in packs.Commands():
+#       renderer.Process (packs.kind[index], packs.Data (index))
+#       rect = renderer.TakeDirty()
+#       if rect != None:
+#           rgb = renderer.RGB (rect)
+#           ... update that part of the display ...
+#
+# For further details see http://www.kibosh.org/cdgtools/
+
+import struct, bisect
+import cdgpacks
+
+
+# Screen layout
+WIDTH = 300
+HEIGHT = 216
+TILE_WIDTH = 6
+TILE_HEIGHT = 12
+TILE_COLUMNS = WIDTH // TILE_WIDTH
+TILE_ROWS = HEIGHT // TILE_HEIGHT
+# Bits of a tile block's row and column fields which are used
+TILE_ROW_MASK = 0x1F
+TILE_COLUMN_MASK = 0x3F
+BORDER_WIDTH = 6
+BORDER_HEIGHT = 12
+
+# The whole screen, and the part inside the border, as (x0, y0, x1, y1)
+FULL_SCREEN = (0, 0, WIDTH, HEIGHT)
+VISIBLE_SCREEN = (BORDER_WIDTH, BORDER_HEIGHT, WIDTH - BORDER_WIDTH, HEIGHT - BORDER_HEIGHT)
+
+# Scroll commands
+SCROLL_NONE = 0
+SCROLL_RIGHT = 1
+SCROLL_DOWN = 1
+SCROLL_LEFT = 2
+SCROLL_UP = 2
+
+# One 6 pixel row of a tile, as two big-endian integers
+_tileRow = struct.Struct (">IH")
+
+
+# Union of two rectangles, either of which may be None
+def _Union (a, b):
+	if a == None:
+		return (b)
+	if b == None:
+		return (a)
+	return (min (a[0], b[0]), min (a[1], b[1]), max (a[2], b[2]), max (a[3], b[3]))
+
+
+# The 6 pixel rows of a tile in colours colour0 and colour1, for each
+# of the 64 possible rows of pixel bits (the leftmost pixel being bit
+# 5), as the integers to pack with _tileRow. Built as needed.
+_tilePatterns = {}
+def _TilePatterns (colour0, colour1):
+	patterns = _tilePatterns.get ((colour0, colour1))
+	if patterns == None:
+		patterns = []
+		for bits in range (64):
+			row = bytearray ([(colour1 if bits & (0x20 >> x) else colour0) for x in range (TILE_WIDTH)])
+			patterns.append (_tileRow.unpack (bytes (row)))
+		_tilePatterns[(colour0, colour1)] = patterns
+	return (patterns)
+
+
+# CdgRenderer Class
+#
+# The state of the CD+G screen, as described above. Process() applies
+# one CD+G instruction. The screen starts out cleared to colour 0 with
+# a black colour table.
+class CdgRenderer:
+	def __init__(self):
+		self.pixels = bytearray (WIDTH * HEIGHT)
+		self.palette = bytearray (16 * 3)
+		self.channelTables = None
+		self.border = 0
+		self.transparent = None
+		self.hOffset = 0
+		self.vOffset = 0
+		self.dirty = FULL_SCREEN
+
+	# Apply one instruction, given its kind (see cdgpacks.py) and its 16
+	# (masked) data bytes. Unknown instructions are ignored.
+	def Process (self, kind, data):
+		if kind == cdgpacks.CDG_INST_TILE_BLOCK:
+			self.TileBlock (data, xor = False)
+		elif kind == cdgpacks.CDG_INST_TILE_BLOCK_XOR:
+			self.TileBlock (data, xor = True)
+		elif kind == cdgpacks.CDG_INST_MEMORY_PRESET:
+			self.MemoryPreset (data[0] & 0x0F)
+		elif kind == cdgpacks.CDG_INST_BORDER_PRESET:
+			self.BorderPreset (data[0] & 0x0F)
+		elif kind == cdgpacks.CDG_INST_SCROLL_PRESET:
+			self.Scroll (data, copy = False)
+		elif kind == cdgpacks.CDG_INST_SCROLL_COPY:
+			self.Scroll (data, copy = True)
+		elif kind == cdgpacks.CDG_INST_DEF_TRANSP_COL:
+			self.transparent = data[0] & 0x0F
+		elif kind == cdgpacks.CDG_INST_LOAD_COL_TBL_0_7:
+			self.LoadColourTable (data, 0)
+		elif kind == cdgpacks.CDG_INST_LOAD_COL_TBL_8_15:
+			self.LoadColourTable (data, 8)
+
+	# Apply the graphics packets of a CdgPacks, from packet position start
+	# up to (but not including) end
+	def Play (self, packs, start=0, end=None, commands=None):
+		if commands == None:
+			commands = packs.Commands()
+		if end == None:
+			end = packs.count
+		first = bisect.bisect_left (commands, start)
+		last = bisect.bisect_left (commands, end)
+		for index in commands[first:last]:
+			self.Process (packs.kind[index], packs.Data (index))
+
+	# Draw (or XOR) a 6x12 tile
+	def TileBlock (self, data, xor):
+		row = data[2] & TILE_ROW_MASK
+		column = data[3] & TILE_COLUMN_MASK
+		if (row >= TILE_ROWS) or (column >= TILE_COLUMNS):
+			return
+		x = column * TILE_WIDTH
+		y = row * TILE_HEIGHT
+		patterns = _TilePatterns (data[0] & 0x0F, data[1] & 0x0F)
+		offset = (y * WIDTH) + x
+		pixels = self.pixels
+		if xor:
+			for line in range (TILE_HEIGHT):
+				high, low = _tileRow.unpack_from (pixels, offset)
+				patternHigh, patternLow = patterns[data[4 + line] & 0x3F]
+				_tileRow.pack_into (pixels, offset, high ^ patternHigh, low ^ patternLow)
+				offset = offset + WIDTH
+		else:
+			for line in range (TILE_HEIGHT):
+				patternHigh, patternLow = patterns[data[4 + line] & 0x3F]
+				_tileRow.pack_into (pixels, offset, patternHigh, patternLow)
+				offset = offset + WIDTH
+		self.dirty = _Union (self.dirty, (x, y, x + TILE_WIDTH, y + TILE_HEIGHT))
+
+	# Clear the whole screen to a colour
+	def MemoryPreset (self, colour):
+		self.pixels[:] = bytearray ([colour]) * (WIDTH * HEIGHT)
+		self.dirty = FULL_SCREEN
+
+	# Set the border to a colour
+	def BorderPreset (self, colour):
+		self.border = colour
+		fill = bytearray ([colour])
+		pixels = self.pixels
+		top = BORDER_HEIGHT * WIDTH
+		bottom = (HEIGHT - BORDER_HEIGHT) * WIDTH
+		pixels[:top] = fill * top
+		pixels[bottom:] = fill * (len(pixels) - bottom)
+		for x in range (BORDER_WIDTH):
+			pixels[top + x:bottom:WIDTH] = fill * (HEIGHT - (2 * BORDER_HEIGHT))
+			pixels[top + WIDTH - 1 - x:bottom:WIDTH] = fill * (HEIGHT - (2 * BORDER_HEIGHT))
+		self.dirty = FULL_SCREEN
+
+	# Scroll the screen by a tile in either direction, either wrapping
+	# round what is scrolled off (copy) or filling the space with a colour
+	def Scroll (self, data, copy):
+		colour = data[0] & 0x0F
+		hScroll = data[1] & 0x3F
+		vScroll = data[2] & 0x3F
+		hCommand = (hScroll & 0x30) >> 4
+		vCommand = (vScroll & 0x30) >> 4
+		self.hOffset = hScroll & 0x07
+		self.vOffset = vScroll & 0x0F
+
+		pixels = self.pixels
+		size = len(pixels)
+		fill = bytearray ([colour])
+		if hCommand in (SCROLL_LEFT, SCROLL_RIGHT):
+			# Rotate the whole screen, which moves the pixels which should
+			# wrap round onto the next (or previous) row, then put those
+			# columns right
+			if hCommand == SCROLL_LEFT:
+				old = pixels[:]
+				pixels[:] = old[TILE_WIDTH:] + old[:TILE_WIDTH]
+				for x in range (TILE_WIDTH):
+					target = WIDTH - TILE_WIDTH + x
+					if copy:
+						pixels[target::WIDTH] = old[x::WIDTH]
+					else:
+						pixels[target::WIDTH] = fill * HEIGHT
+			else:
+				old = pixels[:]
+				pixels[:] = old[-TILE_WIDTH:] + old[:-TILE_WIDTH]
+				for x in range (TILE_WIDTH):
+					source = WIDTH - TILE_WIDTH + x
+					if copy:
+						pixels[x::WIDTH] = old[source::WIDTH]
+					else:
+						pixels[x::WIDTH] = fill * HEIGHT
+			self.dirty = FULL_SCREEN
+		if vCommand in (SCROLL_UP, SCROLL_DOWN):
+			# A whole row of tiles is a contiguous block of the screen
+			band = TILE_HEIGHT * WIDTH
+			if vCommand == SCROLL_UP:
+				if copy:
+					pixels[:] = pixels[band:] + pixels[:band]
+				else:
+					pixels[:] = pixels[band:] + (fill * band)
+			else:
+				if copy:
+					pixels[:] = pixels[size - band:] + pixels[:size - band]
+				else:
+					pixels[:] = (fill * band) + pixels[:size - band]
+			self.dirty = FULL_SCREEN
+
+	# Load 8 entries of the colour table, starting at entry first. Each
+	# entry is 4 bits each of red, green and blue, spread over two bytes.
+	def LoadColourTable (self, data, first):
+		entries = bytearray (8 * 3)
+		for i in range (8):
+			high = data[2 * i] & 0x3F
+			low = data[(2 * i) + 1] & 0x3F
+			entries[3 * i] = ((high >> 2) & 0x0F) * 17
+			entries[(3 * i) + 1] = (((high & 0x03) << 2) | ((low >> 4) & 0x03)) * 17
+			entries[(3 * i) + 2] = (low & 0x0F) * 17
+		self.palette[first * 3:(first + 8) * 3] = entries
+		self.channelTables = None
+		# Every pixel may have changed colour
+		self.dirty = FULL_SCREEN
+
+	# Get the rectangle which has changed since the last call, as (x0,
+	# y0, x1, y1), or None if nothing has changed
+	def TakeDirty (self):
+		dirty = self.dirty
+		self.dirty = None
+		return (dirty)
+
+	# Get the colour indexes of a rectangle of the screen, as one row
+	# after another
+	def Indexes (self, rect=FULL_SCREEN):
+		x0, y0, x1, y1 = rect
+		if (x0 == 0) and (x1 == WIDTH):
+			return (bytes (self.pixels[y0 * WIDTH:y1 * WIDTH]))
+		return (b"".join ([bytes (self.pixels[(y * WIDTH) + x0:(y * WIDTH) + x1])
+							for y in range (y0, y1)]))
+
+	# Get a rectangle of the screen in RGB, 3 bytes per pixel, one row
+	# after another
+	def RGB (self, rect=FULL_SCREEN):
+		if self.channelTables == None:
+			# Translate tables from colour index to red, green and blue
+			self.channelTables = [bytes (bytearray ([self.palette[(3 * (colour & 0x0F)) + channel]
+													  for colour in range (256)])) for channel in range (3)]
+		indexes = self.Indexes (rect)
+		rgb = bytearray (len(indexes) * 3)
+		for channel in range (3):
+			rgb[channel::3] = indexes.translate (self.channelTables[channel])
+		return (bytes (rgb))
+
+	# Get the state of the screen, to be restored with Restore()
+	def State (self):
+		return ((bytes (self.pixels), bytes (self.palette), self.border, self.transparent,
+				 self.hOffset, self.vOffset))
+
+	def Restore (self, state):
+		pixels, palette, self.border, self.transparent, self.hOffset, self.vOffset = state
+		self.pixels[:] = pixels
+		self.palette[:] = palette
+		self.channelTables = None
+		self.dirty = FULL_SCREEN
@@ -55,8 +55,8 @@
 # . lame (http://lame.sourceforge.net)
 #
 # If you wish to use an alternative encoder to lame, you can
-# change the command-string in the cdgrip() function below 
-# (see lame_string). If you would like to see native support
+# change the command passed to PcmEncoder in the TrackSink class below.
+# If you would like to see native support
 # for your favourite encoder, or make it configurable from
 # the command-line, let us know.
 #
@@ -124,6 +124,61 @@
 #
 # If a match is found in CDDB then your .mp3 and .cdg files will use
 # these names instead.
+#
+# By default each track is ripped from the bin file in turn. To rip the
+# whole disc in one sequential read of the bin file instead (which
+# can be quicker when the bin file is on slow or network storage),
+# add the --single-pass option:
+#
+#   python cdgrip.py --single-pass mycd.toc
+#
+# The mp3 encoding is the slowest part of the rip. On a machine with
+# several cores, use the --jobs option to rip and encode several tracks
+# at once. e.g. for 4 tracks at once:
+#
+#   python cdgrip.py --jobs 4 mycd.toc
+#
+# Without --jobs, the tracks are ripped one at a time through a
+# pipeline of stages (see cdgpipe.py), so the encode of each track
+# overlaps with the read of the next. At the end of the rip, cdgrip
+# shows how busy each stage was, to show where the bottleneck is.
+# --jobs has no effect with --single-pass, as the disc is read in order.
+#
+# As each track is finished, cdgrip records it in a manifest file next
+# to the toc file (e.g. mycd.manifest), along with checksums of the
+# .mp3 and .cdg files. If a rip is interrupted, just run cdgrip again:
+# any tracks which were already finished (and whose output files are
+# unchanged) are skipped. Tracks which were ripped with different
+# options (the encoder settings, or --ecc) are ripped again. To rip
+# every track again from scratch, delete the manifest file first.
+#
+# If you expect to encode the same disc more than once (e.g. with
+# different lame settings, or after fixing the track names), add the
+# --cache option. The audio and CD+G data ripped from each track is
+# then kept in a cache directory (~/.cdgtools/cache by default, or
+# use --cache-dir), and later encodes of the same disc read it back
+# from there rather than from the bin file. The least recently used
+# tracks are removed once the cache grows past --cache-size megabytes.
+#
+# To see where the time goes during a rip, add the --stats option. At
+# the end of the rip cdgrip then shows the time (wall clock and CPU)
+# spent in each stage of the rip (reading the bin file, splitting out
+# the audio and CD+G data, deinterleaving, encoding and writing), and
+# how much data went through it, for the whole disc and for each track.
+# Use --stats-json FILE to save the same details as a JSON report.
+#
+# To follow the progress of a long rip, add --progress SECS. Every SECS
+# seconds cdgrip then shows how far through the rip it is, the current
+# speed and an estimate of the time left, e.g.:
+#
+#   -> Progress: 42% (12.3 MB/s, 20.1x, 1:23 left)
+#
+# CD+G data ripped from a scratched disc can be damaged, which shows up
+# as garbage on the screen. Each packet of CD+G data carries error
+# correction codes, and with the --ecc option cdgrip uses these to
+# correct damaged packets as it rips (see cdgecc.py). The number of
+# packets corrected, and any which were too badly damaged to correct,
+# are shown for each track.
 
 
 # IMPLEMENTATION DETAILS
@@ -155,8 +210,8 @@
 
 
 # Standard Python and local imports
-import sys, os, getopt
-import cdgtools, cdgdao, cdgparse, cdgcddb
+import sys, os, getopt, threading, Queue
+import cdgtools, cdgdao, cdgparse, cdgcddb, cdgpipe, cdgmanifest, cdgcache, cdgstats, cdgecc
 
 
 # Constants
@@ -165,7 +220,232 @@ DELIMITER = ("-----------------------------------------------------------")
 
 
 
-def cdgrip(tocfilename, delete_bin_toc=False, with_cddb=False, verbose=False):
+# EncodePool Class
+#
+# Runs the rip and encode jobs for the tracks on a bounded pool of
+# worker threads, so that several tracks can be encoding at once.
+# Submit() blocks once every worker is busy and the queue of waiting
+# jobs is full.
+#
+# Each track's console output goes through Log(), which uses an
+# OrderedLog to keep the output of each track together and in order
+# however many jobs are running. A track that fails to encode is
+# reported and recorded, but the other tracks carry on. If on_finished
+# is given, it is called with the sequence number of each track which
+# is successfully encoded.
+class EncodePool:
+	def __init__(self, jobs=1, on_finished=None):
+		self.jobs = jobs
+		self.onFinished = on_finished
+		self.numTracks = 0
+		self.orderedLog = cdgpipe.OrderedLog()
+		self.failed = []
+
+		self.workers = []
+		if jobs > 1:
+			self.queue = Queue.Queue (jobs)
+			for i in range (jobs):
+				worker = threading.Thread (target = self._Worker)
+				worker.setDaemon (True)
+				worker.start()
+				self.workers.append (worker)
+
+	# Get the sequence number for the next track's output
+	def NewTrack (self):
+		self.numTracks = self.numTracks + 1
+		return (self.numTracks - 1)
+
+	# Print (or hold back) a line of console output for a track
+	def Log (self, seq, message):
+		self.orderedLog.Log (seq, message)
+
+	# Run func(*args) to encode a track. Runs it immediately if there is
+	# only one job, otherwise queues it for the workers.
+	def Submit (self, seq, trackname, func, args):
+		if self.jobs > 1:
+			self.queue.put ((seq, trackname, func, args))
+		else:
+			self._Run (seq, trackname, func, args)
+
+	def _Worker (self):
+		while True:
+			job = self.queue.get()
+			if job == None:
+				return
+			self._Run (*job)
+
+	def _Run (self, seq, trackname, func, args):
+		try:
+			status = func (*args)
+			if status != 0:
+				self.Log (seq, "-> ERROR: Encoding %s failed (exit status %d)" % (trackname, status))
+				self.failed.append ((seq, trackname))
+			else:
+				self.Log (seq, "-> Finished: %s" % trackname)
+				if self.onFinished != None:
+					self.onFinished (seq)
+		except Exception:
+			self.Log (seq, "-> ERROR: Encoding %s failed (%s)" % (trackname, sys.exc_info()[1]))
+			self.failed.append ((seq, trackname))
+		self.orderedLog.Done (seq)
+
+	# Wait for all the encodes to finish. Returns the names of any tracks
+	# which failed, in track order.
+	def Finish (self):
+		for worker in self.workers:
+			self.queue.put (None)
+		for worker in self.workers:
+			worker.join()
+		self.failed.sort()
+		return ([trackname for seq, trackname in self.failed])
+
+
+# TrackSink Class
+#
+# Receives the audio and subchannel data for one track as it is ripped.
+# The audio is piped straight into a lame process as it arrives, and
+# the CD+G data written straight out to the .cdg file, deinterleaving
+# on the way if the data is in raw format, and correcting it if ecc is
+# True. Close() finishes the encode and returns the lame exit status.
+# Write() returns the deinterleaved CD+G data, before any correction.
+class TrackSink:
+	def __init__(self, pool, seq, track, trackname, interleaved, startByte, trackSize, verbose=False,
+					cached=False, ecc=False):
+		self.pool = pool
+		self.seq = seq
+		self.track = track
+		self.trackname = trackname
+		self.interleaved = interleaved
+		self.encoderError = None
+
+		self.Log (DELIMITER)
+		self.Log ("-> Starting: %s" % trackname)
+		if verbose == True:
+			self.Log ("-> Track start byte = %d, Track Size = %d" % (startByte, trackSize))
+
+		if cached:
+			self.Log ("-> Reading audio and CD+G data from the cache")
+		else:
+			self.Log ("-> Ripping audio and CD+G subchannel data")
+		if (interleaved):
+			self.Log ("-> Deinterleaving raw CD+G data")
+			self.deinterleaver = cdgparse.Deinterleaver()
+		self.corrector = None
+		if ecc:
+			self.corrector = cdgecc.PackCorrector()
+		self.cdgfile = open ("%s.cdg" % trackname, "wb")
+
+		# Encode with lame, piping the audio in as it is ripped
+		self.Log ("-> Encoding audio to mp3")
+		self.encoder = cdgparse.PcmEncoder (cdgparse.LameCommand ("%s.mp3" % trackname))
+
+	def Log (self, message):
+		self.pool.Log (self.seq, message)
+
+	def Write (self, pcmdata, cdgdata):
+		# If lame has died, keep going with the CD+G data, and report
+		# the failure when the sink is closed
+		if self.encoderError == None:
+			try:
+				self.encoder.Write (pcmdata)
+			except (IOError, OSError):
+				self.encoderError = sys.exc_info()[1]
+		if (self.interleaved):
+			cdgdata = self.deinterleaver.Feed (cdgdata)
+		correctdata = cdgdata
+		if self.corrector != None:
+			correctdata = self.corrector.Feed (cdgdata)
+		start = cdgstats.Start()
+		self.cdgfile.write (correctdata)
+		cdgstats.Stop (start, "write", len(correctdata), len(correctdata))
+		return (cdgdata)
+
+	def Close (self):
+		self.cdgfile.close()
+		if self.corrector != None:
+			self.Log ("-> CD+G error correction: %s" % self.corrector.Summary())
+		status = self.encoder.Close()
+		if (status == 0) and (self.encoderError != None):
+			raise self.encoderError
+		return (status)
+
+
+# Get the list of output files for a track
+def TrackOutputs (trackname):
+	return (["%s.mp3" % trackname, "%s.cdg" % trackname])
+
+
+# Rip and encode one track from the BinImage, in a single pass over
+# the track. Run as an EncodePool job, so several tracks can be ripped
+# and encoded at once. If a StreamCache is given, the track is read
+# from the cache if it's there, and otherwise added to it. If a
+# cdgparse.Progress is given, the track's sectors are added to it as
+# they are encoded. If ecc is True the CD+G packs are corrected.
+def RipTrack (pool, seq, binimage, track, trackname, interleaved, verbose, cache=None, progress=None,
+				ecc=False):
+	cdgstats.SetTrack (trackname)
+	startByte = binimage.startBytes[track]
+	trackSize = binimage.trackSizeBytes[track]
+	key = None
+	entry = None
+	if cache != None:
+		try:
+			key = cache.Lookup (binimage.FileName, startByte, trackSize, interleaved)
+			if key == None:
+				entry = cache.NewEntry (binimage.FileName, startByte, trackSize, interleaved)
+		except (IOError, OSError):
+			pool.Log (seq, "-> WARNING: Could not use the cache (%s)" % sys.exc_info()[1])
+
+	# Cached CD+G data is already deinterleaved
+	sink = TrackSink (pool, seq, track, trackname, interleaved and (key == None),
+						startByte, trackSize, verbose, cached = (key != None), ecc = ecc)
+	complete = False
+	try:
+		if key != None:
+			chunks = cache.iter_entry (key)
+		else:
+			chunks = cdgparse.iter_pcmcdg (binimage, startByte, trackSize)
+		for pcmchunk, cdgchunk in chunks:
+			rawcdg = cdgchunk
+			cdgchunk = sink.Write (pcmchunk, cdgchunk)
+			if progress != None:
+				progress.Add ((len(pcmchunk) + cdgparse.AUDIO_SIZE - 1) // cdgparse.AUDIO_SIZE)
+			if entry != None:
+				# Problems with the cache don't stop the rip
+				try:
+					entry.AddRaw (pcmchunk, rawcdg)
+					entry.AddCdg (cdgchunk)
+				except (IOError, OSError):
+					pool.Log (seq, "-> WARNING: Could not cache %s (%s)" % (trackname, sys.exc_info()[1]))
+					entry.Abort()
+					entry = None
+		complete = True
+	finally:
+		status = sink.Close()
+		if entry != None:
+			try:
+				if complete:
+					entry.Commit()
+				else:
+					entry.Abort()
+			except (IOError, OSError):
+				pool.Log (seq, "-> WARNING: Could not cache %s (%s)" % (trackname, sys.exc_info()[1]))
+	return (status)
+
+
+# Get the rip options which affect the output files, to be recorded in
+# the manifest: whether error correction is on, and the encoder command
+# (with %s in place of the track name)
+def RipOptions (ecc):
+	return ({"ecc": ecc, "encoder": cdgparse.LameCommand ("%s.mp3")})
+
+
+def cdgrip(tocfilename, delete_bin_toc=False, with_cddb=False, verbose=False, single_pass=False, jobs=1,
+			cache_dir=None, cache_bytes=cdgcache.DEFAULT_CACHE_BYTES, stats=False, stats_json=None,
+			progress_interval=None, ecc=False):
+
+	# Start collecting the statistics for this rip
+	cdgstats.Reset()
 
 	# Parse the TOC file to get the bin file and track details
 	binfilename, interleaved, startBytes, trackSizeBytes = cdgdao.ParseToc (tocfilename)
@@ -216,60 +496,124 @@ def cdgrip(tocfilename, delete_bin_toc=False, with_cddb=False, verbose=False):
 				print ("-> CDDB track info: %s" % trackname)
 			# Otherwise (no CDDB match found) use generic track names
 
-	# Convert the audio and subchannel data for each track to .mp3 and .cdg files
+	# Skip any tracks which were finished by a previous (interrupted) rip
+	# of the same bin file with the same options, and whose output files
+	# are still intact
+	manifest = cdgmanifest.RipManifest (tocfilename, binfilename)
+	options = RipOptions (ecc)
+	ripTracks = []
 	for track in range(numTracks):
-		print (DELIMITER)
-		print ("-> Starting: %s" % trackNames[track])
-		if verbose == True:
-			print ("-> Track start byte = %d, Track Size = %d"
-					% (startBytes[track], trackSizeBytes[track]))
-
-		# Rip the audio to a raw PCM file
-		print ("-> Ripping audio")
-		pcmdata = cdgparse.bin2pcm (binfilename, startBytes[track], trackSizeBytes[track])
-		cdgparse.pcmWriteToFile ("temp.pcm", pcmdata)
-		
-		# Encode with lame
-		print ("-> Encoding audio to mp3")
-		mp3name = "%s.mp3" % trackNames[track]
-		# Quote any songnames with spaces in before calling lame
-		if mp3name.find(" ") != -1:
-			mp3name = "\"%s\"" % mp3name
-		lame_string = "lame -r --silent --cbr --big-endian temp.pcm %s" % mp3name
-		os.system (lame_string)
-
-		print ("-> Ripping CD+G subchannel data")
-		cdgdata = cdgparse.bin2cdg (binfilename, startBytes[track], trackSizeBytes[track])
-
-		# Deinterleave if the data is in raw format
-		if (interleaved):
-			print ("-> Deinterleaving raw CD+G data")
-			cdgdata = cdgparse.Deinterleave (cdgdata)
+		if manifest.IsDone (trackNames[track], startBytes[track], trackSizeBytes[track],
+								TrackOutputs (trackNames[track]), options):
+			print ("-> Skipping: %s (already ripped)" % trackNames[track])
+		else:
+			ripTracks.append (track)
+
+	# Record each track in the manifest as it is finished, so that the
+	# rip can be resumed from there if it is interrupted
+	def TrackFinished (seq):
+		track = ripTracks[seq]
+		try:
+			manifest.TrackDone (trackNames[track], startBytes[track], trackSizeBytes[track],
+								TrackOutputs (trackNames[track]), options)
+		except (IOError, OSError):
+			print ("-> WARNING: Could not update the rip manifest (%s)" % sys.exc_info()[1])
+
+	# Show the progress through the rip every progress_interval seconds,
+	# if requested
+	progressCallback = None
+	if progress_interval != None:
+		def progressCallback (done, total, rate):
+			sys.stdout.write ("-> Progress: %s\n" % cdgparse.ProgressText (done, total, rate))
+	else:
+		progress_interval = cdgparse.PROGRESS_INTERVAL
+
+	# Open the cache of ripped tracks, if requested
+	cache = None
+	if cache_dir != None:
+		cache = cdgcache.StreamCache (cache_dir, cache_bytes)
+		print ("-> Using the track cache in %s" % cache.directory)
 
-		# Write the finished CDG data out to a file
-		cdgname = "%s.cdg" % trackNames[track]
-		print ("-> Finished: %s" % trackNames[track])
-		cdgparse.cdgWriteToFile (cdgname, cdgdata)
+	# Convert the audio and subchannel data for each track to .mp3 and .cdg files
+	if len(ripTracks) == 0:
+		print ("-> All tracks were already ripped")
+		failed = []
+	elif (jobs > 1) and not single_pass:
+		# Map the bin file once, to be shared by all of the tracks, and
+		# hand each track to the pool to be ripped and encoded
+		binimage = cdgparse.BinImage (binfilename, startBytes, trackSizeBytes)
+		pool = EncodePool (jobs, on_finished = TrackFinished)
+		progress = None
+		if progressCallback != None:
+			progress = cdgparse.Progress (sum ([cdgparse.TrackSectors (trackSizeBytes[track])
+												for track in ripTracks]),
+										  progressCallback, progress_interval)
+		for track in ripTracks:
+			seq = pool.NewTrack()
+			pool.Submit (seq, trackNames[track], RipTrack,
+							(pool, seq, binimage, track, trackNames[track], interleaved, verbose, cache,
+							 progress, ecc))
+		failed = pool.Finish()
+		binimage.close()
+	else:
+		# Rip the tracks one at a time through the pipeline, so that the
+		# read of each track overlaps with the encode of the one before.
+		# In single pass mode the bin file is read from start to end in
+		# one go, otherwise the bin file is mapped and read a track at a time.
+		if single_pass:
+			binimage = binfilename
+		else:
+			binimage = cdgparse.BinImage (binfilename, startBytes, trackSizeBytes)
+		pipeline = cdgpipe.RipPipeline (binimage, interleaved, separator = DELIMITER, verbose = verbose,
+										on_finished = TrackFinished, cache = cache,
+										progress = progressCallback,
+										progress_interval = progress_interval, ecc = ecc)
+		for track in ripTracks:
+			pipeline.AddTrack (startBytes[track], trackSizeBytes[track], "%s.cdg" % trackNames[track],
+								cdgparse.LameCommand ("%s.mp3" % trackNames[track]), trackNames[track])
+		failed = pipeline.Run()
+		if not single_pass:
+			binimage.close()
 
-	# Delete the temporary PCM audio file
-	os.unlink ("temp.pcm")
+		print (DELIMITER)
+		cdgpipe.PrintStageStats (pipeline)
 
-	# Delete the TOC and BIN file if requested
+	if len(failed) > 0:
+		print (DELIMITER)
+		print ("-> %d track(s) failed to encode:" % len(failed))
+		for trackname in failed:
+			print ("->   %s" % trackname)
+
+	# Delete the TOC and BIN file if requested (keeping them if anything failed)
 	print (DELIMITER)
-	if delete_bin_toc == True:
+	if delete_bin_toc == True and len(failed) > 0:
+		print ("-> Not deleting the cdrdao output files (%s, %s) as some tracks failed"
+				% (tocfilename, binfilename))
+	elif delete_bin_toc == True:
 		print ("-> Deleting the cdrdao output files (%s, %s)" % (tocfilename, binfilename))
 		os.unlink(tocfilename)
 		os.unlink(binfilename)
+		manifest.Remove()
 	else:
 		print ("-> Not deleting the cdrdao output files (%s, %s)" % (tocfilename, binfilename))
 		print ("-> Use --delete-bin-toc to delete them after ripping")
 
+	# Output the statistics if requested
+	if stats == True:
+		print (DELIMITER)
+		cdgstats.Summary()
+	if stats_json != None:
+		cdgstats.WriteReport (stats_json, "cdgrip", {"toc": tocfilename, "failed": failed,
+								"jobs": jobs, "singlePass": single_pass})
+		print (DELIMITER)
+		print ("-> Statistics saved to %s" % stats_json)
+
 	# Finished
 	print (DELIMITER)
 	print ("-> CD+G rip complete")
 	print (DELIMITER)
 
-	return
+	return (failed)
 
 
 # Usage instructions
@@ -288,6 +632,33 @@ def usage():
 	print ("")
 	print ("  --with-cddb               :    Attempt to get track names from CDDB")
 	print ("")
+	print ("  --single-pass             :    Rip the whole disc in one sequential")
+	print ("                                 read of the bin file")
+	print ("")
+	print ("  -j N, --jobs N            :    Run up to N mp3 encodes at once")
+	print ("")
+	print ("  --cache                   :    Keep the ripped audio and CD+G data of")
+	print ("                                 each track in the track cache, and use")
+	print ("                                 it if the disc is encoded again")
+	print ("")
+	print ("  --cache-dir DIR           :    Use DIR for the track cache (default")
+	print ("                                 %s)" % cdgcache.DEFAULT_CACHE_DIR)
+	print ("")
+	print ("  --cache-size MB           :    Limit the track cache to MB megabytes")
+	print ("                                 (default %d)" % (cdgcache.DEFAULT_CACHE_BYTES / (1024 * 1024)))
+	print ("")
+	print ("  --stats                   :    Show timing and throughput statistics")
+	print ("                                 for each stage of the rip")
+	print ("")
+	print ("  --stats-json FILE         :    Save the statistics for the rip to FILE")
+	print ("                                 as a JSON report")
+	print ("")
+	print ("  --ecc                     :    Correct damaged CD+G data using the")
+	print ("                                 error correction codes on the disc")
+	print ("")
+	print ("  --progress SECS           :    Show the progress of the rip, with the")
+	print ("                                 estimated time left, every SECS seconds")
+	print ("")
 	print ("  --help                    :    Display this message")
 	print ("")
 
@@ -300,7 +671,10 @@ def main():
 	
 	# Get the options out
 	try:
-		opts, args = getopt.getopt(sys.argv[1:], "hv", ["delete-bin-toc", "help", "with-cddb"])
+		opts, args = getopt.getopt(sys.argv[1:], "hvj:", ["delete-bin-toc", "help", "with-cddb",
+													"single-pass", "jobs=", "cache", "cache-dir=",
+													"cache-size=", "stats", "stats-json=",
+													"progress=", "ecc"])
 	except getopt.GetoptError:
 		usage()
  		sys.exit(2)
@@ -316,6 +690,14 @@ def main():
 	with_cddb = False
 	delete_bin_toc = False
 	verbose = False
+	single_pass = False
+	jobs = 1
+	cache_dir = None
+	cache_bytes = cdgcache.DEFAULT_CACHE_BYTES
+	stats = False
+	stats_json = None
+	progress_interval = None
+	ecc = False
 
 	# Parse the command-line options   
 	for opt, arg in opts:
@@ -328,9 +710,46 @@ def main():
 			with_cddb = True
 		if opt in ("--delete-bin-toc"):
 			delete_bin_toc = True
+		if opt in ("--single-pass"):
+			single_pass = True
+		if opt in ("-j", "--jobs"):
+			try:
+				jobs = int(arg)
+			except ValueError:
+				jobs = 0
+			if jobs < 1:
+				usage()
+				sys.exit(2)
+		if opt == "--cache":
+			cache_dir = cache_dir or cdgcache.DEFAULT_CACHE_DIR
+		if opt == "--cache-dir":
+			cache_dir = arg
+		if opt == "--stats":
+			stats = True
+		if opt == "--stats-json":
+			stats_json = arg
+		if opt == "--ecc":
+			ecc = True
+		if opt == "--progress":
+			try:
+				progress_interval = float(arg)
+			except ValueError:
+				progress_interval = -1
+			if progress_interval < 0:
+				usage()
+				sys.exit(2)
+		if opt == "--cache-size":
+			try:
+				cache_bytes = int(arg) * 1024 * 1024
+			except ValueError:
+				usage()
+				sys.exit(2)
 
 	# Do the rip
-	cdgrip(tocfile, delete_bin_toc, with_cddb, verbose)
+	failed = cdgrip(tocfile, delete_bin_toc, with_cddb, verbose, single_pass, jobs,
+					cache_dir, cache_bytes, stats, stats_json, progress_interval, ecc)
+	if len(failed) > 0:
+		return (1)
 
 	return
 
@@ -0,0 +1,246 @@
+# cdgsnap - cdgtools: Screen snapshots of CDG files for seeking
+
+# Copyright (C) 2009  Kelvin Lawson (kelvinl@users.sf.net)
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+
+# OVERVIEW
+#
+# cdgsnap is part of the cdgtools suite of CD+G karaoke software.
+#
+# The CD+G screen at any point in a song is the result of every
+# instruction before it, so finding out what is shown at 2:45 would
+# otherwise mean playing the file from the start. This module plays
+# the file once (with cdgrender) and keeps snapshots of the screen
+# along the way: the pixels, colour table, border, transparent colour
+# and scroll offsets. A snapshot is taken every few seconds of
+# graphics (SNAPSHOT_INTERVAL by default), and always just after the
+# screen is cleared by a memory preset.
+#
+# Each snapshot is compressed with zlib (a cleared screen compresses to
+# almost nothing), and they are saved next to the .cdg file (theboxer.cdg
+# has the snapshots theboxer.cdgsnap). The saved snapshots are used as
+# long as the .cdg file's size and modification time are unchanged, and
+# otherwise rebuilt.
+#
+# A seek restores the last snapshot before the requested time, then
+# reads and plays only the packets between the snapshot and that time:
+#
+#   snapshots = cdgsnap.CdgSnapshots ("theboxer.cdg")
+#   renderer = snapshots.Seek (165)
+#   rgb = renderer.RGB (cdgrender.VISIBLE_SCREEN)
+#
+# See cdg2text.py for an example application which utilises this module.
+#
+# For further details see http://www.kibosh.org/cdgtools/
+
+import os, struct, bisect, zlib
+import cdgpacks, cdgrender, cdgindex
+
+
+# Default time between snapshots, in seconds
+SNAPSHOT_INTERVAL = 5
+
+# Version of the snapshot file format
+SNAPSHOT_VERSION = 1
+
+# Snapshot file header: magic, version, .cdg file size and mtime, the
+# snapshot interval (in packets) and the number of snapshots. Each
+# snapshot then has its packet position, border, transparent colour
+# (0xFF for none), scroll offsets and compressed size, followed by the
+# compressed pixels and colour table.
+_MAGIC = b"CDGSNP"
+_header = struct.Struct ("<6sHQQII")
+_snapHeader = struct.Struct ("<IBBBBI")
+_NO_TRANSPARENT = 0xFF
+
+
+# Get the snapshot filename for a .cdg file
+def SnapshotName (cdgfilename):
+	return (os.path.splitext (cdgfilename)[0] + ".cdgsnap")
+
+
+# Snapshot Class
+#
+# The state of the screen just before the packet at position is played
+class Snapshot:
+	def __init__(self, position, border, transparent, hOffset, vOffset, compressed):
+		self.position = position
+		self.time = float (position) / cdgpacks.PACKS_PER_SECOND
+		self.border = border
+		self.transparent = transparent
+		self.hOffset = hOffset
+		self.vOffset = vOffset
+		self.compressed = compressed
+
+	# Get the screen state, to be given to CdgRenderer.Restore()
+	def State (self):
+		data = zlib.decompress (self.compressed)
+		size = cdgrender.WIDTH * cdgrender.HEIGHT
+		return ((data[:size], data[size:], self.border, self.transparent,
+				 self.hOffset, self.vOffset))
+
+
+# Take a snapshot of a renderer's screen
+def TakeSnapshot (renderer, position):
+	pixels, palette, border, transparent, hOffset, vOffset = renderer.State()
+	return (Snapshot (position, border, transparent, hOffset, vOffset,
+					  zlib.compress (pixels + palette)))
+
+
+# CdgSnapshots Class
+#
+# The snapshots of a .cdg file, loaded from the saved snapshots if they
+# are still valid (and were taken at the same interval), and otherwise
+# built (and saved, unless save is False). If the snapshots can't be
+# saved (e.g. the directory is read-only) they are just kept in memory.
+class CdgSnapshots:
+	def __init__(self, cdgfilename, interval=SNAPSHOT_INTERVAL, save=True):
+		self.FileName = cdgfilename
+		self.snapFileName = SnapshotName (cdgfilename)
+		self.interval = max (cdgindex.TimeToPack (interval), 1)
+		cdgstat = os.stat (cdgfilename)
+		self.size = cdgstat.st_size
+		self.mtime = int (cdgstat.st_mtime)
+		self.count = self.size // cdgpacks.PACK_SIZE
+
+		self.snapshots = self._Load()
+		if self.snapshots == None:
+			self.snapshots = self._Build()
+			if save:
+				try:
+					self._Save()
+				except (IOError, OSError):
+					pass
+		self.positions = [snapshot.position for snapshot in self.snapshots]
+
+	def __len__ (self):
+		return (len(self.snapshots))
+
+	# Find the last snapshot at or before a packet position. Returns None
+	# if there isn't one (the screen is still as it starts out).
+	def Before (self, position):
+		i = bisect.bisect_right (self.positions, position)
+		if i == 0:
+			return (None)
+		return (self.snapshots[i - 1])
+
+	# Get the screen just before the packet at position is played. If a
+	# renderer is given it is updated, otherwise a new one is returned.
+	def SeekPack (self, position, renderer=None):
+		position = min (max (position, 0), self.count)
+		if renderer == None:
+			renderer = cdgrender.CdgRenderer()
+		snapshot = self.Before (position)
+		if snapshot == None:
+			renderer.Restore (cdgrender.CdgRenderer().State())
+			start = 0
+		else:
+			renderer.Restore (snapshot.State())
+			start = snapshot.position
+		if position > start:
+			renderer.Play (cdgpacks.CdgPacks (self._Read (start, position)))
+		return (renderer)
+
+	# Get the screen at time seconds, i.e. with every packet before that
+	# time played
+	def Seek (self, time, renderer=None):
+		return (self.SeekPack (cdgindex.TimeToPack (time), renderer))
+
+	# Play the whole file, taking the snapshots
+	def _Build (self):
+		packs = cdgpacks.LoadFile (self.FileName)
+		renderer = cdgrender.CdgRenderer()
+		snapshots = []
+		last = 0
+		cleared = False
+		for index in packs.Commands():
+			kind = packs.kind[index]
+			# Memory presets come in runs, so take the snapshot once the
+			# run is over
+			if cleared and (kind != cdgpacks.CDG_INST_MEMORY_PRESET):
+				snapshots.append (TakeSnapshot (renderer, index))
+				last = index
+				cleared = False
+			elif index - last >= self.interval:
+				snapshots.append (TakeSnapshot (renderer, index))
+				last = index
+			renderer.Process (kind, packs.Data (index))
+			if kind == cdgpacks.CDG_INST_MEMORY_PRESET:
+				cleared = True
+		if cleared:
+			snapshots.append (TakeSnapshot (renderer, packs.count))
+		return (snapshots)
+
+	# Load the saved snapshots. Returns None if there aren't any, or they
+	# are out of date or unreadable.
+	def _Load (self):
+		try:
+			snapfile = open (self.snapFileName, "rb")
+		except IOError:
+			return (None)
+		try:
+			try:
+				magic, version, size, mtime, interval, count = _header.unpack (snapfile.read (_header.size))
+				if (magic != _MAGIC) or (version != SNAPSHOT_VERSION) or (size != self.size) \
+						or (mtime != self.mtime) or (interval != self.interval):
+					return (None)
+				snapshots = []
+				for i in range (count):
+					position, border, transparent, hOffset, vOffset, length = \
+						_snapHeader.unpack (snapfile.read (_snapHeader.size))
+					compressed = snapfile.read (length)
+					if len(compressed) != length:
+						return (None)
+					if transparent == _NO_TRANSPARENT:
+						transparent = None
+					snapshots.append (Snapshot (position, border, transparent, hOffset, vOffset, compressed))
+				return (snapshots)
+			except (struct.error, ValueError, EOFError):
+				return (None)
+		finally:
+			snapfile.close()
+
+	# Save the snapshots, to a temporary file which is then renamed over
+	# the old one
+	def _Save (self):
+		tempname = "%s.%d.tmp" % (self.snapFileName, os.getpid())
+		snapfile = open (tempname, "wb")
+		try:
+			snapfile.write (_header.pack (_MAGIC, SNAPSHOT_VERSION, self.size, self.mtime,
+										  self.interval, len(self.snapshots)))
+			for snapshot in self.snapshots:
+				transparent = snapshot.transparent
+				if transparent == None:
+					transparent = _NO_TRANSPARENT
+				snapfile.write (_snapHeader.pack (snapshot.position, snapshot.border, transparent,
+												  snapshot.hOffset, snapshot.vOffset,
+												  len(snapshot.compressed)))
+				snapfile.write (snapshot.compressed)
+		finally:
+			snapfile.close()
+		if os.name == "nt" and os.path.exists (self.snapFileName):
+			os.unlink (self.snapFileName)
+		os.rename (tempname, self.snapFileName)
+
+	# Read the packets from position start up to (but not including) end
+	def _Read (self, start, end):
+		cdgfile = open (self.FileName, "rb")
+		try:
+			cdgfile.seek (start * cdgpacks.PACK_SIZE)
+			return (cdgfile.read ((end - start) * cdgpacks.PACK_SIZE))
+		finally:
+			cdgfile.close()
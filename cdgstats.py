@@ -0,0 +1,266 @@
+# cdgstats - cdgtools: Timing and throughput statistics
+
+# Copyright (C) 2009  Kelvin Lawson (kelvinl@users.sf.net)
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+
+# OVERVIEW
+#
+# cdgstats is part of the cdgtools suite of CD+G karaoke software.
+#
+# This module records how long each stage of a rip (or of building a
+# disc image) takes, and how much data it processes, so that a slow rip
+# can be tracked down to the stage responsible. For each stage of each
+# track it adds up:
+#
+#   . wall     - elapsed time spent in the stage
+#   . cpu      - CPU time used by the thread running the stage (or by
+#                the encoder process, for the encode stage)
+#   . bytesIn  - bytes of data passed into the stage
+#   . bytesOut - bytes of data produced by the stage
+#   . sectors  - CD sectors processed
+#
+# cdgparse, cdgpipe, cdgrip and cdg2bin record their stages as they go.
+# Recording a stage costs a couple of system calls, and is done once per
+# chunk of data (typically a thousand sectors) rather than per sector,
+# so the statistics are always on. The stages are:
+#
+#   . read         - reading the bin file
+#   . demux        - splitting sectors into audio and subchannel data
+#   . deinterleave - deinterleaving raw CD+G data
+#   . ecc          - checking and correcting CD+G packs (see cdgecc.py)
+#   . encode       - piping audio into the encoder, and waiting for it
+#   . write        - writing out .cdg (and other) files
+#   . cache        - reading from and writing to the track cache
+#   . decode       - decoding mp3/ogg tracks (cdg2bin)
+#   . produce_bin  - interleaving audio and CD+G data into a bin (cdg2bin)
+#
+# plus the whole-track functions such as bin2cdg() and bin2pcm() (whose
+# times include the read and demux stages they do along the way).
+#
+# To record a stage:
+#
+#   start = cdgstats.Start()
+#   ... do the work ...
+#   cdgstats.Stop (start, "read", bytesIn = len(block), sectors = 4)
+#
+# The stage is recorded against the current thread's track, as set by
+# SetTrack(). At the end of the run, Summary() prints a summary of the
+# statistics, and WriteReport() saves them as a JSON report.
+#
+# See cdgrip.py for an example application which utilises this module.
+#
+# For further details see http://www.kibosh.org/cdgtools/
+
+import os, sys, time, threading, json, platform
+import cdgtools
+
+
+# Get the CPU time used by the current thread. Linux can report this
+# for each thread (RUSAGE_THREAD, which older Pythons don't name). On
+# other platforms the CPU time of the whole process is used, which
+# overstates the CPU time of stages running at the same time.
+try:
+	import resource
+	if sys.platform.startswith ("linux"):
+		_RUSAGE_THREAD = getattr (resource, "RUSAGE_THREAD", 1)
+	else:
+		_RUSAGE_THREAD = resource.RUSAGE_SELF
+	def ThreadCpu ():
+		usage = resource.getrusage (_RUSAGE_THREAD)
+		return (usage.ru_utime + usage.ru_stime)
+except ImportError:
+	def ThreadCpu ():
+		times = os.times()
+		return (times[0] + times[1])
+
+
+# Default for Recorder.Stages(), meaning all tracks
+_ALL = object()
+
+
+# Recorder Class
+#
+# Collects the statistics for a run. Totals are kept for each
+# (stage, track) pair. May be shared between threads.
+class Recorder:
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.Reset()
+
+	# Clear out the statistics and start timing a new run
+	def Reset (self):
+		self.lock.acquire()
+		try:
+			self.records = {}
+			self.trackOrder = []
+			self.startTime = time.time()
+			self.startTimes = os.times()
+		finally:
+			self.lock.release()
+
+	# Add to the totals for a stage of a track
+	def Add (self, stage, track, wall=0.0, cpu=0.0, bytesIn=0, bytesOut=0, sectors=0, calls=1):
+		self.lock.acquire()
+		try:
+			record = self.records.get ((stage, track))
+			if record == None:
+				record = [0, 0.0, 0.0, 0, 0, 0]
+				self.records[(stage, track)] = record
+				if (track != None) and (track not in self.trackOrder):
+					self.trackOrder.append (track)
+			record[0] = record[0] + calls
+			record[1] = record[1] + wall
+			record[2] = record[2] + cpu
+			record[3] = record[3] + bytesIn
+			record[4] = record[4] + bytesOut
+			record[5] = record[5] + sectors
+		finally:
+			self.lock.release()
+
+	# Get the totals for each stage, over all the tracks (or for one
+	# track). Returns a list of dictionaries, in rip order.
+	def Stages (self, track=_ALL):
+		self.lock.acquire()
+		try:
+			totals = {}
+			order = []
+			for (stage, stagetrack), record in self.records.items():
+				if (track is not _ALL) and (stagetrack != track):
+					continue
+				if stage not in totals:
+					totals[stage] = [0, 0.0, 0.0, 0, 0, 0]
+					order.append (stage)
+				totals[stage] = [a + b for a, b in zip (totals[stage], record)]
+		finally:
+			self.lock.release()
+
+		stages = []
+		for stage in _SortStages (order):
+			calls, wall, cpu, bytesIn, bytesOut, sectors = totals[stage]
+			stats = {"stage": stage, "calls": calls, "wall": wall, "cpu": cpu,
+					 "bytesIn": bytesIn, "bytesOut": bytesOut, "sectors": sectors,
+					 "MBps": 0.0, "sectorsps": 0.0}
+			if wall > 0:
+				stats["MBps"] = max (bytesIn, bytesOut) / wall / (1024 * 1024)
+				stats["sectorsps"] = sectors / wall
+			stages.append (stats)
+		return (stages)
+
+	# Get the tracks, in the order they were first recorded
+	def Tracks (self):
+		self.lock.acquire()
+		try:
+			return (list (self.trackOrder))
+		finally:
+			self.lock.release()
+
+	# Build the full report for the run, as a dictionary ready to be
+	# saved as JSON. tool is the name of the program, and any details
+	# about the run (e.g. the TOC filename) can be passed as extra.
+	def Report (self, tool, extra=None):
+		times = os.times()
+		report = {"tool": tool, "version": cdgtools.VERSION_STRING,
+				  "date": time.strftime ("%Y-%m-%d %H:%M:%S", time.localtime (self.startTime)),
+				  "host": platform.node(), "python": platform.python_version(),
+				  "wall": time.time() - self.startTime,
+				  "cpu": {"user": times[0] - self.startTimes[0],
+						  "system": times[1] - self.startTimes[1],
+						  "childrenUser": times[2] - self.startTimes[2],
+						  "childrenSystem": times[3] - self.startTimes[3]},
+				  "stages": self.Stages(),
+				  "tracks": [{"track": track, "stages": self.Stages (track)} for track in self.Tracks()]}
+		if extra != None:
+			report.update (extra)
+		return (report)
+
+
+# Order stages as they happen in a rip, with any others afterwards
+_stageOrder = ["read", "demux", "cache", "deinterleave", "ecc", "encode", "write", "decode", "produce_bin"]
+def _SortStages (stages):
+	def key (stage):
+		if stage in _stageOrder:
+			return (_stageOrder.index (stage), stage)
+		return (len(_stageOrder), stage)
+	return (sorted (stages, key = key))
+
+
+# The recorder used by the cdgtools modules
+recorder = Recorder()
+
+# The current track of each thread
+_local = threading.local()
+
+
+# Set the track that the current thread is working on. Stages recorded
+# by the thread are recorded against this track (or against no track
+# if None).
+def SetTrack (track):
+	_local.track = track
+
+def CurrentTrack ():
+	return (getattr (_local, "track", None))
+
+
+# Start timing a stage. Returns the start times to pass to Stop().
+def Start ():
+	return (time.time(), ThreadCpu())
+
+# Finish timing a stage, and record it against the current track
+def Stop (start, stage, bytesIn=0, bytesOut=0, sectors=0):
+	recorder.Add (stage, getattr (_local, "track", None), time.time() - start[0],
+				  ThreadCpu() - start[1], bytesIn, bytesOut, sectors)
+
+# Record a stage which was timed some other way
+def Add (stage, wall=0.0, cpu=0.0, bytesIn=0, bytesOut=0, sectors=0, calls=1):
+	recorder.Add (stage, getattr (_local, "track", None), wall, cpu, bytesIn, bytesOut, sectors, calls)
+
+
+# Clear out the statistics, ready for a new run
+def Reset ():
+	recorder.Reset()
+
+
+# Print a summary of the statistics for the run
+def Summary (output=None):
+	if output == None:
+		output = _Print
+	report = recorder.Report ("")
+	output ("-> Statistics (wall %.2fs, CPU %.2fs, encoder/decoder CPU %.2fs):"
+			% (report["wall"], report["cpu"]["user"] + report["cpu"]["system"],
+			   report["cpu"]["childrenUser"] + report["cpu"]["childrenSystem"]))
+	output ("->   %-13s %8s %8s %10s %10s %9s %8s" % ("stage", "wall", "cpu", "in MB", "out MB",
+													  "sectors", "MB/s"))
+	for stats in report["stages"]:
+		output ("->   %-13s %7.2fs %7.2fs %10.1f %10.1f %9d %8.1f"
+				% (stats["stage"], stats["wall"], stats["cpu"], stats["bytesIn"] / (1024.0 * 1024),
+				   stats["bytesOut"] / (1024.0 * 1024), stats["sectors"], stats["MBps"]))
+	for track in report["tracks"]:
+		output ("->   %s: %s" % (track["track"], ", ".join (["%s %.2fs" % (stats["stage"], stats["wall"])
+															  for stats in track["stages"]])))
+
+def _Print (message):
+	print (message)
+
+
+# Save the JSON report for the run to filename
+def WriteReport (filename, tool, extra=None):
+	reportfile = open (filename, "w")
+	try:
+		json.dump (recorder.Report (tool, extra), reportfile, indent = 1, sort_keys = True,
+				   encoding = "latin-1")
+	finally:
+		reportfile.close()
@@ -0,0 +1,2 @@
+# cdgtools test suite. Run from the top of the source tree with:
+#       python -m unittest discover -s tests -t .
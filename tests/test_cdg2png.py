@@ -0,0 +1,63 @@
+# cdgtools: Tests of the video frame export in cdg2png
+
+import os, random, shutil, struct, tempfile, unittest, zlib
+import cdgpacks, cdgrender, cdgsnap, cdgindex, cdgbench, cdg2png
+
+
+SECONDS = 4
+FPS = 10
+
+
+class Cdg2pngTest (unittest.TestCase):
+	def setUp (self):
+		self.tempdir = tempfile.mkdtemp()
+		self.cdgfilename = os.path.join (self.tempdir, "song.cdg")
+		cdgfile = open (self.cdgfilename, "wb")
+		cdgfile.write (cdgbench.MakeCdgStream (SECONDS * 75, random.Random (1)))
+		cdgfile.close()
+
+	def tearDown (self):
+		shutil.rmtree (self.tempdir)
+
+	# The RGB screen of each frame, seeking to it from the snapshots
+	def _ExpectedFrames (self):
+		snapshots = cdgsnap.CdgSnapshots (self.cdgfilename, 1, save = False)
+		return ([snapshots.SeekPack (cdgindex.TimeToPack (float (frame) / FPS)).RGB (cdgrender.FULL_SCREEN)
+				 for frame in range (SECONDS * FPS)])
+
+	def testRgb (self):
+		expected = b"".join (self._ExpectedFrames())
+		for jobs in (1, 2):
+			self.assertEqual (cdg2png.cdg2png (self.cdgfilename, fps = FPS, format = cdg2png.FORMAT_RGB,
+											   jobs = jobs, interval = 1)[0], SECONDS * FPS)
+			self.assertEqual (open (os.path.join (self.tempdir, "song.rgb"), "rb").read(), expected, jobs)
+
+	def testPng (self):
+		expected = self._ExpectedFrames()
+		outdir = os.path.join (self.tempdir, "frames")
+		frames, encoded = cdg2png.cdg2png (self.cdgfilename, outdir, FPS, jobs = 1, interval = 1)
+		self.assertEqual (frames, SECONDS * FPS)
+		self.assertTrue (encoded <= frames)
+		for frame in (0, 7, frames - 1):
+			png = open (os.path.join (outdir, "song-%06d.png" % frame), "rb").read()
+			self.assertEqual (png[:8], b"\x89PNG\r\n\x1a\n")
+			width, height = struct.unpack (">II", png[16:24])
+			self.assertEqual ((width, height), (cdgrender.WIDTH, cdgrender.HEIGHT))
+			# The image data follows the IHDR chunk
+			length = struct.unpack (">I", png[33:37])[0]
+			rows = zlib.decompress (png[41:41 + length])
+			stride = (width * 3) + 1
+			self.assertEqual (b"".join ([rows[y * stride + 1:(y + 1) * stride] for y in range (height)]),
+							  expected[frame], frame)
+
+	# Files too short for a single frame give no frames
+	def testEmpty (self):
+		for data in (b"", b"\x09" * 20):
+			cdgfile = open (self.cdgfilename, "wb")
+			cdgfile.write (data)
+			cdgfile.close()
+			self.assertEqual (cdg2png.cdg2png (self.cdgfilename, fps = FPS, jobs = 2), (0, 0))
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,55 @@
+# cdgtools: Tests of the statistics and lint mode of cdg2text
+
+import os, random, shutil, tempfile, unittest
+import cdgpacks, cdgrender, cdg2text
+
+
+class FileStatsTest (unittest.TestCase):
+	def setUp (self):
+		self.tempdir = tempfile.mkdtemp()
+		self.cdgfilename = os.path.join (self.tempdir, "song.cdg")
+
+	def tearDown (self):
+		shutil.rmtree (self.tempdir)
+
+	# Tile blocks are only counted as malformed if the renderer doesn't
+	# draw them, and the heatmap counts the tiles where they are drawn
+	def testTilesAgreeWithRenderer (self):
+		rand = random.Random (1)
+		packets = []
+		for i in range (2000):
+			instruction = rand.choice ((cdgpacks.CDG_INST_TILE_BLOCK, cdgpacks.CDG_INST_TILE_BLOCK_XOR))
+			data = [rand.randrange (64) for j in range (16)]
+			packets.append (bytes (bytearray ([cdgpacks.CDG_COMMAND, instruction, 0, 0] + data + [0] * 4)))
+		cdgfile = open (self.cdgfilename, "wb")
+		cdgfile.write (b"".join (packets))
+		cdgfile.close()
+
+		malformed = 0
+		heatmap = [[0] * cdgrender.TILE_COLUMNS for row in range (cdgrender.TILE_ROWS)]
+		for packet in packets:
+			renderer = cdgrender.CdgRenderer()
+			renderer.TakeDirty()
+			renderer.Process (bytearray (packet)[1], bytearray (packet)[4:20])
+			dirty = renderer.TakeDirty()
+			if dirty == None:
+				malformed = malformed + 1
+			else:
+				heatmap[dirty[1] // cdgrender.TILE_HEIGHT][dirty[0] // cdgrender.TILE_WIDTH] += 1
+
+		stats = cdg2text.FileStats (self.cdgfilename)
+		self.assertTrue (malformed > 0)
+		self.assertEqual (stats["malformed"], malformed)
+		self.assertEqual (stats["heatmap"], heatmap)
+
+	def testTruncated (self):
+		cdgfile = open (self.cdgfilename, "wb")
+		cdgfile.write (b"\x00" * (cdgpacks.PACK_SIZE * 3 + 5))
+		cdgfile.close()
+		stats = cdg2text.FileStats (self.cdgfilename)
+		self.assertEqual ((stats["packs"], stats["trailing_bytes"], stats["truncated_files"]), (3, 5, 1))
+		self.assertEqual (stats["kinds"]["Empty"], 3)
+
+
+if __name__ == "__main__":
+	unittest.main()
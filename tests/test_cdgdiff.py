@@ -0,0 +1,95 @@
+# cdgtools: Tests of comparing CD+G tracks with cdgdiff
+
+import os, sys, random, shutil, tempfile, unittest, StringIO
+import cdgpacks, cdgbench, cdgdiff
+
+
+SECONDS = 20
+
+
+# Compare two tracks, with the output thrown away
+def _Diff (a, b, offset=0):
+	stdout = sys.stdout
+	sys.stdout = StringIO.StringIO()
+	try:
+		return (cdgdiff.cdgdiff (a, b, offset))
+	finally:
+		sys.stdout = stdout
+
+
+class CdgdiffTest (unittest.TestCase):
+	def setUp (self):
+		self.rand = random.Random (1)
+		self.cdgdata = cdgbench.MakeCdgStream (SECONDS * 75, self.rand)
+		self.reference = cdgpacks.CdgPacks (self.cdgdata)
+
+	# Put some packets of padding in front of the reference
+	def _Shifted (self, packets):
+		if packets >= 0:
+			return (cdgpacks.CdgPacks (cdgbench.MakeCdgStream ((packets + 3) // 4, self.rand)[:packets * 24] +
+									   self.cdgdata))
+		return (cdgpacks.CdgPacks (self.cdgdata[-packets * 24:]))
+
+	def testSame (self):
+		self.assertEqual (cdgdiff.FindOffset (self.reference, self.reference, 300), 0)
+		self.assertEqual (_Diff (self.reference, cdgpacks.CdgPacks (self.cdgdata)), 0)
+
+	def testFindOffset (self):
+		for offset in (37, -13):
+			shifted = self._Shifted (offset)
+			self.assertEqual (cdgdiff.FindOffset (self.reference, shifted, 300), offset)
+			if offset > 0:
+				# The padding is only in the shifted track, and not blank
+				self.assertEqual (_Diff (self.reference, shifted, offset),
+								  cdgdiff.CountNotBlank (shifted, 0, offset))
+
+	def testDifferingPacks (self):
+		data = bytearray (self.cdgdata)
+		damaged = sorted (self.rand.sample (range (len(self.reference)), 28))
+		for index in damaged:
+			data[index * 24 + self.rand.randrange (24)] ^= self.rand.randrange (1, 64)
+		packs = cdgpacks.CdgPacks (bytes (data))
+		self.assertEqual (list (cdgdiff.DifferingPacks (self.reference, packs)), damaged)
+		self.assertEqual (cdgdiff.CountDiffering (self.reference, packs), len(damaged))
+		self.assertEqual (_Diff (self.reference, packs), len(damaged))
+
+	# A track cut short differs, but not if only blank packets are missing
+	def testTruncated (self):
+		half = cdgpacks.CdgPacks (self.cdgdata[:len(self.cdgdata) // 2])
+		missing = cdgdiff.CountNotBlank (self.reference, half.count, self.reference.count)
+		self.assertTrue (missing > 0)
+		self.assertEqual (_Diff (self.reference, half), missing)
+		self.assertEqual (_Diff (half, self.reference), missing)
+		padded = cdgpacks.CdgPacks (self.cdgdata + b"\x00" * 24 * 100)
+		self.assertEqual (_Diff (self.reference, padded), 0)
+
+	def testRanges (self):
+		self.assertEqual (cdgdiff.Ranges ([1, 2, 3, 7, 9, 10]), [(1, 3), (7, 7), (9, 10)])
+		self.assertEqual (cdgdiff.Ranges ([]), [])
+
+
+# A .cdg file compared against the track of a rip, run from another
+# directory
+class LoadTrackTest (unittest.TestCase):
+	def setUp (self):
+		self.tempdir = tempfile.mkdtemp()
+		self.cwd = os.getcwd()
+
+	def tearDown (self):
+		os.chdir (self.cwd)
+		shutil.rmtree (self.tempdir)
+
+	def testRip (self):
+		for raw in (False, True):
+			tocname = cdgbench.MakeDisc (self.tempdir, tracks = 2, seconds = 2, raw = raw)
+			os.chdir (os.path.dirname (self.tempdir))
+			for track in (1, 2):
+				cdgname = os.path.splitext (tocname)[0] + "-%02d.cdg" % track
+				rip = cdgdiff.LoadTrack (tocname, track)
+				self.assertEqual (rip.masked, cdgdiff.LoadTrack (cdgname).masked)
+			self.assertEqual (cdgdiff.LoadTrack (tocname, 3), None)
+			os.chdir (self.cwd)
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,85 @@
+# cdgtools: Tests of the CD+G error correction in cdgecc
+
+import random, unittest
+import cdgecc
+
+
+# Make a random pack with valid parity
+def _RandomPack (rand):
+	return (cdgecc.EncodePack ([rand.randrange (64) for i in range (cdgecc.PACK_SIZE)]))
+
+# Damage some symbols of a pack (each changed to another six-bit value)
+def _Damage (pack, positions, rand):
+	damaged = bytearray (pack)
+	for position in positions:
+		damaged[position] = damaged[position] ^ rand.randrange (1, 64)
+	return (damaged)
+
+
+class PackCorrectionTest (unittest.TestCase):
+	def setUp (self):
+		self.rand = random.Random (1)
+
+	def testEncodedPacksAreClean (self):
+		for i in range (100):
+			pack = _RandomPack (self.rand)
+			self.assertTrue (cdgecc.CheckPack (pack))
+			self.assertEqual (cdgecc.CorrectPack (bytearray (pack)), cdgecc.PACK_CLEAN)
+
+	def testOneBadSymbol (self):
+		for position in range (cdgecc.PACK_SIZE):
+			pack = _RandomPack (self.rand)
+			damaged = _Damage (pack, [position], self.rand)
+			self.assertFalse (cdgecc.CheckPack (damaged))
+			self.assertEqual (cdgecc.CorrectPack (damaged), cdgecc.PACK_CORRECTED, position)
+			self.assertEqual (damaged, pack, position)
+
+	def testTwoBadSymbols (self):
+		for i in range (200):
+			pack = _RandomPack (self.rand)
+			positions = self.rand.sample (range (cdgecc.PACK_SIZE), 2)
+			damaged = _Damage (pack, positions, self.rand)
+			self.assertEqual (cdgecc.CorrectPack (damaged), cdgecc.PACK_CORRECTED, positions)
+			self.assertEqual (damaged, pack, positions)
+
+	# A pack which can't be corrected is left as it is
+	def testUncorrectable (self):
+		uncorrectable = 0
+		for i in range (200):
+			pack = _RandomPack (self.rand)
+			damaged = _Damage (pack, self.rand.sample (range (cdgecc.PACK_SIZE), 4), self.rand)
+			before = bytearray (damaged)
+			result = cdgecc.CorrectPack (damaged)
+			if result == cdgecc.PACK_UNCORRECTABLE:
+				uncorrectable = uncorrectable + 1
+				self.assertEqual (damaged, before)
+			else:
+				self.assertTrue (cdgecc.CheckPack (damaged))
+		self.assertTrue (uncorrectable > 0)
+
+	# A batch of packs, some damaged, checked in bulk and corrected
+	def testCorrectPacks (self):
+		packs = [_RandomPack (self.rand) for i in range (1000)]
+		damaged = list (packs)
+		for index in (0, 17, 500, 999):
+			damaged[index] = _Damage (packs[index], self.rand.sample (range (cdgecc.PACK_SIZE), 2), self.rand)
+		cdgdata, corrected, uncorrectable = cdgecc.CorrectPacks (b"".join ([bytes (pack) for pack in damaged]))
+		self.assertEqual ((corrected, uncorrectable), (4, 0))
+		self.assertEqual (cdgdata, b"".join ([bytes (pack) for pack in packs]))
+
+	# Chunks fed to a PackCorrector, with a partial pack at the end
+	def testPackCorrector (self):
+		packs = [_RandomPack (self.rand) for i in range (100)]
+		damaged = list (packs)
+		damaged[50] = _Damage (packs[50], [3], self.rand)
+		corrector = cdgecc.PackCorrector()
+		output = []
+		for start in range (0, 100, 8):
+			output.append (corrector.Feed (b"".join ([bytes (pack) for pack in damaged[start:start + 8]])))
+		output.append (corrector.Feed (b"\x01\x02\x03"))
+		self.assertEqual (b"".join (output), b"".join ([bytes (pack) for pack in packs]) + b"\x01\x02\x03")
+		self.assertEqual ((corrector.packs, corrector.corrected, corrector.uncorrectable), (100, 1, 0))
+
+
+if __name__ == "__main__":
+	unittest.main()
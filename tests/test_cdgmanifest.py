@@ -0,0 +1,53 @@
+# cdgtools: Tests of the rip manifest in cdgmanifest
+
+import os, shutil, tempfile, unittest
+import cdgmanifest
+
+
+class RipManifestTest (unittest.TestCase):
+	def setUp (self):
+		self.tempdir = tempfile.mkdtemp()
+		self.tocfilename = os.path.join (self.tempdir, "disc.toc")
+		self.binfilename = os.path.join (self.tempdir, "disc.bin")
+		self.outputs = [os.path.join (self.tempdir, "track01.mp3"), os.path.join (self.tempdir, "track01.cdg")]
+		for filename, data in ((self.binfilename, b"bin"), (self.outputs[0], b"mp3"), (self.outputs[1], b"cdg")):
+			outfile = open (filename, "wb")
+			outfile.write (data)
+			outfile.close()
+		self.options = {"ecc": False, "encoder": ["lame", "-r", "%s.mp3"]}
+
+	def tearDown (self):
+		shutil.rmtree (self.tempdir)
+
+	# Record the track as done, and load the manifest back
+	def _Reload (self):
+		manifest = cdgmanifest.RipManifest (self.tocfilename, self.binfilename)
+		manifest.TrackDone ("track01", 0, 2448, self.outputs, self.options)
+		return (cdgmanifest.RipManifest (self.tocfilename, self.binfilename))
+
+	def testDone (self):
+		manifest = self._Reload()
+		self.assertTrue (manifest.IsDone ("track01", 0, 2448, self.outputs, self.options))
+		self.assertFalse (manifest.IsDone ("track02", 0, 2448, self.outputs, self.options))
+		self.assertFalse (manifest.IsDone ("track01", 2448, 2448, self.outputs, self.options))
+
+	# A track ripped with other options isn't done
+	def testOptions (self):
+		manifest = self._Reload()
+		self.assertFalse (manifest.IsDone ("track01", 0, 2448, self.outputs,
+										   {"ecc": True, "encoder": ["lame", "-r", "%s.mp3"]}))
+		self.assertFalse (manifest.IsDone ("track01", 0, 2448, self.outputs,
+										   {"ecc": False, "encoder": ["lame", "-h", "%s.mp3"]}))
+		self.assertFalse (manifest.IsDone ("track01", 0, 2448, self.outputs))
+
+	# A track whose output was changed isn't done
+	def testChangedOutput (self):
+		manifest = self._Reload()
+		outfile = open (self.outputs[1], "wb")
+		outfile.write (b"CDG")
+		outfile.close()
+		self.assertFalse (manifest.IsDone ("track01", 0, 2448, self.outputs, self.options))
+
+
+if __name__ == "__main__":
+	unittest.main()
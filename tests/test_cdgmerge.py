@@ -0,0 +1,122 @@
+# cdgtools: Tests of merging several rips with cdgmerge
+
+import os, sys, random, shutil, tempfile, unittest, StringIO
+import cdgparse, cdgbench, cdgmerge
+
+
+class VoteTest (unittest.TestCase):
+	def testMajority (self):
+		result, differing, undecided = cdgmerge.Vote ([b"abcd", b"abXd", b"Ybcd"])
+		self.assertEqual ((result, differing, undecided), (b"abcd", 2, []))
+
+	# Without a majority the first block's byte is kept
+	def testNoMajority (self):
+		result, differing, undecided = cdgmerge.Vote ([b"abcd", b"aXcY"])
+		self.assertEqual ((result, differing, undecided), (b"abcd", 2, [1, 3]))
+		result, differing, undecided = cdgmerge.Vote ([b"ab", b"Xb", b"Yb"])
+		self.assertEqual ((result, differing, undecided), (b"ab", 1, [0]))
+
+	# Blocks bigger than a vote chunk are voted on a chunk at a time
+	def testChunks (self):
+		rand = random.Random (1)
+		size = cdgmerge.VOTE_CHUNK * 3 + 5
+		good = bytearray ([rand.randrange (256) for i in range (size)])
+		blocks = []
+		for rip in range (3):
+			block = bytearray (good)
+			for position in range (rip, size, 97):
+				block[position] = block[position] ^ 0x55
+			blocks.append (bytes (block))
+		result, differing, undecided = cdgmerge.Vote (blocks)
+		self.assertEqual ((result, undecided), (bytes (good), []))
+		self.assertEqual (differing, len(set ([position for rip in range (3) for position in range (rip, size, 97)])))
+
+
+class MergeTest (unittest.TestCase):
+	def setUp (self):
+		self.tempdir = tempfile.mkdtemp()
+		self.rand = random.Random (1)
+		self.stdout = sys.stdout
+		sys.stdout = StringIO.StringIO()
+
+	def tearDown (self):
+		sys.stdout = self.stdout
+		shutil.rmtree (self.tempdir)
+
+	# Make a disc, and copies of it in other directories with some
+	# subchannel bytes (and optionally audio bytes) damaged, none of
+	# them in the same place in two copies. Returns the good bin file
+	# and the TOC file of each copy.
+	def _MakeRips (self, copies, raw, audio=False):
+		gooddir = os.path.join (self.tempdir, "good")
+		os.mkdir (gooddir)
+		tocname = cdgbench.MakeDisc (gooddir, tracks = 2, seconds = 2, raw = raw)
+		binname = os.path.splitext (tocname)[0] + ".bin"
+		good = open (binname, "rb").read()
+		sectors = len(good) // cdgparse.SECTOR_SIZE
+		used = set()
+		tocnames = []
+		for copy in range (copies):
+			data = bytearray (good)
+			for i in range (40):
+				while True:
+					sector = self.rand.randrange (sectors)
+					if audio and (i % 2):
+						position = (sector * cdgparse.SECTOR_SIZE) + self.rand.randrange (cdgparse.AUDIO_SIZE)
+					else:
+						position = (sector * cdgparse.SECTOR_SIZE) + cdgparse.AUDIO_SIZE + \
+									self.rand.randrange (cdgparse.SUBCHAN_SIZE)
+					if position not in used:
+						break
+				used.add (position)
+				# Only the R-W bits are damaged, as only they are checked
+				data[position] = data[position] ^ self.rand.randrange (1, 64)
+			copydir = os.path.join (self.tempdir, "copy%d" % copy)
+			os.mkdir (copydir)
+			shutil.copy (tocname, copydir)
+			open (os.path.join (copydir, os.path.basename (binname)), "wb").write (bytes (data))
+			tocnames.append (os.path.join (copydir, os.path.basename (tocname)))
+		return (good, tocnames)
+
+	def _Merge (self, tocnames, audio=False):
+		outtoc = os.path.join (self.tempdir, "merged.toc")
+		mergers = cdgmerge.cdgmerge (tocnames, outtoc, audio)
+		self.assertNotEqual (mergers, None)
+		self.assertTrue ("\"merged.bin\"" in open (outtoc).read())
+		return (open (os.path.join (self.tempdir, "merged.bin"), "rb").read(), mergers)
+
+	# Three rips are merged by majority vote
+	def testThreeRips (self):
+		for raw in (False, True):
+			good, tocnames = self._MakeRips (3, raw, audio = True)
+			merged, mergers = self._Merge (tocnames, audio = True)
+			self.assertEqual (merged, good, raw)
+			self.assertEqual (sum ([merger.subchanUnresolved + merger.audioUnresolved for merger in mergers]), 0)
+			shutil.rmtree (os.path.join (self.tempdir, "good"))
+			for tocname in tocnames:
+				shutil.rmtree (os.path.dirname (tocname))
+
+	# Two rips never have a majority where they differ, so the parity
+	# of each pack decides. In the raw layout the start of each track
+	# also has bytes belonging to the previous track's packs, which
+	# can't be checked, and are kept from the first rip.
+	def testTwoRips (self):
+		for raw in (False, True):
+			good, tocnames = self._MakeRips (2, raw)
+			merged, mergers = self._Merge (tocnames)
+			self.assertEqual (merged, good, raw)
+			self.assertEqual (sum ([merger.subchanDiffer for merger in mergers]), 80)
+			if not raw:
+				self.assertEqual (sum ([merger.subchanParity for merger in mergers]), 80)
+			shutil.rmtree (os.path.join (self.tempdir, "good"))
+			for tocname in tocnames:
+				shutil.rmtree (os.path.dirname (tocname))
+
+	def testSameBinTwice (self):
+		good, tocnames = self._MakeRips (1, False)
+		self.assertEqual (cdgmerge.cdgmerge ([tocnames[0], tocnames[0]], os.path.join (self.tempdir, "merged.toc")),
+						  None)
+
+
+if __name__ == "__main__":
+	unittest.main()
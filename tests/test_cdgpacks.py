@@ -0,0 +1,54 @@
+# cdgtools: Tests of the bulk .cdg decoding in cdgpacks
+
+import random, unittest
+import cdgpacks
+
+
+class ByteOperationsTest (unittest.TestCase):
+	def testBitwise (self):
+		rand = random.Random (1)
+		for size in (0, 1, 2, 100):
+			a = bytes (bytearray ([rand.randrange (256) for i in range (size)]))
+			b = bytes (bytearray ([rand.randrange (256) for i in range (size)]))
+			pairs = zip (bytearray (a), bytearray (b))
+			self.assertEqual (cdgpacks.AndBytes (a, b), bytes (bytearray ([x & y for x, y in pairs])))
+			self.assertEqual (cdgpacks.OrBytes (a, b), bytes (bytearray ([x | y for x, y in pairs])))
+			self.assertEqual (cdgpacks.XorBytes (a, b), bytes (bytearray ([x ^ y for x, y in pairs])))
+
+	# Leading zero bytes are kept
+	def testIntRoundTrip (self):
+		for data in (b"", b"\x00", b"\x00\x00\x01", b"\xff\x00"):
+			self.assertEqual (cdgpacks.IntToBytes (cdgpacks.BytesToInt (data), len(data)), data)
+
+
+class CdgPacksTest (unittest.TestCase):
+	def testDecode (self):
+		rand = random.Random (1)
+		packets = []
+		for i in range (500):
+			packet = bytearray ([rand.randrange (256) for j in range (cdgpacks.PACK_SIZE)])
+			if rand.random() < 0.8:
+				packet[0] = cdgpacks.CDG_COMMAND | (rand.randrange (4) << 6)
+				packet[1] = rand.choice (cdgpacks.CDG_INSTRUCTIONS + (3, 63))
+			packets.append (bytes (packet))
+		packs = cdgpacks.CdgPacks (b"".join (packets) + b"\x09\x01")
+		self.assertEqual ((packs.count, packs.trailing), (500, 2))
+
+		commands = []
+		for index in range (len(packets)):
+			packet = bytearray (packets[index])
+			if (packet[0] & cdgpacks.CDG_MASK) != cdgpacks.CDG_COMMAND:
+				kind = cdgpacks.CDG_KIND_NONE
+			elif (packet[1] & cdgpacks.CDG_MASK) in cdgpacks.CDG_INSTRUCTIONS:
+				kind = packet[1] & cdgpacks.CDG_MASK
+			else:
+				kind = cdgpacks.CDG_INST_UNKNOWN
+			self.assertEqual (packs.kind[index], kind, index)
+			self.assertEqual (packs.Data (index), bytearray ([byte & cdgpacks.CDG_MASK for byte in packet[4:20]]))
+			if kind != cdgpacks.CDG_KIND_NONE:
+				commands.append (index)
+		self.assertEqual (packs.Commands(), commands)
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,167 @@
+# cdgtools: Tests of the bin file readers in cdgparse
+
+import os, sys, struct, random, shutil, tempfile, unittest
+import cdgparse
+
+
+# The original readers, one sector at a time, to check the block
+# readers against
+
+def _BaselineBin2cdg (binfilename, start_offset, binsize):
+	binfile = open (binfilename, "rb")
+	binfile.seek (start_offset, 0)
+	_cdgdata = []
+	donesize = 0
+	while donesize < binsize:
+		binfile.seek (2352, 1)
+		donesize = donesize + 2352
+		chunk = binfile.read (96)
+		if len(chunk) > 0:
+			for byte in bytearray (chunk):
+				_cdgdata.append (struct.pack ("B", byte & 0x3F))
+			donesize = donesize + len(chunk)
+		else:
+			break
+	binfile.close()
+	return (b"".join (_cdgdata))
+
+def _BaselineBin2pcm (binfilename, start_offset, binsize):
+	binfile = open (binfilename, "rb")
+	binfile.seek (start_offset, 0)
+	_audiodata = []
+	donesize = 0
+	while donesize < binsize:
+		chunk = binfile.read (2352)
+		binfile.seek (96, 1)
+		if len(chunk) > 0:
+			_audiodata.append (chunk)
+			donesize = donesize + len(chunk) + 96
+		else:
+			break
+	binfile.close()
+	return (b"".join (_audiodata))
+
+def _BaselineDeinterleave (cdgdata):
+	sectors = (len(cdgdata) // 96) - 2
+	deinterleavedData = []
+	for sector in range (sectors):
+		for pack in range (4):
+			for column in range (24):
+				deinterleavedData.append (cdgdata[(sector * 96) + (pack * 24) + cdgparse.offsets[column]])
+	return (b"".join (deinterleavedData))
+
+
+# Sizes of bin file tried, in bytes: whole sectors, a partial sector
+# holding only audio, and one cut off part way through the subchannel
+SECTORS = 10
+SIZES = {
+	"aligned": SECTORS * cdgparse.SECTOR_SIZE,
+	"short": (SECTORS * cdgparse.SECTOR_SIZE) + 1000,
+	"truncated": (SECTORS * cdgparse.SECTOR_SIZE) + 2400,
+}
+
+# Track regions tried: (start offset, size). The last runs off the end
+# of every file.
+REGIONS = [
+	(0, SECTORS * cdgparse.SECTOR_SIZE),
+	(2 * cdgparse.SECTOR_SIZE, 3 * cdgparse.SECTOR_SIZE),
+	(cdgparse.SECTOR_SIZE, 100 * cdgparse.SECTOR_SIZE),
+]
+
+
+class BinReaderTest (unittest.TestCase):
+	def setUp (self):
+		self.tempdir = tempfile.mkdtemp()
+		rand = random.Random (1)
+		self.files = {}
+		for name, size in SIZES.items():
+			filename = os.path.join (self.tempdir, name + ".bin")
+			binfile = open (filename, "wb")
+			binfile.write (bytes (bytearray ([rand.randrange (256) for i in range (size)])))
+			binfile.close()
+			self.files[name] = filename
+
+	def tearDown (self):
+		shutil.rmtree (self.tempdir)
+
+	# Run a check on every file and region
+	def _EachRegion (self, check):
+		for name, filename in sorted (self.files.items()):
+			for start, size in REGIONS:
+				check (filename, start, size, "%s %d+%d" % (name, start, size))
+
+	def testBin2cdg (self):
+		def check (filename, start, size, what):
+			expected = _BaselineBin2cdg (filename, start, size)
+			self.assertEqual (cdgparse.bin2cdg (filename, start, size), expected, what)
+			image = cdgparse.BinImage (filename)
+			try:
+				self.assertEqual (cdgparse.bin2cdg (image, start, size), expected, what)
+				self.assertEqual (image.Region (start, size).Subchannel(), expected, what)
+			finally:
+				image.close()
+		self._EachRegion (check)
+
+	def testBin2pcm (self):
+		def check (filename, start, size, what):
+			expected = _BaselineBin2pcm (filename, start, size)
+			self.assertEqual (b"".join (cdgparse.bin2pcm (filename, start, size)), expected, what)
+			image = cdgparse.BinImage (filename)
+			try:
+				self.assertEqual (b"".join ([bytes (view) for view in cdgparse.bin2pcm (image, start, size)]),
+								  expected, what)
+			finally:
+				image.close()
+		self._EachRegion (check)
+
+	def testBin2pcmcdg (self):
+		def check (filename, start, size, what):
+			expected = (_BaselineBin2pcm (filename, start, size), _BaselineBin2cdg (filename, start, size))
+			pcmdata, cdgdata = cdgparse.bin2pcmcdg (filename, start, size)
+			self.assertEqual ((bytes (pcmdata), cdgdata), expected, what)
+			image = cdgparse.BinImage (filename)
+			try:
+				pcmdata, cdgdata = image.Region (start, size).Demux()
+				self.assertEqual ((bytes (pcmdata), cdgdata), expected, what)
+			finally:
+				image.close()
+		self._EachRegion (check)
+
+	def testChunkedReaders (self):
+		def check (filename, start, size, what):
+			pcmExpected = _BaselineBin2pcm (filename, start, size)
+			cdgExpected = _BaselineBin2cdg (filename, start, size)
+			for chunk in (1, 3, cdgparse.BLOCK_SECTORS):
+				self.assertEqual (b"".join (cdgparse.iter_cdg (filename, start, size, chunk)), cdgExpected, what)
+				self.assertEqual (b"".join (cdgparse.iter_pcm (filename, start, size, chunk)), pcmExpected, what)
+				chunks = list (cdgparse.iter_pcmcdg (filename, start, size, chunk))
+				self.assertEqual (b"".join ([pcm for pcm, cdg in chunks]), pcmExpected, what)
+				self.assertEqual (b"".join ([cdg for pcm, cdg in chunks]), cdgExpected, what)
+		self._EachRegion (check)
+
+	def testIterDisc (self):
+		for name, filename in sorted (self.files.items()):
+			starts = [start for start, size in REGIONS]
+			sizes = [size for start, size in REGIONS]
+			cdgdata = [[] for track in starts]
+			for track, pcmdata, cdgchunk in cdgparse.iter_disc (filename, starts, sizes, 2):
+				cdgdata[track].append (cdgchunk)
+			for track in range (len(starts)):
+				self.assertEqual (b"".join (cdgdata[track]),
+								  _BaselineBin2cdg (filename, starts[track], sizes[track]), name)
+
+	# Raw (interleaved) subchannel data, deinterleaved in one go and as
+	# it is read
+	def testDeinterleave (self):
+		def check (filename, start, size, what):
+			cdgdata = _BaselineBin2cdg (filename, start, size)
+			expected = _BaselineDeinterleave (cdgdata)
+			self.assertEqual (cdgparse.Deinterleave (cdgparse.bin2cdg (filename, start, size)), expected, what)
+			deinterleaver = cdgparse.Deinterleaver()
+			streamed = [deinterleaver.Feed (chunk) for chunk in cdgparse.iter_cdg (filename, start, size, 1)]
+			self.assertEqual (b"".join (streamed), expected, what)
+		self._EachRegion (check)
+
+
+if __name__ == "__main__":
+	unittest.main()
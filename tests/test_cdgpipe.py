@@ -0,0 +1,82 @@
+# cdgtools: Tests of the rip pipeline in cdgpipe
+
+import os, sys, random, shutil, tempfile, unittest
+import cdgparse, cdgpipe
+
+
+# Stand-in encoder, which copies the audio to the output file
+_ENCODER = "import sys; open (sys.argv[1], 'wb').write (sys.stdin.read())"
+
+TRACK_SECTORS = 6
+NAMES = ["one", "two", "three"]
+
+
+# OrderedLog which cancels the pipeline as a track is started
+class CancellingLog (cdgpipe.OrderedLog):
+	def __init__(self, name):
+		cdgpipe.OrderedLog.__init__(self, output = self.Keep)
+		self.name = name
+		self.pipeline = None
+		self.lines = []
+
+	def Keep (self, message):
+		self.lines.append (message)
+
+	def Log (self, seq, message):
+		if message == "-> Starting: %s" % self.name:
+			self.pipeline.Cancel()
+		cdgpipe.OrderedLog.Log (self, seq, message)
+
+
+class RipPipelineTest (unittest.TestCase):
+	def setUp (self):
+		self.tempdir = tempfile.mkdtemp()
+		self.binfilename = os.path.join (self.tempdir, "disc.bin")
+		rand = random.Random (1)
+		size = len(NAMES) * TRACK_SECTORS * cdgparse.SECTOR_SIZE
+		binfile = open (self.binfilename, "wb")
+		binfile.write (bytes (bytearray ([rand.randrange (256) for i in range (size)])))
+		binfile.close()
+		self.finished = []
+
+	def tearDown (self):
+		shutil.rmtree (self.tempdir)
+
+	def _Pipeline (self, log):
+		pipeline = cdgpipe.RipPipeline (self.binfilename, False, log = log, chunk_sectors = 1,
+										on_finished = self.finished.append)
+		for track in range (len(NAMES)):
+			path = os.path.join (self.tempdir, NAMES[track])
+			pipeline.AddTrack (track * TRACK_SECTORS * cdgparse.SECTOR_SIZE,
+							   TRACK_SECTORS * cdgparse.SECTOR_SIZE, path + ".cdg",
+							   [sys.executable, "-c", _ENCODER, path + ".pcm"], NAMES[track])
+		return (pipeline)
+
+	def testRun (self):
+		log = CancellingLog (None)
+		pipeline = self._Pipeline (log)
+		self.assertEqual (pipeline.Run(), [])
+		self.assertEqual (self.finished, [0, 1, 2])
+		for track in range (len(NAMES)):
+			start = track * TRACK_SECTORS * cdgparse.SECTOR_SIZE
+			size = TRACK_SECTORS * cdgparse.SECTOR_SIZE
+			path = os.path.join (self.tempdir, NAMES[track])
+			self.assertEqual (open (path + ".cdg", "rb").read(),
+							  cdgparse.bin2cdg (self.binfilename, start, size))
+			self.assertEqual (open (path + ".pcm", "rb").read(),
+							  b"".join (cdgparse.bin2pcm (self.binfilename, start, size)))
+
+	# A track cut short by a cancel is reported as cancelled, not finished
+	def testCancel (self):
+		log = CancellingLog ("two")
+		pipeline = self._Pipeline (log)
+		log.pipeline = pipeline
+		self.assertEqual (pipeline.Run(), ["two", "three"])
+		self.assertEqual (self.finished, [0])
+		self.assertTrue ("-> Finished: one" in log.lines)
+		self.assertTrue ("-> Cancelled: two" in log.lines)
+		self.assertFalse ("-> Finished: two" in log.lines)
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,69 @@
+# cdgtools: Tests of seeking with screen snapshots in cdgsnap
+
+import os, random, shutil, tempfile, unittest
+import cdgpacks, cdgrender, cdgsnap, cdgbench
+
+
+SECONDS = 20
+SECTORS_PER_SECOND = 75
+
+
+class SnapshotTest (unittest.TestCase):
+	def setUp (self):
+		self.tempdir = tempfile.mkdtemp()
+		self.cdgfilename = os.path.join (self.tempdir, "song.cdg")
+		cdgfile = open (self.cdgfilename, "wb")
+		cdgfile.write (cdgbench.MakeCdgStream (SECONDS * SECTORS_PER_SECOND, random.Random (1)))
+		cdgfile.close()
+		self.packs = cdgpacks.LoadFile (self.cdgfilename)
+		rand = random.Random (2)
+		self.positions = sorted ([rand.randrange (self.packs.count + 1) for i in range (50)] +
+								 [0, 1, self.packs.count])
+
+	def tearDown (self):
+		shutil.rmtree (self.tempdir)
+
+	# Check that seeking to each position gives the same screen as
+	# playing the file from the start
+	def _CheckSeeks (self, snapshots):
+		renderer = cdgrender.CdgRenderer()
+		commands = self.packs.Commands()
+		played = 0
+		for position in self.positions:
+			renderer.Play (self.packs, played, position, commands)
+			played = position
+			self.assertEqual (snapshots.SeekPack (position).State(), renderer.State(), position)
+
+	def testSeekPack (self):
+		snapshots = cdgsnap.CdgSnapshots (self.cdgfilename, 1, save = False)
+		self.assertTrue (len(snapshots) > SECONDS)
+		self._CheckSeeks (snapshots)
+
+	# Seeks reuse the renderer passed in
+	def testSeekIntoRenderer (self):
+		snapshots = cdgsnap.CdgSnapshots (self.cdgfilename, 1, save = False)
+		renderer = cdgrender.CdgRenderer()
+		for position in reversed (self.positions):
+			self.assertTrue (snapshots.SeekPack (position, renderer) is renderer)
+		self.assertEqual (renderer.State(), cdgrender.CdgRenderer().State())
+		self.assertEqual (snapshots.Seek (SECONDS * 2).State(), snapshots.SeekPack (self.packs.count).State())
+
+	# Saved snapshots are loaded back, and rebuilt once out of date
+	def testSaved (self):
+		built = cdgsnap.CdgSnapshots (self.cdgfilename, 1)
+		self.assertTrue (os.path.exists (cdgsnap.SnapshotName (self.cdgfilename)))
+		loaded = cdgsnap.CdgSnapshots (self.cdgfilename, 1)
+		self.assertEqual (loaded.positions, built.positions)
+		self._CheckSeeks (loaded)
+
+		cdgfile = open (self.cdgfilename, "ab")
+		cdgfile.write (b"\x00" * cdgpacks.PACK_SIZE)
+		cdgfile.close()
+		self.packs = cdgpacks.LoadFile (self.cdgfilename)
+		rebuilt = cdgsnap.CdgSnapshots (self.cdgfilename, 1)
+		self.assertEqual (rebuilt.count, self.packs.count)
+		self._CheckSeeks (rebuilt)
+
+
+if __name__ == "__main__":
+	unittest.main()